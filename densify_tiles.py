@@ -0,0 +1,6 @@
+#!/usr/bin/python
+
+import sys
+from dpg.tiles import main
+
+sys.exit(main())
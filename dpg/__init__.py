@@ -0,0 +1,3 @@
+"""
+Description: Support modules for the COLMAP/OpenMVG/OpenMVS pipeline scripts.
+"""
@@ -0,0 +1,443 @@
+"""
+Description: Resource-aware admission control for pipeline stages.
+
+Before a stage is launched its memory, CPU and GPU needs are estimated from
+the number and size of the input images and from the peak memory recorded
+for the same tool in earlier runs. The stage is only admitted when the live
+headroom reported by psutil (and GPUtil when present) covers the estimate;
+otherwise it waits. Admitted stages are written as reservation files in a
+host-wide folder guarded by a file lock, so pipeline processes running other
+scenes on the same machine see each other. A reservation counts in full until
+its process tree has actually grown to the estimated size.
+
+A stage is always admitted when nothing else is running, so an estimate
+larger than the machine never blocks a run forever.
+
+The cores are handed out the same way: an admitted stage gets the cores of
+the budget no other stage holds, but at least an even share of the budget
+among the running stages, and runs its tool with that many threads (see
+dpg.threads). Whenever a stage starts or ends, the running stages are pinned
+again to disjoint blocks of cores sized by their thread counts.
+"""
+
+import fcntl, json, logging, os, tempfile, threading, time, uuid
+import psutil
+
+from dpg.threads import (AFFINITY_SUPPORTED, available_cores, format_cores,
+                         pin_process_tree, place_cores)
+
+GB = 1024**3
+# Margin applied on top of the peak memory measured in earlier runs
+SAFETY_FACTOR = 1.2
+# Number of runs per tool kept in the history file
+HISTORY_LENGTH = 20
+# GPU memory of a new stage only shows up in GPUtil after the tool initialized
+GPU_RAMP_SECONDS = 30
+
+# Rough defaults used until a tool has history on this host:
+# [base memory GB, memory GB per input megapixel, CPU cores (0 for all), GPU memory GB]
+DEFAULT_PROFILES = {
+    "feature_extractor": [1.0, 0.01, 2, 1.5],
+    "exhaustive_matcher": [1.0, 0.005, 2, 1.5],
+    "sequential_matcher": [1.0, 0.005, 2, 1.5],
+    "vocab_tree_matcher": [2.0, 0.005, 2, 1.5],
+    "spatial_matcher": [1.0, 0.005, 2, 1.5],
+    "matches_importer": [1.0, 0.005, 2, 1.5],
+    "mapper": [1.0, 0.02, 0, 0],
+    "image_undistorter": [0.5, 0.005, 0, 0],
+    "model_converter": [0.5, 0.0, 1, 0],
+    "colmap_model": [0.5, 0.005, 1, 0],
+    "InterfaceCOLMAP": [0.5, 0.005, 1, 0],
+    "DensifyPointCloud": [2.0, 0.06, 0, 2.0],
+    "ReconstructMesh": [2.0, 0.06, 0, 0],
+    "RefineMesh": [1.0, 0.04, 0, 0],
+    "TextureMesh": [1.0, 0.03, 0, 0],
+    "preprocess_images": [0.5, 0.0, 0, 0],
+    "view_graph": [0.5, 0.005, 1, 0],
+    "partition_scene": [0.5, 0.005, 1, 0],
+    "model_merger": [1.0, 0.01, 1, 0],
+    "bundle_adjuster": [1.0, 0.02, 0, 0],
+    "update_scene": [0.5, 0.0, 1, 0],
+    "image_registrator": [1.0, 0.02, 0, 0],
+    "densify_tiles": [0.5, 0.0, 1, 0],
+    "openMVG_main_SfMInit_ImageListing": [0.5, 0.0, 1, 0],
+    "openMVG_main_ComputeFeatures": [1.0, 0.01, 0, 0],
+    "openMVG_main_PairGenerator": [0.5, 0.0, 1, 0],
+    "openMVG_main_ComputeMatches": [1.0, 0.005, 0, 0],
+    "openMVG_main_GeometricFilter": [1.0, 0.005, 0, 0],
+    "openMVG_main_SfM": [1.0, 0.02, 0, 0],
+    "openMVG_main_ComputeSfM_DataColor": [0.5, 0.005, 1, 0],
+    "openMVG_main_openMVG2openMVS": [0.5, 0.005, 0, 0],
+}
+DEFAULT_PROFILE = [1.0, 0.01, 0, 0]
+
+logger = logging.getLogger("GraphEngine")
+
+
+def stage_tool(command):
+    """
+    Description: Name of the tool a command runs, the subcommand for colmap, the script for python
+    """
+    command = list(map(str, command))
+    tool = os.path.basename(command[0])
+    if tool == "colmap" and len(command) > 1:
+        return command[1]
+    if tool.startswith("python") and len(command) > 1:
+        return os.path.splitext(os.path.basename(command[1]))[0]
+    return tool
+
+
+def process_tree_rss(pid):
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    rss = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+
+def process_created(pid):
+    """
+    Description: Start time of a process, None when it is gone
+    """
+    try:
+        return psutil.Process(pid).create_time()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+
+def same_process(pid, created):
+    """
+    Description: Whether a pid still belongs to the process started at created, and not
+                 to a later one that reused it
+    """
+    if not pid or created is None:
+        return False
+    current = process_created(pid)
+    # Start times have the resolution of the clock ticks
+    return current is not None and abs(current - created) < 0.01
+
+
+def gpu_free_memory():
+    """
+    Description: Free memory in bytes of the emptiest GPU, or None if GPUtil is missing or there is no GPU
+    """
+    try:
+        import GPUtil
+        gpus = GPUtil.getGPUs()
+    except ModuleNotFoundError:
+        return None
+    if not gpus:
+        return None
+    return max(gpu.memoryFree for gpu in gpus) * 1024 * 1024
+
+
+class Reservation:
+
+    def __init__(self, title, tool, megapixels, estimate):
+        self.id = "{0}-{1}".format(os.getpid(), uuid.uuid4().hex[:8])
+        self.title = title
+        self.tool = tool
+        self.megapixels = megapixels
+        self.mem = estimate["mem"]
+        self.cpus = estimate["cpus"]
+        self.gpu_mem = estimate["gpu_mem"]
+        # Set at admission when the controller hands out threads
+        self.threads = None
+        self.cores = []
+        self.pid = None
+        # Start times of the processes, telling them apart from later ones with the same pid
+        self.owner_created = process_created(os.getpid())
+        self.created = None
+        self.start = time.time()
+        self.peak_rss = 0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "owner": os.getpid(),
+            "owner_created": self.owner_created,
+            "pid": self.pid,
+            "created": self.created,
+            "title": self.title,
+            "mem": self.mem,
+            "cpus": self.cpus,
+            "gpu_mem": self.gpu_mem,
+            "threads": self.threads,
+            "cores": self.cores,
+            "start": self.start,
+        }
+
+
+class AdmissionController:
+    """
+    Description: Admit stages only when the host has room for them
+    Args:
+        state_dir: host-wide folder with the reservation files and the lock
+        history_path: json file with the peak memory of earlier runs per tool
+        poll_interval: seconds between two headroom checks while a stage waits
+        cpu_overcommit: how many times the cores may be handed out
+        cpu_budget: cores the stages of all the pipelines on the host share, None for all of them
+        thread_budget: hand every stage a thread count, False to let the tools use all cores
+        affinity: pin the running stages to disjoint blocks of cores
+    """
+
+    def __init__(self,
+                 state_dir=None,
+                 history_path=None,
+                 poll_interval=2.0,
+                 cpu_overcommit=2.0,
+                 cpu_budget=None,
+                 thread_budget=True,
+                 affinity=True):
+        self.state_dir = state_dir or os.path.join(tempfile.gettempdir(),
+                                                   "dpg_admission")
+        self.history_path = history_path or os.path.join(
+            os.path.expanduser("~"), ".cache", "dpg", "stage_history.json")
+        self.poll_interval = poll_interval
+        self.cpu_overcommit = cpu_overcommit
+        cores = available_cores()
+        self.cores = cores[:cpu_budget] if cpu_budget else cores
+        self.cpu_budget = len(self.cores)
+        self.thread_budget = thread_budget
+        self.affinity = affinity and thread_budget and AFFINITY_SUPPORTED
+        self.lock_path = os.path.join(self.state_dir, "lock")
+        self.active = {}
+        self.active_lock = threading.Lock()
+        self.sampler = None
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def host_lock(self):
+        file = open(self.lock_path, "a")
+        fcntl.flock(file, fcntl.LOCK_EX)
+        return file
+
+    def load_history(self):
+        try:
+            with open(self.history_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def estimate(self, command, megapixels):
+        """
+        Description: Estimate the resources a command needs
+        Args:
+            command: argv of the stage
+            megapixels: total megapixels of the scene images
+            return: dict with mem and gpu_mem in bytes, and cpus
+        """
+        tool = stage_tool(command)
+        base, per_megapixel, cpus, gpu = DEFAULT_PROFILES.get(
+            tool, DEFAULT_PROFILE)
+        mem = (base + per_megapixel * megapixels) * GB
+        runs = [run for run in self.load_history().get(tool, []) if run[0] > 0]
+        if runs:
+            # Scale the worst measured peak per megapixel to this scene
+            per_megapixel = max(peak / run_megapixels
+                                for run_megapixels, peak in runs)
+            mem = max(base * GB, per_megapixel * megapixels) * SAFETY_FACTOR
+        arguments = list(map(str, command))
+        for index, value in enumerate(arguments[:-1]):
+            if value.endswith(".use_gpu") and arguments[index + 1] == "0":
+                gpu = 0
+        return {
+            "mem": int(mem),
+            "cpus": min(cpus or self.cpu_budget, self.cpu_budget),
+            "gpu_mem": int(gpu * GB),
+        }
+
+    def live_reservations(self):
+        reservations = []
+        for name in os.listdir(self.state_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                with open(path) as file:
+                    reservation = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if "owner_created" in reservation:
+                alive = same_process(reservation["owner"],
+                                     reservation["owner_created"])
+            else:
+                # Written by an older version, without the start time
+                alive = psutil.pid_exists(reservation["owner"])
+            if not alive:
+                # Left behind by a pipeline that died, its pid may be in use again
+                os.remove(path)
+                continue
+            if not same_process(reservation["pid"], reservation.get("created")):
+                # The tool exited or its pid was reused, it is no process to measure or pin
+                reservation["pid"] = None
+            reservations.append(reservation)
+        return reservations
+
+    def fits(self, reservation, others):
+        if not others:
+            return True
+        # Memory the running stages are still expected to grow into
+        pending = sum(
+            max(0, other["mem"] -
+                (process_tree_rss(other["pid"]) if other["pid"] else 0))
+            for other in others)
+        available = psutil.virtual_memory().available - pending
+        if reservation.mem > available:
+            return False
+        cpus = sum(other["cpus"] for other in others) + reservation.cpus
+        if cpus > self.cpu_budget * self.cpu_overcommit:
+            return False
+        if reservation.gpu_mem > 0:
+            free = gpu_free_memory()
+            if free is not None:
+                now = time.time()
+                free -= sum(other["gpu_mem"] for other in others
+                            if now - other["start"] < GPU_RAMP_SECONDS)
+                if reservation.gpu_mem > free:
+                    return False
+        return True
+
+    def admit(self, title, command, megapixels):
+        """
+        Description: Block until the host has room for the stage, then reserve it
+        Args:
+            title: stage title
+            command: argv of the stage
+            megapixels: total megapixels of the scene images
+            return: the Reservation, to pass to attach and release
+        """
+        reservation = Reservation(title, stage_tool(command), megapixels,
+                                  self.estimate(command, megapixels))
+        waiting = False
+        while True:
+            with self.host_lock():
+                others = self.live_reservations()
+                if self.thread_budget:
+                    self.assign_threads(reservation, others)
+                if self.fits(reservation, others):
+                    reservation.start = time.time()
+                    self.write(reservation)
+                    with self.active_lock:
+                        self.active[reservation.id] = reservation
+                    self.place()
+                    break
+            if not waiting:
+                waiting = True
+                logger.info(
+                    "Waiting for resources for {0}: {1:.1f}GB RAM, {2} cores, {3:.1f}GB GPU"
+                    .format(title, reservation.mem / GB, reservation.cpus,
+                            reservation.gpu_mem / GB))
+            time.sleep(self.poll_interval)
+        if reservation.threads:
+            logger.info("{0}: {1} threads{2}".format(
+                title, reservation.threads,
+                " on cores " + format_cores(reservation.cores)
+                if self.affinity else ""))
+        return reservation
+
+    def assign_threads(self, reservation, others):
+        """
+        Description: Number of threads of a stage, from the cores the running stages hold
+        """
+        if DEFAULT_PROFILES.get(reservation.tool, DEFAULT_PROFILE)[2] == 1:
+            # Single-threaded tools
+            threads = 1
+        else:
+            free = self.cpu_budget - sum(other["cpus"] for other in others)
+            share = self.cpu_budget // (len(others) + 1)
+            threads = min(self.cpu_budget, max(1, free, share))
+        reservation.threads = threads
+        reservation.cpus = threads
+
+    def place(self):
+        """
+        Description: Pin the running stages to disjoint blocks of cores, with the host lock held
+        """
+        if not self.affinity:
+            return
+        reservations = sorted(
+            (reservation for reservation in self.live_reservations()
+             if reservation.get("threads")),
+            key=lambda reservation: reservation["start"])
+        blocks = place_cores(
+            [reservation["threads"] for reservation in reservations],
+            self.cores)
+        for reservation, cores in zip(reservations, blocks):
+            if reservation.get("cores") != cores:
+                reservation["cores"] = cores
+                self.write_dict(reservation)
+            with self.active_lock:
+                if reservation["id"] in self.active:
+                    self.active[reservation["id"]].cores = cores
+            if reservation["pid"]:
+                pin_process_tree(reservation["pid"], cores)
+
+    def write(self, reservation):
+        self.write_dict(reservation.to_dict())
+
+    def write_dict(self, data):
+        path = os.path.join(self.state_dir, data["id"] + ".json")
+        with open(path + ".tmp", "w") as file:
+            json.dump(data, file)
+        os.replace(path + ".tmp", path)
+
+    def attach(self, reservation, pid):
+        """
+        Description: Link a reservation to the process that was started for it
+        """
+        reservation.pid = pid
+        reservation.created = process_created(pid)
+        with self.host_lock():
+            self.write(reservation)
+            self.place()
+        with self.active_lock:
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample,
+                                                daemon=True)
+                self.sampler.start()
+
+    def sample(self):
+        while True:
+            with self.active_lock:
+                reservations = list(self.active.values())
+                if not reservations:
+                    # Started again by the next attach, a controller per run leaves no thread behind
+                    self.sampler = None
+                    return
+            for reservation in reservations:
+                if reservation.pid:
+                    reservation.peak_rss = max(
+                        reservation.peak_rss,
+                        process_tree_rss(reservation.pid))
+            time.sleep(self.poll_interval)
+
+    def release(self, reservation, success=True):
+        """
+        Description: Drop a reservation, recording its peak memory when the stage succeeded
+        """
+        with self.active_lock:
+            self.active.pop(reservation.id, None)
+        with self.host_lock():
+            try:
+                os.remove(
+                    os.path.join(self.state_dir, reservation.id + ".json"))
+            except FileNotFoundError:
+                pass
+            # The cores of the stage go back to the ones still running
+            self.place()
+            if success and reservation.peak_rss > 0 and reservation.megapixels > 0:
+                history = self.load_history()
+                runs = history.setdefault(reservation.tool, [])
+                runs.append([reservation.megapixels, reservation.peak_rss])
+                del runs[:-HISTORY_LENGTH]
+                os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+                with open(self.history_path + ".tmp", "w") as file:
+                    json.dump(history, file)
+                os.replace(self.history_path + ".tmp", self.history_path)
@@ -0,0 +1,270 @@
+"""
+Description: Batch mode, run many scene folders through the pipeline with a bounded worker pool.
+
+Every scene runs in its own pipeline process, so a crash or a GPU pinned with
+CUDA_VISIBLE_DEVICES stays with its scene; services running many scenes in one
+process use dpg.pipeline directly. Each scene gets its own output folder, and
+the process is started from that folder so its GraphEngine log lands there,
+next to a console.log with everything the process printed. With --queue-dir the
+scene processes are shipped to the workers of a shared job queue instead.
+
+Usage:
+    batch_pipeline.py [batch options] scene_dir_or_glob ... -- [pipeline options]
+"""
+
+import argparse, glob, itertools, logging, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+from tabulate import tabulate
+
+from dpg.executor import LocalExecutor, QueueExecutor
+from dpg.host import cached_hardware
+
+PIPELINE_SCRIPTS = ["COLMAP_MVS_pipeline.py", "colmap_mvs_pipeline.py"]
+
+logger = logging.getLogger("GraphEngine")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Run the COLMAP/OpenMVS pipeline on many scenes")
+    parser.add_argument("scenes",
+                        nargs="*",
+                        help="Scene folders or glob patterns")
+    parser.add_argument("--scene-list",
+                        type=str,
+                        help="File with one scene folder or glob per line")
+    parser.add_argument(
+        "--output-root",
+        type=str,
+        help=
+        "Folder receiving one output folder per scene, named after the scene folder and its parents when names clash. Default: <scene>/output",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of scenes processed at the same time. Default: derived from the budgets below",
+    )
+    parser.add_argument("--cpus-per-scene",
+                        type=int,
+                        default=4,
+                        help="CPU cores budgeted per scene. Default: 4")
+    parser.add_argument(
+        "--mem-per-scene",
+        type=float,
+        default=8.0,
+        help="RAM in GB budgeted per scene (DensifyPointCloud peaks around 8 GB on 49 images). Default: 8",
+    )
+    parser.add_argument(
+        "--scenes-per-gpu",
+        type=int,
+        default=1,
+        help="Scenes sharing one GPU, ignored when no GPU is found. Default: 1",
+    )
+    parser.add_argument(
+        "--queue-dir",
+        type=str,
+        help="Run the scenes on the workers of this shared job queue (see queue_worker.py) instead of locally",
+    )
+    parser.add_argument("--pipeline",
+                        type=str,
+                        help="Pipeline script to run for each scene")
+    return parser
+
+
+def find_scenes(patterns):
+    """
+    Description: Expand scene folders and glob patterns, keeping order and dropping duplicates
+    """
+    scenes = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.expanduser(pattern))) or [pattern]
+        for match in matches:
+            path = os.path.abspath(match)
+            if os.path.isdir(path) and path not in scenes:
+                scenes.append(path)
+            elif not os.path.isdir(path):
+                logger.warning("Skipping {0}: not a folder".format(match))
+    return scenes
+
+
+def gpu_count_available():
+    return len(cached_hardware().get("gpus", []))
+
+
+def pool_size(cpus_per_scene, mem_per_scene, scenes_per_gpu, gpu_count):
+    """
+    Description: Number of scenes the machine can run at once within its CPU, RAM and GPU budget
+    """
+    by_cpu = (psutil.cpu_count() or 1) // max(1, cpus_per_scene)
+    by_mem = int(psutil.virtual_memory().total / (1024**3) /
+                 max(mem_per_scene, 0.1))
+    limits = [by_cpu, by_mem]
+    if gpu_count > 0:
+        limits.append(gpu_count * max(1, scenes_per_gpu))
+    return max(1, min(limits))
+
+
+def default_pipeline():
+    folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in PIPELINE_SCRIPTS:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(folder, PIPELINE_SCRIPTS[0])
+
+
+def scene_outputs(scenes, output_root):
+    """
+    Description: Output folder of every scene
+    Args:
+        scenes: list of absolute scene folders
+        output_root: folder receiving the per-scene output folders, or None for <scene>/output
+        return: dict scene -> output folder. Under output_root a scene is named after its
+                folder, with as many parent folders as it takes to tell it from the
+                other scenes, e.g. a_site1 and b_site1 for /a/site1 and /b/site1
+    """
+    if not output_root:
+        return {scene: os.path.join(scene, "output") for scene in scenes}
+    parts = {
+        scene: [part for part in scene.split(os.sep) if part]
+        for scene in scenes
+    }
+    depths = {scene: 1 for scene in scenes}
+    while True:
+        names = {
+            scene: "_".join(parts[scene][-depths[scene]:])
+            for scene in scenes
+        }
+        clashing = [
+            scene for scene in scenes
+            if list(names.values()).count(names[scene]) > 1
+            and depths[scene] < len(parts[scene])
+        ]
+        if not clashing:
+            break
+        for scene in clashing:
+            depths[scene] += 1
+    return {
+        scene: os.path.join(os.path.abspath(output_root), names[scene])
+        for scene in scenes
+    }
+
+
+def run_scene(pipeline, scene, output, pipeline_args, gpu=None,
+              executor=None):
+    """
+    Description: Run the pipeline on one scene in its own process
+    Args:
+        pipeline: path of the pipeline script
+        scene: scene folder, passed as --input
+        output: scene output folder, also the working directory of the process
+        pipeline_args: extra arguments forwarded to the pipeline
+        gpu: index of the GPU the scene is pinned to, or None
+        executor: LocalExecutor (default) or QueueExecutor running the pipeline process
+        return: exit code of the pipeline
+    """
+    os.makedirs(output, exist_ok=True)
+    env = {}
+    if gpu is not None:
+        env["CUDA_VISIBLE_DEVICES"] = str(gpu)
+    cmd = [sys.executable, pipeline, "--input", scene, "--output", output
+           ] + pipeline_args
+    with open(os.path.join(output, "console.log"), "w") as console:
+
+        def write(line):
+            console.write(line + "\n")
+            console.flush()
+
+        return (executor or LocalExecutor()).run(
+            cmd,
+            write,
+            cwd=output,
+            env=env,
+            job={"title": "scene {0}".format(os.path.basename(scene))})
+
+
+def run_batch(scenes,
+              pipeline_args,
+              workers,
+              output_root=None,
+              pipeline=None,
+              gpu_count=0,
+              executor=None):
+    """
+    Description: Run every scene through the pipeline, at most workers at a time
+    Args:
+        scenes: list of scene folders
+        pipeline_args: arguments forwarded to every pipeline run
+        workers: size of the pool
+        output_root: folder receiving the per-scene output folders, or None
+        pipeline: pipeline script, defaults to the one next to the dpg package
+        gpu_count: number of GPUs to spread scenes over
+        executor: runs the pipeline processes, LocalExecutor when None
+        return: list of [scene, exit code, seconds]
+    """
+    pipeline = pipeline or default_pipeline()
+    # Scenes are handed a GPU round robin when they start
+    gpus = itertools.cycle(range(gpu_count)) if gpu_count > 0 else None
+    gpu_lock = threading.Lock()
+    results = {}
+    outputs = scene_outputs(scenes, output_root)
+
+    def process(scene):
+        with gpu_lock:
+            gpu = next(gpus) if gpus is not None else None
+        output = outputs[scene]
+        print("Starting {0}".format(scene), flush=True)
+        logger.info("Starting {0} -> {1}".format(scene, output))
+        start_time = time.time()
+        rc = run_scene(pipeline, scene, output, pipeline_args, gpu, executor)
+        seconds = int(time.time() - start_time)
+        status = "done" if rc == 0 else "failed ({0})".format(rc)
+        print("Finished {0}: {1} in {2}s".format(scene, status, seconds),
+              flush=True)
+        logger.info("Finished {0}: {1} in {2}s".format(scene, status,
+                                                      seconds))
+        results[scene] = [scene, rc, seconds]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(process, scenes))
+    return [results[scene] for scene in scenes]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    pipeline_args = []
+    if "--" in argv:
+        pipeline_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = create_parser().parse_args(argv)
+
+    patterns = list(args.scenes)
+    if args.scene_list:
+        with open(args.scene_list) as file:
+            patterns += [line.strip() for line in file if line.strip()]
+    scenes = find_scenes(patterns)
+    if not scenes:
+        print("No scene folders found")
+        return 1
+
+    executor = None
+    gpu_count = gpu_count_available()
+    workers = args.workers or pool_size(args.cpus_per_scene,
+                                        args.mem_per_scene,
+                                        args.scenes_per_gpu, gpu_count)
+    if args.queue_dir:
+        # The workers own the hardware, every scene is queued at once
+        executor = QueueExecutor(args.queue_dir)
+        gpu_count = 0
+        workers = args.workers or len(scenes)
+    print("Processing {0} scenes with {1} workers".format(
+        len(scenes), workers))
+    results = run_batch(scenes, pipeline_args, workers, args.output_root,
+                        args.pipeline, gpu_count, executor)
+    print(tabulate(results, headers=["Scene", "Exit code", "Time (s)"]))
+    return 0 if all(result[1] == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
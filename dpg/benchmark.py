@@ -0,0 +1,211 @@
+"""
+Description: Benchmark the throughput of the pipeline with several scenes running at once.
+
+For every concurrency level, that many copies of one scene run through the
+pipeline at the same time, each in its own pipeline process, all sharing one
+admission folder so they split the CPU budget between them. The copies only
+link the images of the scene, so every run starts from scratch. With
+--compare every level runs a second time with --no-thread-budget, where each
+tool starts one thread per core as it does on its own.
+
+    concurrency   scenes running at the same time
+    wall          seconds from the first start to the last end
+    scenes/h      scenes finished per hour at that concurrency
+    speedup       scenes/h over the scenes/h of one scene at a time
+    cpu           average use of all the cores of the host
+
+Usage:
+    benchmark_pipeline.py --scene scene_dir [--concurrency 1 2 4] [--compare] -- [pipeline options]
+"""
+
+import argparse, json, logging, os, shutil, sys, tempfile, time
+import psutil
+from tabulate import tabulate
+
+from dpg.batch import run_batch
+from dpg.images import list_images
+
+CONCURRENCY = [1, 2, 4]
+
+logger = logging.getLogger("GraphEngine")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure the pipeline throughput at several numbers of concurrent scenes")
+    parser.add_argument("--scene",
+                        type=str,
+                        required=True,
+                        help="Scene folder holding the images in images/, or the images folder itself")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=CONCURRENCY,
+        help="Numbers of scenes run at the same time. Default: 1 2 4",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Also run every level with --no-thread-budget, the tools using all cores each",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        help="Folder receiving the scene copies, in budgeted_<N> and unbudgeted_<N> folders removed afterwards. Default: a temporary folder",
+    )
+    parser.add_argument("--keep",
+                        action="store_true",
+                        help="Keep the scene copies and their outputs")
+    parser.add_argument("--json",
+                        type=str,
+                        help="Also write the results to this JSON file")
+    parser.add_argument("--pipeline",
+                        type=str,
+                        help="Pipeline script to run for each scene")
+    return parser
+
+
+def copy_scene(scene, folder):
+    """
+    Description: Scene folder linking the images of another one
+    Args:
+        scene: scene folder, or the images folder itself
+        folder: new scene folder
+        return: folder
+    """
+    images = os.path.join(scene, "images")
+    if not os.path.isdir(images):
+        images = scene
+    os.makedirs(os.path.join(folder, "images"))
+    for path in list_images(images):
+        os.symlink(os.path.abspath(path),
+                   os.path.join(folder, "images", os.path.basename(path)))
+    return folder
+
+
+def level_folder(work_dir, budgeted, concurrency):
+    return os.path.join(
+        work_dir, "{0}_{1}".format("budgeted" if budgeted else "unbudgeted",
+                                   concurrency))
+
+
+def run_level(scene, concurrency, budgeted, pipeline_args, work_dir,
+              pipeline=None):
+    """
+    Description: Run copies of a scene at the same time and time them
+    Args:
+        scene: scene folder
+        concurrency: number of copies
+        budgeted: False to run the tools with --no-thread-budget
+        pipeline_args: arguments forwarded to every pipeline run
+        work_dir: folder receiving the copies
+        pipeline: pipeline script, see dpg.batch.run_batch
+        return: dict with mode, concurrency, failed, wall seconds, scenes_per_hour and cpu_percent
+    """
+    mode = "budgeted" if budgeted else "unbudgeted"
+    level_dir = level_folder(work_dir, budgeted, concurrency)
+    scenes = [
+        copy_scene(scene, os.path.join(level_dir, "scene_{0}".format(index)))
+        for index in range(concurrency)
+    ]
+    # A fresh admission folder, so nothing left over from another level holds cores
+    arguments = pipeline_args + [
+        "--admission-dir",
+        os.path.join(level_dir, "admission")
+    ]
+    if not budgeted:
+        arguments.append("--no-thread-budget")
+    psutil.cpu_percent()
+    start_time = time.time()
+    results = run_batch(scenes, arguments, concurrency, pipeline=pipeline)
+    seconds = time.time() - start_time
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "failed": sum(1 for result in results if result[1] != 0),
+        "seconds": seconds,
+        "scenes_per_hour": concurrency * 3600.0 / max(seconds, 1e-6),
+        "cpu_percent": psutil.cpu_percent(),
+    }
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    pipeline_args = []
+    if "--" in argv:
+        pipeline_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = create_parser().parse_args(argv)
+    scene = os.path.abspath(args.scene)
+    if not os.path.isdir(scene):
+        print("Scene folder not found: {0}".format(scene))
+        return 1
+    modes = [True, False] if args.compare else [True]
+    runs = [(budgeted, concurrency) for budgeted in modes
+            for concurrency in dict.fromkeys(args.concurrency)]
+    if args.work_dir:
+        work_dir = os.path.abspath(args.work_dir)
+        existing = [
+            level_folder(work_dir, budgeted, concurrency)
+            for budgeted, concurrency in runs
+            if os.path.exists(level_folder(work_dir, budgeted, concurrency))
+        ]
+        if existing:
+            print("Remove the folders of an earlier benchmark first: {0}".
+                  format(", ".join(existing)))
+            return 1
+        os.makedirs(work_dir, exist_ok=True)
+    else:
+        work_dir = tempfile.mkdtemp(prefix="dpg_benchmark_")
+
+    levels = []
+    try:
+        for budgeted, concurrency in runs:
+            print("Running {0} scene(s) at once{1}".format(
+                concurrency, "" if budgeted else " without thread budget"),
+                  flush=True)
+            levels.append(
+                run_level(scene, concurrency, budgeted, pipeline_args,
+                          work_dir, args.pipeline))
+    finally:
+        if not args.keep:
+            # Only what the benchmark created, --work-dir may hold other files
+            if args.work_dir:
+                for budgeted, concurrency in runs:
+                    shutil.rmtree(level_folder(work_dir, budgeted,
+                                               concurrency),
+                                  ignore_errors=True)
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    rows = []
+    for level in levels:
+        single = [
+            other for other in levels
+            if other["mode"] == level["mode"] and other["concurrency"] == 1
+        ]
+        level["speedup"] = level["scenes_per_hour"] / single[0][
+            "scenes_per_hour"] if single else None
+        rows.append([
+            level["mode"], level["concurrency"],
+            "{0:.1f}".format(level["seconds"]),
+            "{0:.2f}".format(level["scenes_per_hour"]),
+            "-" if level["speedup"] is None else "{0:.2f}x".format(
+                level["speedup"]), "{0:.0f}%".format(level["cpu_percent"]),
+            level["failed"]
+        ])
+    print(
+        tabulate(rows,
+                 headers=[
+                     "Mode", "Concurrency", "Wall (s)", "Scenes/h", "Speedup",
+                     "CPU", "Failed"
+                 ]))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"scene": scene, "levels": levels}, file, indent=1)
+    return 0 if all(level["failed"] == 0 for level in levels) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Description: Content-addressed cache of pipeline stages.
+
+A stage is identified by its title. Its key is built from the command line,
+the content of the tool binary and the content of the declared input
+artifacts. After a successful run the hashes of the declared output artifacts
+are written to a manifest, so on the next run a stage whose key and outputs
+are unchanged can be skipped. Because downstream stages hash the outputs of
+upstream stages, changing one flag only re-executes that stage and whatever
+depends on what it produced.
+
+Command dicts opt in by declaring "inputs" and "outputs" lists of paths next
+to "title" and "command". Stages without outputs are always executed. The
+helper stages run a python script of this repository, whose logic lives in
+the dpg package, so their key also covers the script and the package sources.
+"""
+
+import hashlib, json, logging, os, shutil, sys
+
+CHUNK_SIZE = 1024 * 1024
+# Sources the python helper stages run
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("GraphEngine")
+
+
+def load_json(path, default):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def dump_json(path, data):
+    """
+    Description: Write json atomically, so an interrupted run never leaves a truncated manifest
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_python(binary):
+    return binary == sys.executable or os.path.basename(binary).startswith(
+        "python")
+
+
+class FileIndex:
+    """
+    Description: Content hashes of files, re-read only when their size or mtime changed
+    Args:
+        index_path: json file keeping path -> [size, mtime_ns, sha256]
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.index = load_json(index_path, {})
+
+    def hash_file(self, path):
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        entry = self.index.get(path)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        self.index[path] = stamp + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        dump_json(self.index_path, self.index)
+
+
+class StageCache:
+    """
+    Description: Manifest of stage keys and output hashes, stored in cache_dir
+    Args:
+        cache_dir: directory holding manifest.json and the file hash index
+        package_dir: python package the helper scripts import, part of their signature
+    """
+
+    def __init__(self, cache_dir, package_dir=PACKAGE_DIR):
+        self.cache_dir = cache_dir
+        self.package_dir = package_dir
+        self.package_hash = None
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.manifest = load_json(self.manifest_path, {
+            "stages": {},
+            "derived": {}
+        })
+        # Unchanged files are never re-read
+        self.files = FileIndex(os.path.join(cache_dir, "file_index.json"))
+
+    def hash_file(self, path):
+        return self.files.hash_file(path)
+
+    def hash_path(self, path):
+        """
+        Description: Hash a file, or a directory recursively by relative names and file contents
+        Args:
+            path: file or directory
+            return: hex digest, or None if the path does not exist
+        """
+        if os.path.isfile(path):
+            return self.hash_file(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                relative = os.path.relpath(file_path, path)
+                digest.update(
+                    "{0}\0{1}\n".format(relative,
+                                       self.hash_file(file_path)).encode())
+        return digest.hexdigest()
+
+    def hash_paths(self, paths):
+        return {str(path): self.hash_path(str(path)) for path in paths}
+
+    def hash_package(self):
+        """
+        Description: Hash of the .py files of the package, computed once per cache
+        """
+        if self.package_hash is None:
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(self.package_dir):
+                dirs[:] = sorted(name for name in dirs
+                                 if name != "__pycache__")
+                for name in sorted(files):
+                    if not name.endswith(".py"):
+                        continue
+                    path = os.path.join(root, name)
+                    digest.update("{0}\0{1}\n".format(
+                        os.path.relpath(path, self.package_dir),
+                        self.hash_file(path)).encode())
+            self.package_hash = digest.hexdigest()
+        return self.package_hash
+
+    def signature(self, instruction):
+        """
+        Description: Hash of the command line and of the binary it launches, plus the
+                     script and the package sources for python helper stages
+        """
+        command = list(map(str, instruction["command"]))
+        binary = command[0]
+        if not os.path.isfile(binary):
+            binary = shutil.which(binary) or binary
+        hashes = [self.hash_path(binary)]
+        if is_python(command[0]) and len(command) > 1:
+            hashes += [self.hash_path(command[1]), self.hash_package()]
+        payload = json.dumps([command] + hashes)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def snapshot_inputs(self, instruction):
+        """
+        Description: Hash the inputs of a stage, to be called right before running it
+        """
+        return self.hash_paths(instruction.get("inputs", []))
+
+    def is_fresh(self, instruction):
+        """
+        Description: Check whether a stage can be skipped
+        Args:
+            instruction: command dict with "title", "command", "inputs" and "outputs"
+            return: True if the key matches the manifest and the recorded outputs are intact
+        """
+        outputs = list(map(str, instruction.get("outputs", [])))
+        entry = self.manifest["stages"].get(instruction["title"])
+        if not outputs or entry is None:
+            return False
+        if entry["signature"] != self.signature(instruction):
+            return False
+        inputs = list(map(str, instruction.get("inputs", [])))
+        if sorted(inputs) != sorted(entry["inputs"]) or sorted(
+                outputs) != sorted(entry["outputs"]):
+            return False
+        # A path that is both input and output (e.g. database.db) is updated in place,
+        # so it is compared against the state the stage left it in
+        for path in inputs:
+            if path not in outputs and self.hash_path(
+                    path) != entry["inputs"][path]:
+                return False
+        for path in outputs:
+            recorded = entry["outputs"][path]
+            if recorded is None or not self.derives_from(
+                    self.hash_path(path), recorded):
+                return False
+        return True
+
+    def derives_from(self, current, recorded):
+        """
+        Description: Check whether a file state is, or was produced in place from, a recorded state
+        Args:
+            current: hash of the file now
+            recorded: hash the file had when a stage finished
+            return: True if later stages only updated the file on top of the recorded state
+        """
+        seen = set()
+        while current is not None and current not in seen:
+            if current == recorded:
+                return True
+            seen.add(current)
+            current = self.manifest["derived"].get(current)
+        return False
+
+    def record(self, instruction, input_hashes):
+        """
+        Description: Store the key and output hashes of a stage that just succeeded
+        Args:
+            instruction: command dict that was executed
+            input_hashes: result of snapshot_inputs taken before the run
+        """
+        if not instruction.get("outputs"):
+            return
+        output_hashes = self.hash_paths(instruction["outputs"])
+        self.manifest["stages"][instruction["title"]] = {
+            "signature": self.signature(instruction),
+            "command": list(map(str, instruction["command"])),
+            "inputs": input_hashes,
+            "outputs": output_hashes,
+        }
+        # Remember in-place updates (e.g. the matcher writing into database.db),
+        # so the stage that created the file still sees its output as intact
+        for path, before in input_hashes.items():
+            after = output_hashes.get(path)
+            if before is not None and after is not None and before != after:
+                self.manifest["derived"][after] = before
+        self.save()
+
+    def invalidate(self, title):
+        if self.manifest["stages"].pop(title, None) is not None:
+            self.save()
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        dump_json(self.manifest_path, self.manifest)
+        self.files.save()
@@ -0,0 +1,114 @@
+"""
+Description: Persisted run state, so a failed run can resume at the stage that failed.
+
+The state file lists every stage of the last runs with its status and, for
+completed stages, the signature of the command and the checksums of its
+declared outputs. With --resume the pipeline leaves out the stages that
+completed with the same command and whose outputs are still intact; --from-stage and --to-stage cut the stage list explicitly.
+"""
+
+import datetime, json, os, sys
+
+from dpg.admission import stage_tool
+
+
+class RunState:
+    """
+    Description: Status of every stage, stored in a json file
+    Args:
+        path: state file
+        cache: StageCache used to hash the output artifacts
+    """
+
+    def __init__(self, path, cache):
+        self.path = path
+        self.cache = cache
+        try:
+            with open(path) as file:
+                self.data = json.load(file)
+        except (OSError, ValueError):
+            self.data = {"stages": {}}
+
+    def start_run(self, commands, argv=None):
+        """
+        Description: Forget the state of the stages about to run, they are not complete until they finish again
+        Args:
+            commands: command dicts about to run
+            argv: command line of the run, sys.argv by default
+        """
+        self.data["argv"] = list(argv if argv is not None else sys.argv)
+        self.data["started_at"] = datetime.datetime.now().isoformat()
+        for instruction in commands:
+            self.data["stages"][instruction["title"]] = {"status": "pending"}
+        self.save()
+
+    def completed(self, instruction):
+        """
+        Description: Check whether a stage completed with the same command and its outputs are unchanged since then
+        """
+        entry = self.data["stages"].get(instruction["title"])
+        if entry is None or entry["status"] != "completed":
+            return False
+        # Changed options or a rebuilt binary run the stage again, as in StageCache.is_fresh
+        if entry.get("signature") != self.cache.signature(instruction):
+            return False
+        for path, recorded in entry["outputs"].items():
+            # Outputs updated in place by later stages (database.db) still count as intact
+            if recorded is None or not self.cache.derives_from(
+                    self.cache.hash_path(path), recorded):
+                return False
+        return True
+
+    def mark(self, instruction, status):
+        """
+        Description: Record the outcome of a stage
+        Args:
+            instruction: command dict of the stage
+            status: "completed" or "failed"
+        """
+        entry = {
+            "status": status,
+            "finished_at": datetime.datetime.now().isoformat(),
+            "outputs": {},
+        }
+        if status == "completed":
+            entry["signature"] = self.cache.signature(instruction)
+            entry["outputs"] = self.cache.hash_paths(
+                instruction.get("outputs", []))
+        self.data["stages"][instruction["title"]] = entry
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as file:
+            json.dump(self.data, file, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def stage_index(commands, name):
+    """
+    Description: Find a stage by title or by tool name (e.g. "RefineMesh", "mapper"), ignoring case
+    Args:
+        commands: list of command dicts
+        name: title or tool name
+        return: index of the first matching stage
+    """
+    wanted = name.lower()
+    for index, instruction in enumerate(commands):
+        if instruction["title"].lower() == wanted or stage_tool(
+                instruction["command"]).lower() == wanted:
+            return index
+    raise ValueError("Unknown stage '{0}', available stages: {1}".format(
+        name, ", ".join(instruction["title"] for instruction in commands)))
+
+
+def select_stages(commands, from_stage=None, to_stage=None):
+    """
+    Description: Keep the stages between from_stage and to_stage, both included
+    """
+    start = stage_index(commands, from_stage) if from_stage else 0
+    end = stage_index(commands, to_stage) + 1 if to_stage else len(commands)
+    if start >= end:
+        raise ValueError("--from-stage {0} comes after --to-stage {1}".format(
+            from_stage, to_stage))
+    return commands[start:end]
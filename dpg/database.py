@@ -0,0 +1,339 @@
+"""
+Description: Reader for the COLMAP database.db and pre-flight analysis of its match graph.
+
+The blob columns (keypoints, inlier matches of the two-view geometries) are
+decoded in one pass: the blobs are joined and read with a single
+numpy.frombuffer, then split by their row counts. The analysis only reads the
+inlier matches of the pairs of weakly connected images, the other blobs stay
+on disk. The view graph links two
+images when their verified geometry has at least min_inliers inlier matches,
+the same threshold the mapper applies (--Mapper.min_num_matches, 15 by
+default). Its connected components are the models the mapper can at best
+produce; images with few neighbors are likely to stay unregistered.
+
+Usage:
+    view_graph.py --database database.db [--output view_graph.json] [--min-component-ratio 0.9]
+"""
+
+import argparse, json, os, sqlite3, sys, urllib.parse
+import numpy as np
+from tabulate import tabulate
+
+# COLMAP encodes an image pair as image_id1 * MAX_IMAGE_ID + image_id2
+MAX_IMAGE_ID = 2**31 - 1
+# two_view_geometries.config values of pairs the mapper cannot use
+DEGENERATE_CONFIGS = (0, 1)
+MIN_INLIERS = 15
+# Images with fewer verified neighbors than this are reported as weakly connected
+WEAK_DEGREE = 3
+# Pair ids per query, below the SQLite limit of bound parameters
+QUERY_PAIRS = 500
+
+
+def connect(path):
+    """
+    Description: Open a database read-only, the file is never modified
+    """
+    # Quoted, so a ? # or % in the path is not read as part of the URI
+    return sqlite3.connect("file:{0}?mode=ro".format(
+        urllib.parse.quote(os.path.abspath(path))),
+                           uri=True)
+
+
+def pair_ids_to_images(pair_ids):
+    """
+    Description: Decode COLMAP pair ids
+    Args:
+        pair_ids: int64 array of pair ids
+        return: (image_id1 array, image_id2 array)
+    """
+    pair_ids = np.asarray(pair_ids, dtype=np.int64)
+    return pair_ids // MAX_IMAGE_ID, pair_ids % MAX_IMAGE_ID
+
+
+def decode_blobs(rows, cols, blobs, dtype):
+    """
+    Description: Decode a blob column with a single frombuffer
+    Args:
+        rows: row count of every blob
+        cols: column count, the same for every blob of the table
+        blobs: list of bytes, None for empty entries
+        dtype: numpy type of the values
+        return: (values of all blobs stacked as a rows x cols array, offsets of each blob)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    data = np.frombuffer(b"".join(blob or b"" for blob in blobs), dtype=dtype)
+    offsets = np.concatenate(([0], np.cumsum(rows)))
+    return data.reshape(-1, cols) if cols else data, offsets
+
+
+def read_images(db):
+    """
+    Description: Image ids and names
+    Args:
+        return: dict image_id -> name
+    """
+    return dict(db.execute("SELECT image_id, name FROM images"))
+
+
+def read_keypoint_counts(db):
+    """
+    Description: Number of keypoints per image, without reading the blobs
+    Args:
+        return: dict image_id -> keypoint count
+    """
+    return dict(db.execute("SELECT image_id, rows FROM keypoints"))
+
+
+def read_keypoints(db):
+    """
+    Description: Keypoints of every image
+    Args:
+        return: dict image_id -> float32 array of rows x cols (x, y, then shape parameters)
+    """
+    entries = db.execute(
+        "SELECT image_id, rows, cols, data FROM keypoints").fetchall()
+    if not entries:
+        return {}
+    image_ids, rows, cols, blobs = zip(*entries)
+    values, offsets = decode_blobs(rows, max(cols), blobs, np.float32)
+    return {
+        image_id: values[offsets[index]:offsets[index + 1]]
+        for index, image_id in enumerate(image_ids)
+    }
+
+
+def read_two_view_geometries(db):
+    """
+    Description: Verified image pairs, without their inlier matches
+    Args:
+        return: dict with pair_id, image_id1, image_id2, inliers and config arrays
+    """
+    entries = db.execute(
+        "SELECT pair_id, rows, config FROM two_view_geometries").fetchall()
+    pair_ids = np.array([entry[0] for entry in entries], dtype=np.int64)
+    image_id1, image_id2 = pair_ids_to_images(pair_ids)
+    return {
+        "pair_id": pair_ids,
+        "image_id1": image_id1,
+        "image_id2": image_id2,
+        "inliers": np.array([entry[1] for entry in entries], dtype=np.int64),
+        "config": np.array([entry[2] for entry in entries], dtype=np.int64),
+    }
+
+
+def read_inlier_matches(db, pair_ids):
+    """
+    Description: Inlier matches of some verified pairs
+    Args:
+        pair_ids: int64 array of pair ids
+        return: (uint32 array of keypoint index pairs, first match row of every pair),
+                in the order of pair_ids
+    """
+    entries = {}
+    pair_ids = np.asarray(pair_ids, dtype=np.int64).tolist()
+    for first in range(0, len(pair_ids), QUERY_PAIRS):
+        chunk = pair_ids[first:first + QUERY_PAIRS]
+        for pair_id, rows, blob in db.execute(
+                "SELECT pair_id, rows, data FROM two_view_geometries WHERE pair_id IN ({0})"
+                .format(",".join("?" * len(chunk))), chunk):
+            entries[pair_id] = (rows, blob)
+    return decode_blobs([entries[pair_id][0] for pair_id in pair_ids], 2,
+                        [entries[pair_id][1] for pair_id in pair_ids],
+                        np.uint32)
+
+
+def matched_keypoints(geometries, image_count):
+    """
+    Description: Number of distinct keypoints of each image taking part in at least one inlier match
+    Args:
+        geometries: result of read_two_view_geometries with "matches" from read_inlier_matches,
+                    counts are complete for the images all of whose pairs are included
+        image_count: largest image id
+        return: int64 array indexed by image id
+    """
+    matches = geometries["matches"]
+    counts = np.zeros(image_count + 1, dtype=np.int64)
+    if not len(matches):
+        return counts
+    rows = geometries["inliers"]
+    first = np.repeat(geometries["image_id1"], rows)
+    second = np.repeat(geometries["image_id2"], rows)
+    # image id in the high bits, keypoint index in the low bits
+    keys = np.concatenate(((first << 32) | matches[:, 0].astype(np.int64),
+                           (second << 32) | matches[:, 1].astype(np.int64)))
+    counts += np.bincount(np.unique(keys) >> 32, minlength=image_count + 1)
+    return counts
+
+
+def connected_components(image_ids, edges1, edges2):
+    """
+    Description: Connected components of the view graph, with union-find
+    Args:
+        image_ids: all image ids
+        edges1, edges2: image ids of the edges
+        return: list of components (sorted lists of image ids), largest first
+    """
+    parent = {image_id: image_id for image_id in image_ids}
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for first, second in zip(edges1.tolist(), edges2.tolist()):
+        root1, root2 = find(first), find(second)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+    components = {}
+    for image_id in image_ids:
+        components.setdefault(find(image_id), []).append(image_id)
+    return sorted((sorted(component) for component in components.values()),
+                  key=len,
+                  reverse=True)
+
+
+def analyze(path, min_inliers=MIN_INLIERS, weak_degree=WEAK_DEGREE):
+    """
+    Description: Build the view graph of a database and summarize what the mapper will face
+    Args:
+        path: database.db
+        min_inliers: inlier matches needed for an edge of the view graph
+        weak_degree: images with fewer neighbors are reported as weakly connected
+        return: dict with the image, pair and component statistics
+    """
+    db = connect(path)
+    try:
+        images = read_images(db)
+        keypoints = read_keypoint_counts(db)
+        geometries = read_two_view_geometries(db)
+        image_ids = sorted(images)
+        largest_id = max(image_ids, default=0)
+        usable = ((geometries["inliers"] >= min_inliers)
+                  & ~np.isin(geometries["config"], DEGENERATE_CONFIGS))
+        edges1 = geometries["image_id1"][usable]
+        edges2 = geometries["image_id2"][usable]
+        degree = np.bincount(np.concatenate((edges1, edges2)),
+                             minlength=largest_id + 1)
+        components = connected_components(image_ids, edges1, edges2)
+        weak_ids = [
+            image_id for image_id in image_ids
+            if degree[image_id] < weak_degree
+        ]
+        # The matched keypoints are only reported for the weak images
+        touching = (np.isin(geometries["image_id1"], weak_ids)
+                    | np.isin(geometries["image_id2"], weak_ids))
+        weak_pairs = {
+            key: values[touching]
+            for key, values in geometries.items()
+        }
+        weak_pairs["matches"], weak_pairs["offsets"] = read_inlier_matches(
+            db, weak_pairs["pair_id"])
+    finally:
+        db.close()
+    matched = matched_keypoints(weak_pairs, largest_id)
+
+    weak = []
+    for image_id in weak_ids:
+        weak.append({
+            "name": images[image_id],
+            "neighbors": int(degree[image_id]),
+            "keypoints": int(keypoints.get(image_id, 0)),
+            "matched_keypoints": int(matched[image_id]),
+        })
+    largest = components[0] if components else []
+    in_largest = np.isin(edges1, largest)
+    return {
+        "database": path,
+        "images": len(image_ids),
+        "keypoints": int(sum(keypoints.values())),
+        "verified_pairs": int(len(geometries["inliers"])),
+        "usable_pairs": int(usable.sum()),
+        "min_inliers": min_inliers,
+        "mean_neighbors":
+        round(float(degree[image_ids].mean()), 2) if image_ids else 0.0,
+        "components": [len(component) for component in components],
+        "largest_component_ratio":
+        round(len(largest) / float(len(image_ids)), 4) if image_ids else 0.0,
+        "singletons": sum(1 for component in components if len(component) == 1),
+        "weak_images": weak,
+        # Mapper workload: the images it registers and the correspondences it triangulates
+        "mapper_images": len(largest),
+        "mapper_pairs": int(in_largest.sum()),
+        "mapper_correspondences":
+        int(geometries["inliers"][usable][in_largest].sum()),
+        "component_images":
+        [[images[image_id] for image_id in component]
+         for component in components if len(component) > 1],
+    }
+
+
+def summary_rows(stats):
+    return [
+        ["Images", stats["images"]],
+        ["Keypoints", stats["keypoints"]],
+        ["Verified pairs", stats["verified_pairs"]],
+        ["Pairs with >= {0} inliers".format(stats["min_inliers"]),
+         stats["usable_pairs"]],
+        ["Mean neighbors per image", stats["mean_neighbors"]],
+        ["Components (> 1 image)",
+         sum(1 for size in stats["components"] if size > 1)],
+        ["Largest component", "{0} images ({1:.0%})".format(
+            stats["mapper_images"], stats["largest_component_ratio"])],
+        ["Unconnected images", stats["singletons"]],
+        ["Weakly connected images", len(stats["weak_images"])],
+        ["Mapper pairs", stats["mapper_pairs"]],
+        ["Mapper correspondences", stats["mapper_correspondences"]],
+    ]
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Analyze the match graph of a COLMAP database before mapping")
+    parser.add_argument("--database",
+                        type=str,
+                        required=True,
+                        help="COLMAP database.db")
+    parser.add_argument("--output",
+                        type=str,
+                        help="Write the analysis to this JSON file")
+    parser.add_argument(
+        "--min-inliers",
+        type=int,
+        default=MIN_INLIERS,
+        help="Inlier matches needed to link two images. Default: {0}".format(
+            MIN_INLIERS))
+    parser.add_argument(
+        "--min-component-ratio",
+        type=float,
+        help="Exit with 1 when the largest component holds a smaller share of the images",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    stats = analyze(args.database, args.min_inliers)
+    print(tabulate(summary_rows(stats)))
+    for image in stats["weak_images"][:20]:
+        print("Weakly connected: {name} ({neighbors} neighbors, {matched_keypoints}/{keypoints} keypoints matched)"
+              .format(**image))
+    if len(stats["weak_images"]) > 20:
+        print("... and {0} more weakly connected images".format(
+            len(stats["weak_images"]) - 20))
+    if args.output:
+        with open(args.output + ".tmp", "w") as file:
+            json.dump(stats, file, indent=1)
+        os.replace(args.output + ".tmp", args.output)
+    if (args.min_component_ratio is not None
+            and stats["largest_component_ratio"] < args.min_component_ratio):
+        print("Largest component holds {0:.0%} of the images, less than --min-component-ratio {1:.0%}"
+              .format(stats["largest_component_ratio"],
+                      args.min_component_ratio))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
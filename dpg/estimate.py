@@ -0,0 +1,413 @@
+"""
+Description: Dry-run estimate of the runtime, memory and disk use of a plan.
+
+Every stage is reduced to an amount of work: the image pairs a matcher
+verifies, the images the mappers register, or the megapixels the other tools
+process (divided by 4 per --resolution-level of the OpenMVS tools). Clusters
+and tiles get their share of the scene. Earlier run reports give the seconds
+and output bytes per unit of work of every tool, the median over its
+successful runs, and rough defaults stand in for the tools without history.
+Memory and GPU memory are the admission control estimates, which are what
+the run itself will hold the stages to.
+
+The stages are laid out on --jobs slots in the order the scheduler starts
+them, which gives the wall time and the memory of the stages running side by
+side. Stages whose cached outputs are up to date cost nothing. Plans that do
+not fit the RAM, the GPUs or the free disk space of the host are flagged.
+"""
+
+import glob, json, logging, math, os, statistics
+import psutil
+from tabulate import tabulate
+
+from dpg.admission import AdmissionController, stage_tool
+from dpg.cache import StageCache
+from dpg.host import cached_hardware, disk_usage
+from dpg.images import image_sizes, scaled_size
+from dpg.report import load_report
+from dpg.scheduler import resolve_dependencies
+
+logger = logging.getLogger("GraphEngine")
+
+GB = 1024**3
+# Reports of earlier runs looked up by default, in the current and the output folder
+REPORT_PATTERN = "GraphEngine_*_report.json"
+
+# Rough defaults used until a tool has history:
+# [seconds per unit of work, output bytes per unit of work]
+DEFAULT_RATES = {
+    "preprocess_images": [0.05, 0.3e6],
+    "feature_extractor": [0.3, 0.5e6],
+    "exhaustive_matcher": [0.01, 5e3],
+    "sequential_matcher": [0.01, 5e3],
+    "vocab_tree_matcher": [0.01, 5e3],
+    "spatial_matcher": [0.01, 5e3],
+    "matches_importer": [0.01, 5e3],
+    "view_graph": [0.001, 1e3],
+    "partition_scene": [0.01, 1e3],
+    "mapper": [1.0, 0.2e6],
+    "model_merger": [0.05, 0.2e6],
+    "bundle_adjuster": [0.5, 0.2e6],
+    "update_scene": [0.001, 1e3],
+    "image_registrator": [0.1, 0.2e6],
+    "image_undistorter": [0.05, 3e6],
+    "model_converter": [0.01, 0.1e6],
+    "colmap_model": [0.005, 1e3],
+    "InterfaceCOLMAP": [0.02, 0.05e6],
+    "DensifyPointCloud": [2.0, 8e6],
+    "densify_tiles": [0.01, 0.0],
+    "ReconstructMesh": [1.0, 1e6],
+    "RefineMesh": [3.0, 1e6],
+    "TextureMesh": [1.0, 1e6],
+    "openMVG_main_SfMInit_ImageListing": [0.001, 1e3],
+    "openMVG_main_ComputeFeatures": [0.5, 0.5e6],
+    "openMVG_main_PairGenerator": [0.001, 1e3],
+    "openMVG_main_ComputeMatches": [0.01, 5e3],
+    "openMVG_main_GeometricFilter": [0.005, 2e3],
+    "openMVG_main_SfM": [1.0, 0.2e6],
+    "openMVG_main_ComputeSfM_DataColor": [0.05, 0.1e6],
+    "openMVG_main_openMVG2openMVS": [0.05, 3e6],
+}
+DEFAULT_RATE = [0.5, 0.5e6]
+
+# Tools whose work grows with the number of images rather than their size
+IMAGE_TOOLS = [
+    "view_graph", "partition_scene", "mapper", "model_merger",
+    "bundle_adjuster", "update_scene", "image_registrator", "colmap_model",
+    "openMVG_main_SfMInit_ImageListing", "openMVG_main_SfM"
+]
+# Tools verifying image pairs, OpenMVG matches every pair by default
+PAIR_TOOLS = [
+    "openMVG_main_PairGenerator", "openMVG_main_ComputeMatches",
+    "openMVG_main_GeometricFilter"
+]
+# COLMAP defaults of the options bounding the pairs of each matcher
+SEQUENTIAL_OVERLAP = 10
+LOOP_DETECTION_PERIOD = 10
+LOOP_DETECTION_NUM_IMAGES = 50
+VOCAB_TREE_NUM_IMAGES = 100
+SPATIAL_MAX_NEIGHBORS = 50
+# OpenMVS default of --resolution-level
+DEFAULT_RESOLUTION_LEVELS = {"DensifyPointCloud": 1}
+
+
+def describe_scene(images_dir, max_size=None):
+    """
+    Description: Size of a scene as the stages see it, reading only the image headers
+    Args:
+        images_dir: folder with the input images
+        max_size: --max-image-size of the run, None when the images are used as they are
+        return: dict with images, megapixels (after preprocessing) and source_megapixels
+    """
+    sizes = image_sizes(images_dir)
+    scaled = [scaled_size(width, height, max_size) for width, height in sizes]
+    return {
+        "images": len(sizes),
+        "megapixels": sum(width * height for width, height in scaled) / 1e6,
+        "source_megapixels":
+        sum(width * height for width, height in sizes) / 1e6,
+    }
+
+
+def option_value(argv, name, default=None):
+    for index, value in enumerate(argv[:-1]):
+        if value == name:
+            return argv[index + 1]
+    return default
+
+
+def matcher_pairs(tool, argv, images):
+    """
+    Description: Number of image pairs a COLMAP matcher verifies, from its options
+    """
+    everything = images * (images - 1) / 2.0
+    if tool == "sequential_matcher":
+        overlap = int(
+            option_value(argv, "--SequentialMatching.overlap",
+                         SEQUENTIAL_OVERLAP))
+        pairs = images * overlap
+        if option_value(argv, "--SequentialMatching.loop_detection") == "1":
+            pairs += images / LOOP_DETECTION_PERIOD * LOOP_DETECTION_NUM_IMAGES
+    elif tool == "vocab_tree_matcher":
+        pairs = images * int(
+            option_value(argv, "--VocabTreeMatching.num_images",
+                         VOCAB_TREE_NUM_IMAGES))
+    elif tool == "spatial_matcher":
+        pairs = images * int(
+            option_value(argv, "--SpatialMatching.max_num_neighbors",
+                         SPATIAL_MAX_NEIGHBORS))
+    else:
+        pairs = everything
+    return min(pairs, everything)
+
+
+def stage_work(instruction, scene):
+    """
+    Description: Amount of work of a stage, the quantity its runtime and output grow with
+    Args:
+        instruction: command dict
+        scene: result of describe_scene
+        return: (amount, unit), unit is "pairs", "images" or "megapixels"
+    """
+    argv = list(map(str, instruction["command"]))
+    tool = stage_tool(argv)
+    share = instruction.get("scene_share", 1.0)
+    images = scene["images"] * share
+    if tool == "matches_importer":
+        # The pairs of an update, every new image with every other image
+        return images * (scene["images"] - 1), "pairs"
+    if tool.endswith("_matcher") or tool in PAIR_TOOLS:
+        return matcher_pairs(tool, argv, images), "pairs"
+    if tool in IMAGE_TOOLS:
+        return images, "images"
+    if tool == "preprocess_images":
+        return scene["source_megapixels"], "megapixels"
+    level = int(
+        option_value(argv, "--resolution-level",
+                     DEFAULT_RESOLUTION_LEVELS.get(tool, 0)))
+    # Every level halves the width and the height of the images
+    return scene["megapixels"] * share / 4**level, "megapixels"
+
+
+def report_paths(patterns):
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(os.path.expanduser(pattern)))
+    return sorted(paths)
+
+
+def tool_rates(reports):
+    """
+    Description: Seconds and output bytes per unit of work of every tool, from run reports
+    Args:
+        reports: list of run report dicts
+        return: dict tool -> dict with seconds, disk (medians, disk None without artifacts) and runs
+    """
+    samples = {}
+    for report in reports:
+        for stage in report.get("stages", []):
+            work = stage.get("work")
+            if stage.get("skipped") or stage.get("exit_code") != 0 or not work:
+                continue
+            tool = stage_tool(stage["argv"])
+            entry = samples.setdefault(tool, {"seconds": [], "disk": []})
+            entry["seconds"].append(stage["duration"] / work)
+            sizes = [
+                size for size in stage.get("artifacts", {}).values()
+                if size is not None
+            ]
+            if sizes:
+                entry["disk"].append(sum(sizes) / work)
+    return {
+        tool: {
+            "seconds": statistics.median(entry["seconds"]),
+            "disk":
+            statistics.median(entry["disk"]) if entry["disk"] else None,
+            "runs": len(entry["seconds"]),
+        }
+        for tool, entry in samples.items()
+    }
+
+
+def load_rates(patterns):
+    """
+    Description: tool_rates of the run reports matching some globs, unreadable reports are skipped
+    Args:
+        return: (tool_rates, number of reports read)
+    """
+    reports = []
+    for path in report_paths(patterns):
+        try:
+            reports.append(load_report(path))
+        except (OSError, ValueError) as err:
+            logger.warning("Skipping report {0}: {1}".format(path, err))
+    return tool_rates(reports), len(reports)
+
+
+def simulate(durations, dependencies, jobs):
+    """
+    Description: Lay the stages out on jobs slots, starting each one as soon as its dependencies and a slot allow
+    Args:
+        durations: seconds of every stage
+        dependencies: result of resolve_dependencies
+        jobs: number of stages run at the same time
+        return: list of (start, end) in seconds
+    """
+    slots = [0.0] * max(1, jobs)
+    times = []
+    for index, duration in enumerate(durations):
+        ready = max((times[earlier][1] for earlier in dependencies[index]),
+                    default=0.0)
+        slot = min(range(len(slots)), key=lambda slot: slots[slot])
+        start = max(ready, slots[slot])
+        slots[slot] = start + duration
+        times.append((start, start + duration))
+    return times
+
+
+def estimate_plan(plan, patterns=None, admission=None, scene=None):
+    """
+    Description: Predict the runtime, memory and disk use of a plan without running it
+    Args:
+        plan: Plan from build_plan
+        patterns: globs of earlier run reports, default GraphEngine_*_report.json in the current and the output folder
+        admission: AdmissionController giving the memory estimates, default one with the host history
+        scene: result of describe_scene, computed from the plan by default
+        return: dict with scene, jobs, stages, wall_time, peak_memory, disk, host and problems
+    """
+    config = plan.config
+    if patterns is None:
+        patterns = [
+            REPORT_PATTERN,
+            os.path.join(plan.output_directory, REPORT_PATTERN)
+        ]
+    if scene is None:
+        scene = describe_scene(plan.images_directory, config.max_image_size)
+    if admission is None:
+        admission = AdmissionController(state_dir=config.admission_dir)
+    rates, reports = load_rates(patterns)
+    cache = StageCache(os.path.join(plan.output_directory, ".stage_cache"))
+
+    stages = []
+    for instruction in plan.commands:
+        tool = stage_tool(instruction["command"])
+        work, unit = stage_work(instruction, scene)
+        seconds_rate, disk_rate = DEFAULT_RATES.get(tool, DEFAULT_RATE)
+        basis = "default"
+        if tool in rates:
+            seconds_rate = rates[tool]["seconds"]
+            if rates[tool]["disk"] is not None:
+                disk_rate = rates[tool]["disk"]
+            basis = "{0} runs".format(rates[tool]["runs"])
+        resources = admission.estimate(
+            instruction["command"],
+            scene["megapixels"] * instruction.get("scene_share", 1.0))
+        cached = not config.recompute and cache.is_fresh(instruction)
+        stages.append({
+            "title": instruction["title"],
+            "tool": tool,
+            "work": round(work, 3),
+            "unit": unit,
+            "seconds": 0.0 if cached else seconds_rate * work,
+            "memory": resources["mem"],
+            "gpu_memory": resources["gpu_mem"],
+            "disk": 0.0 if cached else disk_rate * work,
+            "basis": basis,
+            "cached": cached,
+        })
+
+    times = simulate([stage["seconds"] for stage in stages],
+                     resolve_dependencies(plan.commands), config.jobs)
+    peak_memory = 0
+    for index, (stage, (start, end)) in enumerate(zip(stages, times)):
+        stage["start"], stage["end"] = start, end
+        if stage["cached"]:
+            continue
+        # This stage and the ones still running when it starts
+        running = stage["memory"] + sum(
+            other["memory"]
+            for other_index, (other, (other_start, other_end)) in enumerate(
+                zip(stages, times)) if other_index != index
+            and not other["cached"] and other_start <= start < other_end)
+        peak_memory = max(peak_memory, running)
+
+    hardware = cached_hardware(config.host_cache_ttl)
+    memory_total = psutil.virtual_memory().total
+    disks = disk_usage([plan.output_directory])
+    disk_free = min(disk["free"] for disk in disks.values())
+    disk = sum(stage["disk"] for stage in stages)
+    problems = []
+    gpus = hardware.get("gpus")
+    gpu_total = max(
+        (gpu["memory_total"] * 1024 * 1024 for gpu in gpus or []), default=0)
+    for stage in stages:
+        if stage["cached"]:
+            continue
+        if stage["memory"] > memory_total:
+            problems.append("{0} needs {1:.1f}GB RAM, the host has {2:.1f}GB".
+                            format(stage["title"], stage["memory"] / GB,
+                                   memory_total / GB))
+        if stage["gpu_memory"] > 0 and gpus is not None:
+            # Without GPUtil the GPUs are unknown and not checked
+            if not gpus:
+                problems.append("{0} runs on the GPU, no GPU was found".format(
+                    stage["title"]))
+            elif stage["gpu_memory"] > gpu_total:
+                problems.append(
+                    "{0} needs {1:.1f}GB GPU memory, the largest GPU has {2:.1f}GB"
+                    .format(stage["title"], stage["gpu_memory"] / GB,
+                            gpu_total / GB))
+    if disk > disk_free:
+        problems.append(
+            "The stages write {0:.1f}GB, {1} has {2:.1f}GB free".format(
+                disk / GB, plan.output_directory, disk_free / GB))
+    return {
+        "scene": scene,
+        "jobs": config.jobs,
+        "reports": reports,
+        "stages": stages,
+        "wall_time": max((end for start, end in times), default=0.0),
+        "peak_memory": peak_memory,
+        "disk": disk,
+        "host": {
+            "memory_total": memory_total,
+            "gpu_memory_total": gpu_total if gpus is not None else None,
+            "disk_free": disk_free,
+        },
+        "problems": problems,
+    }
+
+
+def format_duration(seconds):
+    seconds = int(math.ceil(seconds))
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, seconds // 60 % 60,
+                                        seconds % 60)
+
+
+def format_work(work):
+    return "{0:,.0f}".format(work) if work >= 10 else "{0:.2g}".format(work)
+
+
+def print_estimate(estimate):
+    """
+    Description: Print an estimate, for --estimate
+    """
+    scene = estimate["scene"]
+    print("Scene: {0} images, {1:.1f} megapixels ({2:.1f} before preprocessing)"
+          .format(scene["images"], scene["megapixels"],
+                  scene["source_megapixels"]))
+    table = [[
+        stage["title"],
+        "{0} {1}".format(format_work(stage["work"]), stage["unit"]),
+        "cached" if stage["cached"] else format_duration(stage["seconds"]),
+        stage["memory"] / GB,
+        stage["gpu_memory"] / GB,
+        stage["disk"] / GB,
+        stage["basis"],
+    ] for stage in estimate["stages"]]
+    print(
+        tabulate(table,
+                 headers=[
+                     "Stage", "Work", "Time", "RAM (GB)", "GPU (GB)",
+                     "Disk (GB)", "Based on"
+                 ],
+                 floatfmt=".1f"))
+    host = estimate["host"]
+    print("\nWall time with {0} job(s): {1}".format(
+        estimate["jobs"], format_duration(estimate["wall_time"])))
+    print("Peak RAM of the stages running together: {0:.1f}GB of {1:.1f}GB".
+          format(estimate["peak_memory"] / GB, host["memory_total"] / GB))
+    print("Disk written: {0:.1f}GB, {1:.1f}GB free".format(
+        estimate["disk"] / GB, host["disk_free"] / GB))
+    if estimate["peak_memory"] > host["memory_total"]:
+        print("Admission control will run some of these stages one after the other")
+    if not estimate["reports"]:
+        print("No earlier run reports found, the times are rough defaults")
+    for problem in estimate["problems"]:
+        print("Does not fit: {0}".format(problem))
+
+
+def write_estimate(estimate, path):
+    with open(path + ".tmp", "w") as file:
+        json.dump(estimate, file, indent=1)
+    os.replace(path + ".tmp", path)
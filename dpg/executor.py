@@ -0,0 +1,427 @@
+"""
+Description: Executors running the command of a stage, locally or on worker hosts.
+
+LocalExecutor starts the command as a subprocess of the pipeline. QueueExecutor
+ships the command to a job queue on a filesystem shared by all hosts, where
+worker processes started with queue_worker.py pick it up:
+
+    <queue>/pending/<job>.json   submitted jobs, claimed by renaming them
+    <queue>/running/<job>.json   claimed jobs, touched by the worker as a heartbeat
+    <queue>/logs/<job>.log       output of the command, followed by the submitter
+    <queue>/done/<job>.json      exit code, host and times of finished jobs
+
+A claim is a rename, which is atomic on a POSIX filesystem, so a job runs on
+exactly one worker. Workers apply the admission control of their own host.
+The paths in the command must be valid on every host.
+
+Usage:
+    queue_worker.py --queue /shared/queue [--slots 2] [--no-admission] [--cpu-budget 16]
+"""
+
+import argparse, asyncio, datetime, errno, json, logging, os, socket, sys, threading, time, uuid
+
+from dpg.admission import AdmissionController
+from dpg.runner import KILL_GRACE, run_process, terminate_all, terminate_groups
+from dpg.threads import thread_env, with_threads
+
+logger = logging.getLogger("GraphEngine")
+
+QUEUE_FOLDERS = ["pending", "running", "logs", "done"]
+# Seconds between two touches of a running job
+HEARTBEAT_INTERVAL = 10
+# A running job whose heartbeat is older than this lost its worker
+HEARTBEAT_TIMEOUT = 120
+
+
+def report_launch_error(command, err):
+    if err.errno == errno.ENOENT:
+        message = "Could not find executable: {0} - Have you installed all the requirements?".format(
+            command[0])
+    else:
+        message = "Could not run command: {0}".format(err)
+    print(message)
+    logger.error(message)
+
+
+class LocalExecutor:
+    """
+    Description: Run commands as subprocesses of this process
+    """
+
+    remote = False
+
+    def __init__(self):
+        # Process groups of the commands this executor runs, stopped by cancel
+        self.groups = set()
+        self.lock = threading.Lock()
+        self.cancelled = False
+
+    def cancel(self, grace=KILL_GRACE):
+        """
+        Description: Stop the commands this executor runs, and the ones it is asked to run later
+        """
+        with self.lock:
+            self.cancelled = True
+            groups = list(self.groups)
+        terminate_groups(groups, grace)
+
+    def run(self,
+            command,
+            output,
+            on_start=None,
+            cwd=None,
+            env=None,
+            job=None,
+            timeout=None,
+            idle_timeout=None):
+        """
+        Description: Run a command until it exits
+        Args:
+            command: argv
+            output: called with every output line of the command
+            on_start: called with the pid once the command started
+            cwd: working directory, None for the current one
+            env: variables added to the environment
+            job: extra information for remote executors, unused here
+            timeout: wall-clock limit in seconds, None for none
+            idle_timeout: longest silence in seconds, None for none
+            return: exit code, -1 when the command could not be started or the executor was cancelled
+        """
+        pids = []
+
+        def started(pid):
+            with self.lock:
+                self.groups.add(pid)
+                cancelled = self.cancelled
+            pids.append(pid)
+            if cancelled:
+                # Cancelled while the command was starting
+                terminate_groups([pid], 0)
+            elif on_start is not None:
+                on_start(pid)
+
+        if self.cancelled:
+            return -1
+        try:
+            # Each scheduler thread runs the tool on an event loop of its own
+            return asyncio.run(
+                run_process(command, output, timeout, idle_timeout, started,
+                            cwd, env))
+        except OSError as err:
+            report_launch_error(command, err)
+            return -1
+        finally:
+            with self.lock:
+                self.groups.difference_update(pids)
+
+
+def queue_path(queue_dir, folder, job_id, extension=".json"):
+    return os.path.join(queue_dir, folder, job_id + extension)
+
+
+def write_json(path, data):
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+class QueueExecutor:
+    """
+    Description: Run commands on the workers of a shared job queue
+    Args:
+        queue_dir: queue folder on the shared filesystem
+        poll_interval: seconds between two checks of a submitted job
+    """
+
+    remote = True
+
+    def __init__(self, queue_dir, poll_interval=1.0):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.poll_interval = poll_interval
+        for folder in QUEUE_FOLDERS:
+            os.makedirs(os.path.join(self.queue_dir, folder), exist_ok=True)
+
+    def submit(self, command, cwd=None, env=None, job=None):
+        """
+        Description: Queue a command
+        Args:
+            job: extra fields stored with the job, e.g. title and megapixels
+            return: job id
+        """
+        job_id = "{0}-{1}-{2}".format(
+            datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+            socket.gethostname(),
+            uuid.uuid4().hex[:8])
+        spec = dict(job or {})
+        spec.update({
+            "id": job_id,
+            "command": list(map(str, command)),
+            "cwd": cwd,
+            "env": env or {},
+            "submitted_by": socket.gethostname(),
+            "submitted_at": datetime.datetime.now().isoformat(),
+        })
+        path = queue_path(self.queue_dir, "pending", job_id)
+        # Written under another name first, so workers never claim a partial file
+        with open(path + ".tmp", "w") as file:
+            json.dump(spec, file, indent=1)
+        os.rename(path + ".tmp", path)
+        return job_id
+
+    def run(self,
+            command,
+            output,
+            on_start=None,
+            cwd=None,
+            env=None,
+            job=None,
+            timeout=None,
+            idle_timeout=None):
+        """
+        Description: Submit a command and follow it until a worker finished it
+        Args:
+            command: argv
+            output: called with every output line of the command
+            on_start: not called, the command has no pid on this host
+            cwd: working directory on the worker
+            env: variables added to the environment on the worker
+            job: extra fields stored with the job
+            timeout, idle_timeout: enforced by the worker, in seconds
+            return: exit code, -1 when the worker was lost
+        """
+        job = dict(job or {}, timeout=timeout, idle_timeout=idle_timeout)
+        job_id = self.submit(command, cwd, env, job)
+        log_path = queue_path(self.queue_dir, "logs", job_id, ".log")
+        running = queue_path(self.queue_dir, "running", job_id)
+        done = queue_path(self.queue_dir, "done", job_id)
+        logger.info("Queued job {0}".format(job_id))
+        log_file = None
+        partial = ""
+        # Short stages finish quickly, so the polling starts fast and slows down
+        delay = 0.05
+        try:
+            while True:
+                finished = os.path.exists(done)
+                if log_file is None and os.path.exists(log_path):
+                    log_file = open(log_path, errors="replace")
+                if log_file is not None:
+                    partial += log_file.read()
+                    lines = partial.split("\n")
+                    partial = lines.pop()
+                    for line in lines:
+                        output(line.rstrip("\r"))
+                if finished:
+                    if partial:
+                        output(partial)
+                    with open(done) as file:
+                        result = json.load(file)
+                    logger.info("Job {0} finished on {1} with exit code {2}".
+                                format(job_id, result["host"],
+                                       result["exit_code"]))
+                    return result["exit_code"]
+                try:
+                    age = time.time() - os.path.getmtime(running)
+                except OSError:
+                    age = 0
+                if age > HEARTBEAT_TIMEOUT:
+                    logger.error("Job {0} lost its worker ({1:.0f}s without heartbeat)".
+                                 format(job_id, age))
+                    return -1
+                time.sleep(delay)
+                delay = min(self.poll_interval, delay * 2)
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+
+class Worker:
+    """
+    Description: Claim and run jobs of a shared queue
+    Args:
+        queue_dir: queue folder on the shared filesystem
+        slots: number of jobs run at the same time
+        admission: AdmissionController of this host, or None
+        poll_interval: seconds between two looks at the pending jobs
+    """
+
+    def __init__(self, queue_dir, slots=1, admission=None, poll_interval=1.0):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.slots = threading.Semaphore(slots)
+        self.admission = admission
+        self.poll_interval = poll_interval
+        self.host = socket.gethostname()
+        for folder in QUEUE_FOLDERS:
+            os.makedirs(os.path.join(self.queue_dir, folder), exist_ok=True)
+
+    def claim(self):
+        """
+        Description: Take the oldest pending job
+        Args:
+            return: job dict, or None when nothing is pending
+        """
+        pending = os.path.join(self.queue_dir, "pending")
+        for name in sorted(os.listdir(pending)):
+            if not name.endswith(".json"):
+                continue
+            running = os.path.join(self.queue_dir, "running", name)
+            try:
+                os.rename(os.path.join(pending, name), running)
+            except OSError:
+                # Claimed by another worker in the meantime
+                continue
+            with open(running) as file:
+                return json.load(file)
+        return None
+
+    def heartbeat(self, path, stopped):
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                os.utime(path)
+            except OSError:
+                return
+
+    def execute(self, job):
+        """
+        Description: Run a claimed job and publish its result
+        """
+        running = queue_path(self.queue_dir, "running", job["id"])
+        stopped = threading.Event()
+        threading.Thread(target=self.heartbeat,
+                         args=(running, stopped),
+                         daemon=True).start()
+        started_at = datetime.datetime.now().isoformat()
+        title = job.get("title", job["id"])
+        logger.info("Running {0} ({1})".format(title, job["id"]))
+        reservation = None
+        rc = -1
+        command = job["command"]
+        env = job.get("env")
+        try:
+            if self.admission is not None:
+                reservation = self.admission.admit(title, command,
+                                                   job.get("megapixels", 0))
+            if reservation is not None and reservation.threads:
+                # Sized for this host, the submitter does not know its cores
+                command = with_threads(command, reservation.tool,
+                                       reservation.threads)
+                env = dict(env or {}, **thread_env(reservation.threads))
+            with open(queue_path(self.queue_dir, "logs", job["id"], ".log"),
+                      "w") as log:
+
+                def write(line):
+                    log.write(line + "\n")
+                    log.flush()
+
+                def attach(pid):
+                    if reservation is not None:
+                        self.admission.attach(reservation, pid)
+
+                try:
+                    rc = asyncio.run(
+                        run_process(command, write, job.get("timeout"),
+                                    job.get("idle_timeout"), attach,
+                                    job.get("cwd"), env))
+                except OSError as err:
+                    write("Could not run command on {0}: {1}".format(
+                        self.host, err))
+        finally:
+            if reservation is not None:
+                self.admission.release(reservation, success=rc == 0)
+            stopped.set()
+            write_json(
+                queue_path(self.queue_dir, "done", job["id"]), {
+                    "id": job["id"],
+                    "exit_code": rc,
+                    "host": self.host,
+                    "started_at": started_at,
+                    "finished_at": datetime.datetime.now().isoformat(),
+                })
+            try:
+                os.remove(running)
+            except OSError:
+                pass
+            self.slots.release()
+        logger.info("Finished {0} with exit code {1}".format(title, rc))
+
+    def serve(self, max_idle=None):
+        """
+        Description: Run jobs until interrupted
+        Args:
+            max_idle: stop after this many seconds without a pending job, None to run forever
+        """
+        idle_since = time.time()
+        try:
+            self.claim_loop(idle_since, max_idle)
+        except KeyboardInterrupt:
+            terminate_all()
+            raise
+
+    def claim_loop(self, idle_since, max_idle):
+        while True:
+            self.slots.acquire()
+            job = self.claim()
+            if job is None:
+                self.slots.release()
+                if max_idle is not None and time.time() - idle_since > max_idle:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            idle_since = time.time()
+            threading.Thread(target=self.execute, args=(job, )).start()
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Run pipeline stages from a shared job queue")
+    parser.add_argument("--queue",
+                        type=str,
+                        required=True,
+                        help="Queue folder on the shared filesystem")
+    parser.add_argument("--slots",
+                        type=int,
+                        default=1,
+                        help="Number of jobs run at the same time. Default: 1")
+    parser.add_argument(
+        "--no-admission",
+        action="store_true",
+        help="Start jobs without waiting for enough free RAM/CPU/GPU on this host",
+    )
+    parser.add_argument(
+        "--cpu-budget",
+        type=int,
+        help="Cores the jobs and the other pipelines on this host share. Default: all the cores",
+    )
+    parser.add_argument(
+        "--no-thread-budget",
+        action="store_true",
+        help="Let every tool start one thread per core instead of handing it a share of the CPU budget",
+    )
+    parser.add_argument(
+        "--no-affinity",
+        action="store_true",
+        help="Do not pin the running jobs to disjoint blocks of cores",
+    )
+    parser.add_argument(
+        "--max-idle",
+        type=float,
+        help="Exit after this many seconds without pending jobs. Default: run forever",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    admission = None
+    if not args.no_admission:
+        admission = AdmissionController(
+            cpu_budget=args.cpu_budget,
+            thread_budget=not args.no_thread_budget,
+            affinity=not args.no_affinity)
+    Worker(args.queue, args.slots, admission).serve(args.max_idle)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Description: Lazy, cached description of the host for the logs and run reports.
+
+The hardware part (platform, CPUs, memory, GPUs) rarely changes, so it is kept
+in a per-host json file and only probed again once it is older than the TTL.
+Disk usage is measured for the filesystems the run uses only, one statvfs per
+mount point, instead of for every partition of the machine.
+
+Probing runs in a background thread: GPUtil shells out to nvidia-smi and a
+stale network mount can hang statvfs, and neither may delay the first stage.
+Callers wait for the result with a timeout and get what was collected so far.
+"""
+
+import json, logging, os, platform, socket, threading, time
+import psutil
+
+logger = logging.getLogger("GraphEngine")
+
+# Seconds the cached hardware description stays valid
+HOST_CACHE_TTL = 24 * 60 * 60
+# Seconds a run waits for the probe before reporting what it has
+PROBE_TIMEOUT = 10
+
+
+def host_cache_path(cache_dir=None):
+    return os.path.join(
+        cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "dpg"),
+        "host_{0}.json".format(socket.gethostname()))
+
+
+def probe_hardware():
+    """
+    Description: Platform, CPU, memory and GPUs of this host
+    Args:
+        return: dict
+    """
+    info = {
+        "node": platform.node(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "os": f"{os.name} {platform.system()} {platform.release()}",
+        "cpu_count": psutil.cpu_count(),
+        "memory_total": psutil.virtual_memory().total,
+    }
+    frequency = psutil.cpu_freq()
+    info["cpu_freq"] = frequency.current if frequency is not None else None
+    try:
+        import GPUtil
+        info["gpus"] = [{
+            "name": gpu.name,
+            "memory_total": gpu.memoryTotal
+        } for gpu in GPUtil.getGPUs()]
+    except ModuleNotFoundError:
+        pass
+    return info
+
+
+def cached_hardware(ttl=HOST_CACHE_TTL, cache_dir=None):
+    """
+    Description: Hardware description from the host cache, probed again when older than ttl
+    Args:
+        ttl: seconds the cache stays valid, 0 to always probe
+        cache_dir: folder of the cache file, default ~/.cache/dpg
+        return: dict, see probe_hardware
+    """
+    path = host_cache_path(cache_dir)
+    if ttl > 0:
+        try:
+            if time.time() - os.path.getmtime(path) < ttl:
+                with open(path) as file:
+                    return json.load(file)
+        except (OSError, ValueError):
+            pass
+    info = probe_hardware()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as file:
+            json.dump(info, file, indent=1)
+        os.replace(path + ".tmp", path)
+    except OSError as err:
+        logger.warning("Could not cache the host description: {0}".format(err))
+    return info
+
+
+def mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def disk_usage(paths):
+    """
+    Description: Usage of the filesystems holding the given paths
+    Args:
+        paths: folders of the run, the ones not created yet are looked up through their parents
+        return: dict mount point -> {total, used, free} in bytes
+    """
+    usage = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        mount = mount_point(path)
+        if mount not in usage:
+            disk = psutil.disk_usage(mount)
+            usage[mount] = {
+                "total": disk.total,
+                "used": disk.used,
+                "free": disk.free
+            }
+    return usage
+
+
+class HostProbe:
+    """
+    Description: Describe the host in a background thread
+    Args:
+        paths: folders whose filesystems are measured
+        ttl: seconds the cached hardware description stays valid
+        cache_dir: folder of the host cache, default ~/.cache/dpg
+        timeout: seconds result waits by default
+    """
+
+    def __init__(self,
+                 paths=(),
+                 ttl=HOST_CACHE_TTL,
+                 cache_dir=None,
+                 timeout=PROBE_TIMEOUT):
+        self.paths = list(paths)
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.info = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.on_ready = None
+
+    def start(self, on_ready=None):
+        """
+        Description: Start probing
+        Args:
+            on_ready: called with the description from the probe thread once it is complete
+            return: self
+        """
+        self.on_ready = on_ready
+        threading.Thread(target=self.probe, daemon=True).start()
+        return self
+
+    def probe(self):
+        try:
+            hardware = cached_hardware(self.ttl, self.cache_dir)
+            with self.lock:
+                self.info.update(hardware)
+            # May hang on a stale network mount, the hardware part is kept
+            disks = disk_usage(self.paths)
+            with self.lock:
+                self.info["disks"] = disks
+        except Exception as err:
+            logger.warning("Could not describe the host: {0}".format(err))
+        self.done.set()
+        if self.on_ready is not None:
+            self.on_ready(self.result(0))
+
+    def result(self, timeout=None):
+        """
+        Description: Wait for the description
+        Args:
+            timeout: seconds to wait, default the timeout of the probe
+            return: dict, with "incomplete": True when the probe is still running
+        """
+        complete = self.done.wait(self.timeout if timeout is None else timeout)
+        with self.lock:
+            info = dict(self.info)
+        if not complete:
+            info["incomplete"] = True
+        return info
@@ -0,0 +1,62 @@
+"""
+Description: Helpers to inspect the input images of a scene without decoding them.
+"""
+
+import os
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+
+def list_images(images_dir):
+    """
+    Description: Sorted paths of the images directly inside a folder
+    Args:
+        images_dir: folder with the input images
+        return: list of paths, empty if the folder does not exist
+    """
+    if not os.path.isdir(images_dir):
+        return []
+    return [
+        os.path.join(images_dir, name)
+        for name in sorted(os.listdir(images_dir))
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def image_sizes(images_dir):
+    """
+    Description: Width and height of every image, reading only the image headers
+    Args:
+        images_dir: folder with the input images
+        return: list of (width, height), unreadable images left out
+    """
+    sizes = []
+    for path in list_images(images_dir):
+        try:
+            # Image.open is lazy, the pixel data is not decoded here
+            with Image.open(path) as image:
+                sizes.append(image.size)
+        except OSError:
+            continue
+    return sizes
+
+
+def scaled_size(width, height, max_size=None):
+    """
+    Description: Size of an image once downsized to max_size, as preprocess_images.py does
+    """
+    if max_size and max(width, height) > max_size:
+        scale = max_size / float(max(width, height))
+        return int(width * scale), int(height * scale)
+    return width, height
+
+
+def sample(items, count):
+    """
+    Description: Up to count items spread evenly over the list
+    """
+    if len(items) <= count:
+        return list(items)
+    step = len(items) / float(count)
+    return [items[int(index * step)] for index in range(count)]
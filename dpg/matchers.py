@@ -0,0 +1,129 @@
+"""
+Description: Selection of the COLMAP feature matcher.
+
+exhaustive_matcher compares every pair of images, which is O(N^2) and only
+practical for small scenes. For larger captures the matcher is chosen from
+the image metadata: spatial_matcher when the images carry EXIF GPS positions,
+sequential_matcher when the file names look like an ordered sequence (video
+frames, flight lines), and vocab_tree_matcher for unordered sets when a
+vocabulary tree is available.
+"""
+
+import logging, os, re
+
+from PIL import Image
+
+from dpg.images import list_images, sample
+
+MATCHERS = ["exhaustive", "sequential", "vocab_tree", "spatial"]
+# Images opened to look for GPS tags, the rest of the scene is assumed alike
+METADATA_SAMPLE = 200
+# Share of images needing GPS tags or sequential names for those matchers
+METADATA_RATIO = 0.9
+GPS_IFD = 0x8825
+GPS_LATITUDE = 2
+
+logger = logging.getLogger("GraphEngine")
+
+
+def has_gps(path):
+    try:
+        with Image.open(path) as image:
+            exif = image.getexif()
+            if hasattr(exif, "get_ifd"):
+                gps = exif.get_ifd(GPS_IFD)
+            else:
+                gps = exif.get(GPS_IFD) or {}
+    except (OSError, ValueError):
+        return False
+    return isinstance(gps, dict) and GPS_LATITUDE in gps
+
+
+def looks_sequential(names):
+    """
+    Description: Check whether file names share a prefix and end in a frame number
+    """
+    numbered = 0
+    prefixes = set()
+    for name in names:
+        match = re.match(r"^(.*?)(\d+)$", os.path.splitext(name)[0])
+        if match:
+            numbered += 1
+            prefixes.add(match.group(1))
+    return (len(names) > 1 and numbered >= METADATA_RATIO * len(names)
+            and len(prefixes) <= max(1, len(names) // 100))
+
+
+def scene_metadata(images_dir):
+    """
+    Description: Gather what the matcher choice depends on, reading a sample of the image headers
+    Args:
+        images_dir: folder with the input images
+        return: dict with image_count, gps_ratio and sequential
+    """
+    images = list_images(images_dir)
+    sampled = sample(images, METADATA_SAMPLE)
+    gps = sum(1 for path in sampled if has_gps(path))
+    return {
+        "image_count": len(images),
+        "gps_ratio": gps / float(len(sampled)) if sampled else 0.0,
+        "sequential": looks_sequential([os.path.basename(path)
+                                        for path in images]),
+    }
+
+
+def select_matcher(metadata, exhaustive_limit, vocab_tree=None):
+    """
+    Description: Choose the matcher for a scene
+    Args:
+        metadata: result of scene_metadata
+        exhaustive_limit: largest image count still matched exhaustively
+        vocab_tree: path of a COLMAP vocabulary tree, or None
+        return: one of MATCHERS
+    """
+    if metadata["image_count"] <= exhaustive_limit:
+        return "exhaustive"
+    if metadata["gps_ratio"] >= METADATA_RATIO:
+        return "spatial"
+    if metadata["sequential"]:
+        return "sequential"
+    if vocab_tree:
+        return "vocab_tree"
+    logger.warning(
+        "{0} unordered images without GPS and no --vocab-tree given, falling back to exhaustive matching"
+        .format(metadata["image_count"]))
+    return "exhaustive"
+
+
+def matcher_options(args, matcher):
+    """
+    Description: COLMAP options for the chosen matcher, from the pipeline arguments
+    """
+    options = []
+    if matcher == "sequential":
+        options += ["--SequentialMatching.overlap", args.matcher_overlap]
+        if args.vocab_tree and args.loop_detection:
+            options += [
+                "--SequentialMatching.loop_detection", "1",
+                "--SequentialMatching.vocab_tree_path", args.vocab_tree
+            ]
+    if matcher == "vocab_tree":
+        options += ["--VocabTreeMatching.vocab_tree_path", args.vocab_tree]
+        if args.vocab_tree_num_images is not None:
+            options += [
+                "--VocabTreeMatching.num_images", args.vocab_tree_num_images
+            ]
+    if matcher == "spatial":
+        if args.spatial_max_neighbors is not None:
+            options += [
+                "--SpatialMatching.max_num_neighbors",
+                args.spatial_max_neighbors
+            ]
+        if args.spatial_max_distance is not None:
+            options += [
+                "--SpatialMatching.max_distance", args.spatial_max_distance
+            ]
+    for option in args.matcher_option or []:
+        key, _, value = option.partition("=")
+        options += ["--" + key.lstrip("-"), value]
+    return options
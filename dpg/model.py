@@ -0,0 +1,570 @@
+"""
+Description: NumPy readers and writers for COLMAP binary sparse models.
+
+A model folder (sparse/0, dense/sparse) holds cameras.bin, images.bin and
+points3D.bin. They are decoded into structured arrays straight from a
+read-only memory map of the files, without one Python object per point or
+observation, so models with millions of points load in seconds:
+
+    cameras     CAMERA_DTYPE, params padded with zeros to MAX_PARAMS
+    images      image_dtype(), points2D_start/num_points2D index points2D
+    points2D    POINT2D_DTYPE, point3D_id is -1 for unmatched features
+    points3D    POINT3D_DTYPE, track_start/track_length index tracks
+    tracks      TRACK_DTYPE, one (image_id, point2D_idx) per observation
+
+The writers produce files COLMAP and InterfaceCOLMAP read back, so the model
+can be filtered here and the TXT conversion with colmap model_converter is
+not needed.
+
+"check" is the gate between the mapper and the dense stages: it scores every
+model the mapper wrote (it writes several when the scene falls apart), moves
+the one with the most registered images to sparse/0 and exits with 1 when
+that model is too weak to be worth densifying. The disjoint models cannot be
+merged, model_merger needs images registered in both.
+
+Usage:
+    colmap_model.py stats sparse/0 [--json stats.json] [--drop-text]
+    colmap_model.py filter sparse/0 --output sparse/filtered --max-error 2 --min-track-length 3
+    colmap_model.py check sparse --database database.db [--json model_check.json]
+"""
+
+import argparse, json, mmap, os, struct, sys
+
+import numpy as np
+from tabulate import tabulate
+
+from dpg.database import connect, read_images as read_database_images
+
+# Number of parameters of every COLMAP camera model, by model id
+CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3),
+    1: ("PINHOLE", 4),
+    2: ("SIMPLE_RADIAL", 4),
+    3: ("RADIAL", 5),
+    4: ("OPENCV", 8),
+    5: ("OPENCV_FISHEYE", 8),
+    6: ("FULL_OPENCV", 12),
+    7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4),
+    9: ("RADIAL_FISHEYE", 5),
+    10: ("THIN_PRISM_FISHEYE", 12),
+    11: ("RAD_TAN_THIN_PRISM_FISHEYE", 16),
+}
+MAX_PARAMS = 16
+
+CAMERA_HEADER = struct.Struct("<IiQQ")
+IMAGE_HEADER = struct.Struct("<I4d3dI")
+COUNT = struct.Struct("<Q")
+
+CAMERA_DTYPE = np.dtype([("camera_id", "<u4"), ("model", "<i4"),
+                         ("width", "<u8"), ("height", "<u8"),
+                         ("params", "<f8", (MAX_PARAMS, ))])
+# Same layout as in images.bin
+POINT2D_DTYPE = np.dtype([("xy", "<f8", (2, )), ("point3D_id", "<i8")])
+# Same layout as a points3D.bin record without its track
+POINT3D_RECORD = np.dtype([("point3D_id", "<u8"), ("xyz", "<f8", (3, )),
+                           ("rgb", "u1", (3, )), ("error", "<f8"),
+                           ("track_length", "<u8")])
+POINT3D_DTYPE = np.dtype(POINT3D_RECORD.descr + [("track_start", "<u8")])
+# Same layout as a track element in points3D.bin
+TRACK_DTYPE = np.dtype([("image_id", "<u4"), ("point2D_idx", "<u4")])
+# Points gathered at once, bounds the size of the index arrays
+CHUNK_POINTS = 1 << 16
+# Thresholds of "check", a model below them is not worth densifying
+MIN_REGISTERED_RATIO = 0.5
+MAX_MEAN_ERROR = 2.0
+MIN_POINTS = 100
+
+
+def image_dtype(name_length=1):
+    return np.dtype([("image_id", "<u4"), ("qvec", "<f8", (4, )),
+                     ("tvec", "<f8", (3, )), ("camera_id", "<u4"),
+                     ("name", "U{0}".format(max(1, name_length))),
+                     ("points2D_start", "<u8"), ("num_points2D", "<u8")])
+
+
+def map_file(path):
+    """
+    Description: Read-only memory map of a file, empty bytes for an empty file
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_cameras(path):
+    """
+    Description: Cameras of a cameras.bin
+    Args:
+        path: cameras.bin
+        return: structured array of CAMERA_DTYPE
+    """
+    data = map_file(path)
+    count, = COUNT.unpack_from(data, 0)
+    cameras = np.zeros(count, dtype=CAMERA_DTYPE)
+    offset = COUNT.size
+    for index in range(count):
+        camera_id, model, width, height = CAMERA_HEADER.unpack_from(
+            data, offset)
+        offset += CAMERA_HEADER.size
+        params = CAMERA_MODELS[model][1]
+        cameras[index] = (camera_id, model, width, height,
+                          np.zeros(MAX_PARAMS))
+        cameras["params"][index, :params] = np.frombuffer(data,
+                                                          dtype="<f8",
+                                                          count=params,
+                                                          offset=offset)
+        offset += 8 * params
+    return cameras
+
+
+def read_images(path):
+    """
+    Description: Registered images of an images.bin with their 2D points
+    Args:
+        path: images.bin
+        return: (images, points2D), structured arrays of image_dtype() and POINT2D_DTYPE
+    """
+    data = map_file(path)
+    count, = COUNT.unpack_from(data, 0)
+    headers = []
+    names = []
+    slices = []
+    offset = COUNT.size
+    start = 0
+    for _ in range(count):
+        headers.append(IMAGE_HEADER.unpack_from(data, offset))
+        offset += IMAGE_HEADER.size
+        end = data.find(b"\x00", offset)
+        names.append(data[offset:end].decode("utf-8"))
+        offset = end + 1
+        points, = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        slices.append((offset, points, start))
+        offset += points * POINT2D_DTYPE.itemsize
+        start += points
+    images = np.zeros(count, dtype=image_dtype(max(map(len, names),
+                                                   default=1)))
+    for index, header in enumerate(headers):
+        images[index] = (header[0], header[1:5], header[5:8], header[8],
+                         names[index], slices[index][2], slices[index][1])
+    points2D = np.empty(start, dtype=POINT2D_DTYPE)
+    for offset, points, first in slices:
+        points2D[first:first + points] = np.frombuffer(data,
+                                                       dtype=POINT2D_DTYPE,
+                                                       count=points,
+                                                       offset=offset)
+    return images, points2D
+
+
+def gather(buffer, offsets, size):
+    """
+    Description: Copy size bytes at every offset of a byte array
+    Args:
+        buffer: uint8 array
+        offsets: int64 array
+        return: uint8 array of shape (len(offsets), size)
+    """
+    return buffer[offsets[:, None] + np.arange(size)]
+
+
+def read_points3D(path):
+    """
+    Description: 3D points of a points3D.bin with their tracks
+    Args:
+        path: points3D.bin
+        return: (points3D, tracks), structured arrays of POINT3D_DTYPE and TRACK_DTYPE
+    """
+    data = map_file(path)
+    count, = COUNT.unpack_from(data, 0)
+    # Records have the size of their track, only their offsets are walked in Python
+    offsets = np.empty(count, dtype=np.int64)
+    length_offset = POINT3D_RECORD.fields["track_length"][1]
+    unpack = COUNT.unpack_from
+    offset = COUNT.size
+    for index in range(count):
+        offsets[index] = offset
+        offset += POINT3D_RECORD.itemsize + TRACK_DTYPE.itemsize * unpack(
+            data, offset + length_offset)[0]
+    buffer = np.frombuffer(data, dtype=np.uint8) if count else np.empty(
+        0, dtype=np.uint8)
+    points = np.zeros(count, dtype=POINT3D_DTYPE)
+    for first in range(0, count, CHUNK_POINTS):
+        chunk = offsets[first:first + CHUNK_POINTS]
+        records = gather(buffer, chunk,
+                         POINT3D_RECORD.itemsize).view(POINT3D_RECORD)[:, 0]
+        for field in POINT3D_RECORD.names:
+            points[field][first:first + len(chunk)] = records[field]
+    lengths = points["track_length"].astype(np.int64)
+    starts = np.cumsum(lengths) - lengths
+    points["track_start"] = starts
+    tracks = np.empty(int(lengths.sum()), dtype=TRACK_DTYPE)
+    for first in range(0, count, CHUNK_POINTS):
+        chunk = slice(first, first + CHUNK_POINTS)
+        chunk_lengths = lengths[chunk]
+        if not chunk_lengths.sum():
+            continue
+        # Offset of every track element, the record's track plus its rank in the track
+        rank = np.arange(chunk_lengths.sum()) - np.repeat(
+            np.cumsum(chunk_lengths) - chunk_lengths, chunk_lengths)
+        elements = np.repeat(offsets[chunk] + POINT3D_RECORD.itemsize,
+                             chunk_lengths) + TRACK_DTYPE.itemsize * rank
+        begin = starts[first]
+        tracks[begin:begin + len(elements)] = gather(
+            buffer, elements, TRACK_DTYPE.itemsize).view(TRACK_DTYPE)[:, 0]
+    return points, tracks
+
+
+def read_model(folder):
+    """
+    Description: Binary COLMAP model of a folder
+    Args:
+        folder: folder with cameras.bin, images.bin and points3D.bin
+        return: dict with cameras, images, points2D, points3D and tracks, see the module description
+    """
+    images, points2D = read_images(os.path.join(folder, "images.bin"))
+    points3D, tracks = read_points3D(os.path.join(folder, "points3D.bin"))
+    return {
+        "cameras": read_cameras(os.path.join(folder, "cameras.bin")),
+        "images": images,
+        "points2D": points2D,
+        "points3D": points3D,
+        "tracks": tracks,
+    }
+
+
+def write_cameras(path, cameras):
+    with open(path, "wb") as file:
+        file.write(COUNT.pack(len(cameras)))
+        for camera in cameras:
+            file.write(
+                CAMERA_HEADER.pack(int(camera["camera_id"]),
+                                   int(camera["model"]), int(camera["width"]),
+                                   int(camera["height"])))
+            params = CAMERA_MODELS[int(camera["model"])][1]
+            file.write(camera["params"][:params].astype("<f8").tobytes())
+
+
+def write_images(path, images, points2D):
+    with open(path, "wb") as file:
+        file.write(COUNT.pack(len(images)))
+        for image in images:
+            file.write(
+                IMAGE_HEADER.pack(int(image["image_id"]), *image["qvec"],
+                                  *image["tvec"], int(image["camera_id"])))
+            file.write(str(image["name"]).encode("utf-8") + b"\x00")
+            start = int(image["points2D_start"])
+            points = int(image["num_points2D"])
+            file.write(COUNT.pack(points))
+            file.write(points2D[start:start + points].astype(
+                POINT2D_DTYPE, copy=False).tobytes())
+
+
+def write_points3D(path, points, tracks):
+    count = len(points)
+    lengths = points["track_length"].astype(np.int64)
+    sizes = POINT3D_RECORD.itemsize + TRACK_DTYPE.itemsize * lengths
+    offsets = np.cumsum(sizes) - sizes
+    buffer = np.empty(int(sizes.sum()), dtype=np.uint8)
+    records = np.empty(count, dtype=POINT3D_RECORD)
+    for field in POINT3D_RECORD.names:
+        records[field] = points[field]
+    records = records.view(np.uint8).reshape(count, POINT3D_RECORD.itemsize)
+    trackBytes = tracks.astype(TRACK_DTYPE, copy=False).view(np.uint8)
+    for first in range(0, count, CHUNK_POINTS):
+        chunk = slice(first, first + CHUNK_POINTS)
+        buffer[offsets[chunk][:, None] +
+               np.arange(POINT3D_RECORD.itemsize)] = records[chunk]
+        chunk_lengths = lengths[chunk]
+        if not chunk_lengths.sum():
+            continue
+        rank = np.arange(chunk_lengths.sum()) - np.repeat(
+            np.cumsum(chunk_lengths) - chunk_lengths, chunk_lengths)
+        elements = np.repeat(offsets[chunk] + POINT3D_RECORD.itemsize,
+                             chunk_lengths) + TRACK_DTYPE.itemsize * rank
+        sources = np.repeat(points["track_start"][chunk].astype(np.int64),
+                            chunk_lengths) + rank
+        buffer[elements[:, None] + np.arange(TRACK_DTYPE.itemsize)] = \
+            trackBytes.reshape(-1, TRACK_DTYPE.itemsize)[sources]
+    with open(path, "wb") as file:
+        file.write(COUNT.pack(count))
+        buffer.tofile(file)
+
+
+def write_model(folder, model):
+    """
+    Description: Write a model as read by read_model in COLMAP's binary format
+    """
+    os.makedirs(folder, exist_ok=True)
+    write_cameras(os.path.join(folder, "cameras.bin"), model["cameras"])
+    write_images(os.path.join(folder, "images.bin"), model["images"],
+                 model["points2D"])
+    write_points3D(os.path.join(folder, "points3D.bin"), model["points3D"],
+                   model["tracks"])
+
+
+def filter_points(model, keep):
+    """
+    Description: Model without some of its 3D points, their observations are unlinked in the images
+    Args:
+        model: dict from read_model
+        keep: boolean array, one entry per 3D point
+        return: dict like read_model, the arrays of the kept points are copies
+    """
+    points = model["points3D"]
+    lengths = points["track_length"].astype(np.int64)
+    kept = points[keep]
+    kept["track_start"] = np.cumsum(kept["track_length"]) - kept["track_length"]
+    tracks = model["tracks"][np.repeat(keep, lengths)]
+    points2D = model["points2D"].copy()
+    linked = points2D["point3D_id"] >= 0
+    dropped = np.isin(points2D["point3D_id"][linked],
+                      points["point3D_id"][~keep].astype(np.int64))
+    ids = points2D["point3D_id"][linked]
+    ids[dropped] = -1
+    points2D["point3D_id"][linked] = ids
+    return dict(model, points2D=points2D, points3D=kept, tracks=tracks)
+
+
+def model_stats(model):
+    """
+    Description: Summary of a sparse model
+    Args:
+        model: dict from read_model
+        return: dict
+    """
+    points = model["points3D"]
+    image_ids = model["images"]["image_id"].astype(np.int64)
+    # Images without observations, e.g. after filter_points, count as 0
+    observations = np.bincount(
+        model["tracks"]["image_id"].astype(np.int64),
+        minlength=int(image_ids.max()) + 1 if len(image_ids) else 0)
+    per_image = observations[image_ids]
+    return {
+        "cameras": len(model["cameras"]),
+        "images": len(model["images"]),
+        "points": len(points),
+        "observations": len(model["tracks"]),
+        "mean_track_length":
+        float(points["track_length"].mean()) if len(points) else 0.0,
+        "mean_error": float(points["error"].mean()) if len(points) else 0.0,
+        "median_error":
+        float(np.median(points["error"])) if len(points) else 0.0,
+        "mean_observations_per_image":
+        float(per_image.mean()) if len(per_image) else 0.0,
+        "min_observations_per_image":
+        int(per_image.min()) if len(per_image) else 0,
+    }
+
+
+def sub_models(sparse_folder):
+    """
+    Description: Models the mapper wrote into a folder, sparse/0, sparse/1...
+    Args:
+        return: sorted list of folder names. The pipeline empties the folder before
+                the mapper runs, so they all come from the same run
+    """
+    if not os.path.isdir(sparse_folder):
+        return []
+    return sorted((name for name in os.listdir(sparse_folder)
+                   if name.isdigit() and os.path.isfile(
+                       os.path.join(sparse_folder, name, "images.bin"))),
+                  key=int)
+
+
+def check_models(sparse_folder,
+                 image_count,
+                 min_registered_ratio=MIN_REGISTERED_RATIO,
+                 max_mean_error=MAX_MEAN_ERROR,
+                 min_points=MIN_POINTS,
+                 min_mean_track_length=None):
+    """
+    Description: Score the models of a mapper output and pick the one the dense stages should use
+    Args:
+        sparse_folder: mapper output folder holding the numbered models
+        image_count: images the mapper was given
+        min_registered_ratio, max_mean_error, min_points, min_mean_track_length: thresholds the
+            selected model has to meet, None to skip one
+        return: dict with the stats of every model, the selected model and the problems found
+    """
+    models = []
+    for name in sub_models(sparse_folder):
+        stats = model_stats(read_model(os.path.join(sparse_folder, name)))
+        stats["model"] = name
+        stats["registered_ratio"] = stats["images"] / float(
+            max(image_count, 1))
+        models.append(stats)
+    result = {"images": image_count, "models": models, "selected": None}
+    problems = []
+    if not models:
+        problems.append("the mapper produced no model")
+    else:
+        # Most registered images, then most points: the other models are disjoint pieces
+        best = max(models, key=lambda stats: (stats["images"], stats["points"]))
+        result["selected"] = best["model"]
+        if (min_registered_ratio is not None
+                and best["registered_ratio"] < min_registered_ratio):
+            problems.append(
+                "{0} of {1} images registered ({2:.0%}), less than {3:.0%}".
+                format(best["images"], image_count, best["registered_ratio"],
+                       min_registered_ratio))
+        if max_mean_error is not None and best["mean_error"] > max_mean_error:
+            problems.append(
+                "mean reprojection error {0:.2f}px, more than {1}px".format(
+                    best["mean_error"], max_mean_error))
+        if min_points is not None and best["points"] < min_points:
+            problems.append("{0} points, fewer than {1}".format(
+                best["points"], min_points))
+        if (min_mean_track_length is not None
+                and best["mean_track_length"] < min_mean_track_length):
+            problems.append("mean track length {0:.2f}, less than {1}".format(
+                best["mean_track_length"], min_mean_track_length))
+    result["problems"] = problems
+    return result
+
+
+def promote_model(sparse_folder, name):
+    """
+    Description: Swap a model with sparse/0, the folder every later stage reads
+    """
+    if name == "0":
+        return
+    first = os.path.join(sparse_folder, "0")
+    chosen = os.path.join(sparse_folder, name)
+    if not os.path.exists(first):
+        os.rename(chosen, first)
+        return
+    swap = os.path.join(sparse_folder, ".swap")
+    os.rename(first, swap)
+    os.rename(chosen, first)
+    os.rename(swap, chosen)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Read, summarize and filter COLMAP binary models")
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+    stats_parser = subparsers.add_parser("stats", help="Summarize a model")
+    stats_parser.add_argument("model", help="Folder with the .bin files")
+    stats_parser.add_argument("--json",
+                              type=str,
+                              help="File receiving the summary as json")
+    stats_parser.add_argument(
+        "--drop-text",
+        action="store_true",
+        help="Remove the .txt model files next to the .bin ones, InterfaceCOLMAP reads the text files first")
+    filter_parser = subparsers.add_parser(
+        "filter", help="Drop badly observed 3D points")
+    filter_parser.add_argument("model", help="Folder with the .bin files")
+    filter_parser.add_argument("--output",
+                               type=str,
+                               required=True,
+                               help="Folder receiving the filtered model")
+    filter_parser.add_argument(
+        "--max-error",
+        type=float,
+        help="Largest mean reprojection error of a kept point, in pixels")
+    filter_parser.add_argument(
+        "--min-track-length",
+        type=int,
+        default=2,
+        help="Fewest images observing a kept point. Default: 2")
+    check_parser = subparsers.add_parser(
+        "check", help="Pick the best model of a mapper output and check it")
+    check_parser.add_argument(
+        "sparse", help="Mapper output folder with the numbered models")
+    check_parser.add_argument("--database",
+                              type=str,
+                              required=True,
+                              help="COLMAP database.db, for the image count")
+    check_parser.add_argument("--json",
+                              type=str,
+                              help="File receiving the scores as json")
+    check_parser.add_argument(
+        "--min-registered-ratio",
+        type=float,
+        default=MIN_REGISTERED_RATIO,
+        help="Smallest share of the images registered. Default: {0}".format(
+            MIN_REGISTERED_RATIO))
+    check_parser.add_argument(
+        "--max-mean-error",
+        type=float,
+        default=MAX_MEAN_ERROR,
+        help="Largest mean reprojection error in pixels. Default: {0}".format(
+            MAX_MEAN_ERROR))
+    check_parser.add_argument(
+        "--min-points",
+        type=int,
+        default=MIN_POINTS,
+        help="Fewest 3D points. Default: {0}".format(MIN_POINTS))
+    check_parser.add_argument("--min-mean-track-length",
+                              type=float,
+                              help="Smallest mean track length")
+    return parser
+
+
+def check(args):
+    db = connect(args.database)
+    try:
+        image_count = len(read_database_images(db))
+    finally:
+        db.close()
+    result = check_models(args.sparse, image_count,
+                          args.min_registered_ratio, args.max_mean_error,
+                          args.min_points, args.min_mean_track_length)
+    print(
+        tabulate([[
+            stats["model"], stats["images"], "{0:.0%}".format(
+                stats["registered_ratio"]), stats["points"],
+            stats["mean_track_length"], stats["mean_error"]
+        ] for stats in result["models"]],
+                 headers=[
+                     "Model", "Images", "Registered", "Points",
+                     "Track length", "Error (px)"
+                 ],
+                 floatfmt=".2f"))
+    if result["selected"] is not None:
+        print("Selected model {0}".format(result["selected"]))
+        promote_model(args.sparse, result["selected"])
+    if args.json:
+        with open(args.json + ".tmp", "w") as file:
+            json.dump(result, file, indent=1)
+        os.replace(args.json + ".tmp", args.json)
+    for problem in result["problems"]:
+        print("Sparse model check failed: {0}".format(problem))
+    return 1 if result["problems"] else 0
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    if args.action == "check":
+        return check(args)
+    model = read_model(args.model)
+    if args.action == "filter":
+        points = model["points3D"]
+        keep = points["track_length"] >= args.min_track_length
+        if args.max_error is not None:
+            keep &= points["error"] <= args.max_error
+        model = filter_points(model, keep)
+        write_model(args.output, model)
+        print("Kept {0} of {1} points".format(len(model["points3D"]),
+                                              len(points)))
+    stats = model_stats(model)
+    for key, value in stats.items():
+        print("{0}: {1}".format(key, value))
+    if args.action == "stats" and args.json:
+        with open(args.json, "w") as file:
+            json.dump(stats, file, indent=1)
+    if args.action == "stats" and args.drop_text:
+        # Left by an earlier model_converter run, they would shadow the binary model
+        for name in ["cameras.txt", "images.txt", "points3D.txt"]:
+            path = os.path.join(args.model, name)
+            if os.path.exists(path):
+                os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
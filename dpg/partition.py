@@ -0,0 +1,182 @@
+"""
+Description: Split the view graph of a large scene into overlapping clusters.
+
+The images are ordered by a breadth-first walk of the view graph, starting
+from a peripheral image and following the strongest matches first, so images
+close in the ordering also overlap in the scene. The ordering is cut into
+equal chunks, and every chunk is grown with the images of the neighboring
+chunks it shares the most inlier matches with. Consecutive clusters then
+have common images, which colmap model_merger needs to align their models.
+
+Each cluster gets an image list for colmap mapper --image_list_path.
+
+Usage:
+    partition_scene.py --database database.db --clusters 4 --output partitions
+"""
+
+import argparse, json, math, os, sys
+from collections import deque
+
+import numpy as np
+
+from dpg.database import (MIN_INLIERS, DEGENERATE_CONFIGS, connect,
+                          read_images, read_two_view_geometries)
+
+# Images shared by two consecutive clusters, as a share of the cluster size
+OVERLAP = 0.15
+# model_merger needs enough common registered images to estimate the alignment
+MIN_OVERLAP = 10
+
+
+def read_view_graph(path, min_inliers=MIN_INLIERS):
+    """
+    Description: Weighted view graph of a COLMAP database
+    Args:
+        path: database.db
+        min_inliers: inlier matches needed to link two images
+        return: (dict image_id -> name, dict image_id -> {neighbor id: inliers})
+    """
+    db = connect(path)
+    try:
+        images = read_images(db)
+        geometries = read_two_view_geometries(db)
+    finally:
+        db.close()
+    usable = ((geometries["inliers"] >= min_inliers)
+              & ~np.isin(geometries["config"], DEGENERATE_CONFIGS))
+    graph = {image_id: {} for image_id in images}
+    for first, second, inliers in zip(
+            geometries["image_id1"][usable].tolist(),
+            geometries["image_id2"][usable].tolist(),
+            geometries["inliers"][usable].tolist()):
+        graph[first][second] = inliers
+        graph[second][first] = inliers
+    return images, graph
+
+
+def walk(graph, start, allowed):
+    """
+    Description: Breadth-first walk following the strongest edges first
+    Args:
+        return: list of visited image ids, in order
+    """
+    order = [start]
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        for neighbor in sorted(graph[node], key=graph[node].get,
+                               reverse=True):
+            if neighbor in allowed and neighbor not in seen:
+                seen.add(neighbor)
+                order.append(neighbor)
+                queue.append(neighbor)
+    return order
+
+
+def spatial_order(graph):
+    """
+    Description: Order all images so that neighbors in the view graph stay close, component by component
+    """
+    remaining = set(graph)
+    order = []
+    while remaining:
+        start = min(remaining)
+        component = set(walk(graph, start, remaining))
+        # The last image reached from anywhere is on the border of the component
+        peripheral = walk(graph, start, component)[-1]
+        order += walk(graph, peripheral, component)
+        remaining -= component
+    return order
+
+
+def partition(graph, clusters, overlap=OVERLAP, min_overlap=MIN_OVERLAP):
+    """
+    Description: Split the view graph into overlapping clusters
+    Args:
+        graph: dict image_id -> {neighbor id: inliers}
+        clusters: number of clusters
+        overlap: share of a cluster added from the neighboring clusters
+        min_overlap: smallest number of images added from the neighboring clusters
+        return: list of sorted lists of image ids
+    """
+    order = spatial_order(graph)
+    cores = [
+        order[len(order) * index // clusters:len(order) * (index + 1) //
+              clusters] for index in range(clusters)
+    ]
+    result = []
+    for index, core in enumerate(cores):
+        members = set(core)
+        candidates = set()
+        for neighbor_index in (index - 1, index + 1):
+            if 0 <= neighbor_index < len(cores):
+                candidates.update(cores[neighbor_index])
+        score = {}
+        for image_id in candidates:
+            score[image_id] = sum(inliers
+                                  for neighbor, inliers in graph[image_id].items()
+                                  if neighbor in members)
+        extra = max(min_overlap, int(math.ceil(overlap * len(core))))
+        ranked = sorted((image_id for image_id in candidates
+                         if score[image_id] > 0),
+                        key=score.get,
+                        reverse=True)
+        result.append(sorted(members.union(ranked[:extra])))
+    return result
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Split a COLMAP scene into overlapping clusters")
+    parser.add_argument("--database",
+                        type=str,
+                        required=True,
+                        help="COLMAP database.db")
+    parser.add_argument("--clusters",
+                        type=int,
+                        required=True,
+                        help="Number of clusters")
+    parser.add_argument("--output",
+                        type=str,
+                        required=True,
+                        help="Folder receiving cluster_<n>/images.txt")
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=OVERLAP,
+        help="Share of a cluster taken from its neighbors. Default: {0}".format(
+            OVERLAP))
+    parser.add_argument(
+        "--min-inliers",
+        type=int,
+        default=MIN_INLIERS,
+        help="Inlier matches needed to link two images. Default: {0}".format(
+            MIN_INLIERS))
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    images, graph = read_view_graph(args.database, args.min_inliers)
+    if len(images) < args.clusters:
+        # An empty image list would make the mapper use every image
+        print("{0} images cannot be split into {1} clusters".format(
+            len(images), args.clusters))
+        return 1
+    clusters = partition(graph, args.clusters, args.overlap)
+    summary = []
+    for index, cluster in enumerate(clusters):
+        folder = os.path.join(args.output, "cluster_{0}".format(index))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "images.txt"), "w") as file:
+            file.writelines(images[image_id] + "\n" for image_id in cluster)
+        summary.append([images[image_id] for image_id in cluster])
+        print("Cluster {0}: {1} images".format(index, len(cluster)))
+    with open(os.path.join(args.output, "partition.json"), "w") as file:
+        json.dump({"clusters": summary}, file, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1516 @@
+"""
+Description: The COLMAP/OpenMVG + OpenMVS pipeline as a library.
+
+build_plan turns a PipelineConfig into the list of stages of one run, and run
+executes a plan. All the state of a run lives in its Plan, so one process can
+build and run any number of pipelines, one after the other or side by side:
+
+    from dpg.pipeline import PipelineConfig, build_plan, run
+
+    config = PipelineConfig("/data/scene", run_colmap=True, run_openmvs=True,
+                            densify=True)
+    report = run(build_plan(config))
+
+run_pipeline does the same on the caller's asyncio event loop, cancelling its
+task stops the tools of the run:
+
+    report = await run_pipeline(config)
+
+The SfM part is done by a backend (dpg.sfm), COLMAP or OpenMVG, and the
+OpenMVS stages continue from the scene it exports. The host is described in
+the background, from a per-host cache (dpg.host). COLMAP_MVS_pipeline.py and
+pipeline.py are the command line front ends.
+"""
+
+import argparse, asyncio, datetime, logging, math, os, platform, sys, threading
+import psutil
+from tabulate import tabulate
+
+from dpg.cache import StageCache
+from dpg.scheduler import run_graph
+from dpg.admission import AdmissionController
+from dpg.threads import thread_env, with_threads
+from dpg.profiler import StageProfiler, ProfileReport
+from dpg.report import RunReport
+from dpg.checkpoint import RunState, select_stages
+from dpg.matchers import MATCHERS
+from dpg.model import MIN_REGISTERED_RATIO, MAX_MEAN_ERROR, MIN_POINTS
+from dpg.executor import LocalExecutor, QueueExecutor
+from dpg.runner import apply_timeouts, clean_folders, terminate_all
+from dpg.host import HOST_CACHE_TTL, HostProbe
+from dpg.upload import UPLOAD_INTERVAL, LogUploader
+from dpg.estimate import (REPORT_PATTERN, describe_scene, estimate_plan,
+                          load_rates, print_estimate, stage_work,
+                          write_estimate)
+from dpg.images import image_sizes, scaled_size
+from dpg.resolution import (GB, MEMORY_SHARE, MIN_RESOLUTION, QUALITY,
+                            QUALITY_PRESETS, choose_resolutions)
+from dpg.sfm import (SCRIPTS_DIR, SFM_BACKENDS, OPENMVG_ENGINES,
+                     create_backend, openmvs_binaries)
+
+logger = logging.getLogger("GraphEngine")
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="OpenMVG/OpenMVS pipeline")
+    parser._action_groups.pop()
+
+    required = parser.add_argument_group("Required arguments")
+    required.add_argument(
+        "--input",
+        type=str,
+        help="Scene folder holding the images in images/, or the images folder itself",
+        required=True)
+    required.add_argument("--output",
+                          type=str,
+                          help="Output path",
+                          required=False)
+
+    pipelines = parser.add_argument_group("Pipelines to run (min. 1 required)")
+    pipelines.add_argument("--run-openmvg",
+                           action="store_true",
+                           help="Run OpenMVG pipeline")
+    pipelines.add_argument("--run-openmvs",
+                           action="store_true",
+                           help="Run OpenMVS pipeline")
+    pipelines.add_argument("--run-colmap",
+                           action="store_true",
+                           help="Run Colmap pipeline")
+    pipelines.add_argument(
+        "--sfm-backend",
+        type=str,
+        choices=SFM_BACKENDS,
+        help="SfM backend whose model --run-openmvs continues from. Default: the one run with --run-colmap/--run-openmvg, else colmap",
+    )
+
+    optional = parser.add_argument_group("Optional arguments")
+    optional.add_argument("--debug",
+                          action="store_true",
+                          help="Print commands without executing them")
+    optional.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Predict the runtime, memory and disk use of every stage from earlier run reports, without executing anything. Exits with 1 when the run does not fit the host",
+    )
+    optional.add_argument(
+        "--estimate-output",
+        type=str,
+        help="Also write the --estimate prediction to this JSON file",
+    )
+    optional.add_argument(
+        "--estimate-reports",
+        type=str,
+        action="append",
+        help="Glob of the run reports --estimate learns from. Repeatable. Default: GraphEngine_*_report.json in the current and the output folder",
+    )
+    optional.add_argument("--recompute",
+                          action="store_true",
+                          help="Recompute everything, ignoring the stage cache")
+    optional.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of independent stages to run at the same time. Default: 1",
+    )
+    optional.add_argument(
+        "--no-admission",
+        action="store_true",
+        help="Start stages without waiting for enough free RAM/CPU/GPU on the host",
+    )
+    optional.add_argument(
+        "--admission-dir",
+        type=str,
+        help="Folder shared by all pipelines on the host to coordinate admission. Default: <tmp>/dpg_admission",
+    )
+    optional.add_argument(
+        "--cpu-budget",
+        type=int,
+        help="Cores the stages of all the pipelines on the host share. Default: all the cores this process may use",
+    )
+    optional.add_argument(
+        "--no-thread-budget",
+        action="store_true",
+        help="Let every tool start one thread per core instead of handing it a share of the CPU budget",
+    )
+    optional.add_argument(
+        "--no-affinity",
+        action="store_true",
+        help="Do not pin the running stages to disjoint blocks of cores",
+    )
+    optional.add_argument(
+        "--profile-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between two CPU/RAM/IO/GPU samples of each stage, written next to the log. 0 disables. Default: 1",
+    )
+    optional.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the stages that completed in the previous run and whose outputs are unchanged",
+    )
+    optional.add_argument(
+        "--from-stage",
+        type=str,
+        help="Start at this stage (title or tool name, e.g. RefineMesh)",
+    )
+    optional.add_argument(
+        "--to-stage",
+        type=str,
+        help="Stop after this stage (title or tool name, e.g. DensifyPointCloud)",
+    )
+    optional.add_argument(
+        "--stage-timeout",
+        type=str,
+        action="append",
+        help="Stop a stage running longer than SECONDS, given as SECONDS for every stage or STAGE=SECONDS (title or tool name, e.g. RefineMesh=7200). Repeatable",
+    )
+    optional.add_argument(
+        "--idle-timeout",
+        type=str,
+        action="append",
+        help="Stop a stage printing nothing for SECONDS, given as SECONDS or STAGE=SECONDS. Repeatable",
+    )
+    optional.add_argument(
+        "--executor",
+        type=str,
+        default="local",
+        choices=["local", "queue"],
+        help="Run stages here, or on the workers of a shared job queue (see queue_worker.py). Default: local",
+    )
+    optional.add_argument(
+        "--queue-dir",
+        type=str,
+        help="Job queue folder shared with the workers, required with --executor queue",
+    )
+    optional.add_argument(
+        "--report",
+        type=str,
+        help="Path of the JSON run report. Default: <log>_report.json",
+    )
+    optional.add_argument(
+        "--host-cache-ttl",
+        type=float,
+        default=HOST_CACHE_TTL,
+        help="Seconds the hardware description cached in ~/.cache/dpg stays valid, 0 probes on every run. Default: {0}".format(HOST_CACHE_TTL),
+    )
+    optional.add_argument(
+        "--upload-url",
+        type=str,
+        help="Upload the log and the run report to this URL while the run goes on (see dpg/upload.py)",
+    )
+    optional.add_argument(
+        "--upload-interval",
+        type=float,
+        default=UPLOAD_INTERVAL,
+        help="Seconds between two uploads of the growing log. Default: {0}".format(UPLOAD_INTERVAL),
+    )
+    optional.add_argument(
+        "--log-file",
+        type=str,
+        help="Log file of the run. Default: GraphEngine_<date>.log in the current folder",
+    )
+    optional.add_argument("--openmvg",
+                          type=str,
+                          help="Location of openmvg. Default: /opt/openmvg")
+    optional.add_argument("--openmvs",
+                          type=str,
+                          help="Location of openmvs. Default: /opt/openmvs")
+    optional.add_argument("--colmap",
+                          type=str,
+                          help="Location of colmap. Default: /opt/colmap")
+    optional.add_argument(
+        "--use_gpu",
+        type=bool,
+        choices=[0, 1],
+        help="whether use gpu for feature extractor",
+    )
+
+    openmvg = parser.add_argument_group("OpenMVG")
+    openmvg.add_argument("--sfm-type",
+                         type=str,
+                         default="global",
+                         choices=sorted(OPENMVG_ENGINES),
+                         help="OpenMVG SfM type. Default: global")
+    openmvg.add_argument("--colorize",
+                         action="store_true",
+                         help="Create colorized sparse pointcloud")
+
+    preprocess = parser.add_argument_group("Image preprocessing")
+    preprocess.add_argument(
+        "--max-image-size",
+        type=int,
+        help="Apply the EXIF orientation and downsize the images to this width or height before Colmap. Default: use the images as they are",
+    )
+    preprocess.add_argument("--image-quality",
+                            type=int,
+                            default=95,
+                            help="JPEG quality of downsized images. Default: 95")
+    preprocess.add_argument(
+        "--preprocess-workers",
+        type=int,
+        help="Number of processes preprocessing images. Default: all cores")
+
+    # echo ">>>>>>>>>>>>>>Starting colmap feature extraction"
+    # colmap feature_extractor \
+    # --SiftExtraction.use_gpu $use_gpu \
+    # --ImageReader.camera_model OPENCV \
+    # --database_path $database_folder \
+    # --image_path $images_folder \
+    colmap_feature_extractor = parser.add_argument_group(
+        "Colmap feature extractor")
+    colmap_feature_extractor.add_argument(
+        "--camera_model",
+        type=str,
+        help="select camera model",
+        choices=["SIMPLE_RADIAL", "OPENCV"],
+    )
+
+    # colmap exhaustive_matcher \
+    # --SiftMatching.use_gpu $use_gpu \
+    # --database_path $database_folder \
+    colmap_matcher = parser.add_argument_group("Colmap matcher")
+    colmap_matcher.add_argument(
+        "--matcher",
+        type=str,
+        default="auto",
+        choices=["auto"] + MATCHERS,
+        help=
+        "Feature matcher. auto picks exhaustive for small scenes, then spatial (EXIF GPS), sequential (numbered frames) or vocab_tree. Default: auto",
+    )
+    colmap_matcher.add_argument(
+        "--exhaustive-limit",
+        type=int,
+        default=300,
+        help="Largest image count matched exhaustively with --matcher auto. Default: 300",
+    )
+    colmap_matcher.add_argument(
+        "--matcher-overlap",
+        type=int,
+        default=10,
+        help="Number of following images each image is matched against by the sequential matcher. Default: 10",
+    )
+    colmap_matcher.add_argument(
+        "--vocab-tree",
+        type=str,
+        help="Vocabulary tree file for vocab_tree matching and sequential loop detection",
+    )
+    colmap_matcher.add_argument(
+        "--vocab-tree-num-images",
+        type=int,
+        help="Number of nearest images retrieved per image by the vocab_tree matcher",
+    )
+    colmap_matcher.add_argument(
+        "--loop-detection",
+        action="store_true",
+        help="Enable loop detection in the sequential matcher (needs --vocab-tree)",
+    )
+    colmap_matcher.add_argument(
+        "--spatial-max-neighbors",
+        type=int,
+        help="Maximum number of GPS neighbors matched by the spatial matcher",
+    )
+    colmap_matcher.add_argument(
+        "--spatial-max-distance",
+        type=float,
+        help="Maximum distance in meters to GPS neighbors in the spatial matcher",
+    )
+    colmap_matcher.add_argument(
+        "--matcher-option",
+        type=str,
+        action="append",
+        help="Extra matcher option as KEY=VALUE, e.g. SiftMatching.max_num_matches=16384. Repeatable",
+    )
+
+    # colmap mapper \
+    # --database_path $database_folder \
+    # --image_path $images_folder \
+    # --output_path $output_folder \
+    colmap_mapper = parser.add_argument_group("Colmap mapper")
+    colmap_mapper.add_argument(
+        "--min-component-ratio",
+        type=float,
+        help="Stop before the mapper when the largest connected group of matched images holds a smaller share of the images, e.g. 0.9",
+    )
+    colmap_mapper.add_argument(
+        "--cluster-size",
+        type=int,
+        help="Split scenes with more images into overlapping clusters mapped in parallel, then merged. Default: map the whole scene at once",
+    )
+    colmap_mapper.add_argument(
+        "--cluster-overlap",
+        type=float,
+        default=0.15,
+        help="Share of a cluster's images shared with the neighboring clusters. Default: 0.15",
+    )
+    colmap_mapper.add_argument(
+        "--update",
+        action="store_true",
+        help="Register the images added to the scene since the last --run-colmap into its sparse/0 model, extracting and matching the new images only",
+    )
+
+    model_check = parser.add_argument_group("Sparse model check")
+    model_check.add_argument(
+        "--no-model-check",
+        action="store_true",
+        help="Go on to the dense stages without checking the sparse model",
+    )
+    model_check.add_argument(
+        "--min-registered-ratio",
+        type=float,
+        default=MIN_REGISTERED_RATIO,
+        help="Stop before the dense stages when the best model registered a smaller share of the images. Default: {0}"
+        .format(MIN_REGISTERED_RATIO),
+    )
+    model_check.add_argument(
+        "--max-mean-error",
+        type=float,
+        default=MAX_MEAN_ERROR,
+        help="Stop before the dense stages when the mean reprojection error of the model is larger, in pixels. Default: {0}"
+        .format(MAX_MEAN_ERROR),
+    )
+    model_check.add_argument(
+        "--min-model-points",
+        type=int,
+        default=MIN_POINTS,
+        help="Stop before the dense stages when the model has fewer 3D points. Default: {0}"
+        .format(MIN_POINTS),
+    )
+    model_check.add_argument(
+        "--min-mean-track-length",
+        type=float,
+        help="Stop before the dense stages when the points of the model are seen by fewer images on average",
+    )
+
+    # colmap image_undistorter \
+    # --image_path $images_folder \
+    # --input_path $output_folder/0 \
+    # --output_path $working_folder/dense \
+    # --output_type COLMAP \
+    colmap_image_undistorter = parser.add_argument_group(
+        "Colmap image undistorter")
+    colmap_image_undistorter.add_argument(
+        "--output_type",
+        type=str,
+        choices=["COLMAP"],
+        help="select image undistorter output type",
+    )
+    # colmap model_converter \
+    # --input_path $working_folder/dense/sparse \
+    # --output_path $working_folder/dense/sparse \
+    # --output_type TXT
+    colmap_model_converter = parser.add_argument_group(
+        "Colmap model converter")
+    colmap_model_converter.add_argument(
+        "--model-converter",
+        action="store_true",
+        help="Convert dense/sparse to text for InterfaceCOLMAP builds that only read text models. Default: InterfaceCOLMAP reads the binary model",
+    )
+
+    # sudo ./InterfaceCOLMAP \
+    # --working-folder $working_folder \
+    # -i $working_folder/dense/ \
+    # --output-file $working_folder/model_colmap.mvs
+
+    imageListing = parser.add_argument_group("OpenMVG Image Listing")
+    imageListing.add_argument(
+        "--cgroup",
+        action="store_true",
+        help="Each view has it's own camera intrisic parameters",
+    )
+    imageListing.add_argument(
+        "--flength",
+        type=float,
+        help=
+        "If your camera is not listed in the camera sensor database, you can set pixel focal length here. The value can be calculated by max(width-pixels, height-pixels) * focal length(mm) / Sensor width",
+    )
+    imageListing.add_argument(
+        "--cmodel",
+        type=int,
+        help=
+        "Camera model: 1. Pinhole 2. Pinhole Radial 1 3. Pinhole Radial 3 (Default) 4. Pinhole Brown 5. Pinhole with a Simple Fish-eye Distortion",
+        choices=[1, 2, 3, 4, 5],
+    )
+
+    computeFeature = parser.add_argument_group("OpenMVG Compute Features")
+    computeFeature.add_argument(
+        "--descmethod",
+        type=str,
+        help="Method to describe and image. Default: SIFT",
+        choices=["SIFT", "AKAZE_FLOAT", "AKAZE_MLDB"],
+    )
+    computeFeature.add_argument(
+        "--dpreset",
+        type=str,
+        help=
+        "Used to control the Image_describer configuration. Default: NORMAL",
+        choices=["NORMAL", "HIGH", "ULTRA"],
+    )
+    computeFeature.add_argument(
+        "--upright",
+        action="store_true",
+        help=
+        "Use upright feature or not. 0 (default) 1: Extract upright feature",
+    )
+
+    computeMatches = parser.add_argument_group("OpenMVG Compute Matches")
+    computeMatches.add_argument(
+        "--ratio",
+        type=float,
+        help=
+        "Nearest Neighbor distance ratio (smaller is more restrictive => Less false positives). Default: 0.8",
+    )
+    computeMatches.add_argument(
+        "--geomodel",
+        type=str,
+        help=
+        "Compute Matches geometric model: f: Fundamental matrix filtering (default) For Incremental SfM e: Essential matrix filtering For Global SfM h: Homography matrix filtering For datasets that have same point of projection",
+        choices=["f", "e", "h"],
+    )
+    computeMatches.add_argument(
+        "--matching",
+        type=str,
+        help=
+        "Compute matches nearest matching method. Default: FASTCASCADEHASHINGL2",
+        choices=[
+            "BRUTEFORCEL2", "ANNL2", "CASCADEHASHINGL2", "FASTCASCADEHASHINGL2"
+        ],
+    )
+
+    incrementalSfm = parser.add_argument_group("OpenMVG Incremental SfM")
+    incrementalSfm.add_argument(
+        "--icmodel",
+        type=int,
+        help=
+        "The camera model type that will be used for views with unknown intrinsic: 1. Pinhole 2. Pinhole radial 1 3. Pinhole radial 3 (default) 4. Pinhole radial 3 + tangential 2 5. Pinhole fisheye",
+        choices=[1, 2, 3, 4, 5],
+    )
+
+    globalSfm = parser.add_argument_group("OpenMVG Global SfM")
+    globalSfm.add_argument(
+        "--grotavg",
+        type=int,
+        help=
+        "1. L1 rotation averaging [Chatterjee] 2. L2 rotation averaging [Martinec] (default)",
+        choices=[1, 2],
+    )
+    globalSfm.add_argument(
+        "--gtransavg",
+        type=int,
+        help=
+        "1: L1 translation averaging [GlobalACSfM] 2: L2 translation averaging [Kyle2014] 3: SoftL1 minimization [GlobalACSfM] (default)",
+        choices=[1, 2, 3],
+    )
+
+    openmvs = parser.add_argument_group("OpenMVS")
+    openmvs.add_argument(
+        "--output-obj",
+        action="store_true",
+        help="Output mesh files as obj instead of ply",
+    )
+    openmvs.add_argument(
+        "--mvs-quality",
+        type=str,
+        default=QUALITY,
+        choices=sorted(QUALITY_PRESETS) + ["off"],
+        help="Image resolution the densify, refine and texture stages aim at, lowered until they fit the memory and --mvs-time-budget. off keeps the OpenMVS defaults. Default: {0}"
+        .format(QUALITY),
+    )
+    openmvs.add_argument(
+        "--mvs-time-budget",
+        type=float,
+        help="Minutes the densify, refine and texture stages may take together, estimated from earlier run reports",
+    )
+    openmvs.add_argument(
+        "--mvs-memory",
+        type=float,
+        help="GB of memory the OpenMVS stages may use. Default: {0:.0%}% of the host memory"
+        .format(MEMORY_SHARE),
+    )
+
+    openmvsDensify = parser.add_argument_group("OpenMVS DensifyPointCloud")
+    openmvsDensify.add_argument("--densify",
+                                action="store_true",
+                                help="Enable dense reconstruction")
+    openmvsDensify.add_argument("--densify-only",
+                                action="store_true",
+                                help="Densify pointcloud and exit")
+    openmvsDensify.add_argument(
+        "--dnumviews",
+        type=int,
+        help=
+        "Number of view used for depth-map estimation. 0 for all neighbor views available. Default: 4",
+    )
+    openmvsDensify.add_argument(
+        "--dnumviewsfuse",
+        type=int,
+        help=
+        "Minimum number of images that agrees with an estimate during fusion in order to consider it inliner. Default: 3",
+    )
+    openmvsDensify.add_argument(
+        "--dreslevel",
+        type=int,
+        help=
+        "How many times to scale down the images before point cloud computation. For better accuracy/speed with high resolution images use 2 or even 3. Default: set by --mvs-quality",
+    )
+    openmvsDensify.add_argument(
+        "--densify-tiles",
+        type=int,
+        default=1,
+        help="Densify this many subsets of neighboring views concurrently and merge their point clouds. Default: 1",
+    )
+
+    openmvsReconstruct = parser.add_argument_group("OpenMVS Reconstruct Mesh")
+    openmvsReconstruct.add_argument(
+        "--rcthickness",
+        type=int,
+        help="ReconstructMesh thickness factor. Default: 2")
+    openmvsReconstruct.add_argument(
+        "--rcdistance",
+        type=int,
+        help=
+        "Minimum distance in pixels between the projection of two 3D points to consider them different while triangulating (0 to disable). Use to reduce amount of memory used with a penalty of lost detail. Default: 2",
+    )
+
+    openmvsRefinemesh = parser.add_argument_group("OpenMVS Refine Mesh")
+    openmvsRefinemesh.add_argument(
+        "--rmiterations",
+        type=int,
+        help="Number of RefineMesh iterations. Default: 3")
+    openmvsRefinemesh.add_argument(
+        "--rmlevel",
+        type=int,
+        help=
+        "Times to scale down the images before mesh refinement. Default: set by --mvs-quality",
+    )
+    openmvsRefinemesh.add_argument(
+        "--rmcuda",
+        action="store_true",
+        help="Refine using CUDA version of RefineMesh (if available)",
+    )
+
+    openmvsRefinemesh.add_argument(
+        "--no_refine",
+        action="store_true",
+        help="Do not refine the mesh",
+    )
+
+    openmvsTexture = parser.add_argument_group("OpenMVS Texture Mesh")
+    openmvsTexture.add_argument(
+        "--txemptycolor",
+        type=int,
+        default=0,
+        help=
+        "Color of surfaces OpenMVS TextureMesh is unable to texture. Default: 0 (black)",
+    )
+    openmvsTexture.add_argument(
+        "--txreslevel",
+        type=int,
+        help="Times to scale down the images before texturing. Default: set by --mvs-quality",
+    )
+    return parser
+
+
+class PipelineConfig:
+    """
+    Description: Options of one pipeline run, named like the command line options (--max-image-size is max_image_size)
+    Args:
+        input: scene folder holding the images/ folder
+        options: other options, the ones left out get their command line default
+    """
+
+    def __init__(self, input, **options):
+        self.argv = options.pop("argv", None)
+        defaults = {
+            action.dest: action.default
+            for action in create_parser()._actions if action.dest != "help"
+        }
+        unknown = sorted(set(options) - set(defaults))
+        if unknown:
+            raise TypeError("Unknown pipeline options: {0}".format(
+                ", ".join(unknown)))
+        defaults.update(options, input=input)
+        self.__dict__.update(defaults)
+
+    @classmethod
+    def from_args(cls, argv=None, parser=None):
+        """
+        Description: Config from a command line, sys.argv[1:] by default
+        """
+        argv = sys.argv[1:] if argv is None else list(argv)
+        options = vars((parser or create_parser()).parse_args(argv))
+        return cls(argv=[sys.argv[0]] + argv, **options)
+
+
+class Plan:
+    """
+    Description: Stages of one pipeline run, built by build_plan
+    Args:
+        config: PipelineConfig the plan was built from
+        commands: list of command dicts
+        output_directory: output folder of the run, holding the stage cache
+        images_directory: source images of the scene
+        folders: folders created before the stages run
+        notes: decisions taken while planning, logged when the run starts
+        backend: SfmBackend of the run
+    """
+
+    def __init__(self, config, commands, output_directory, images_directory,
+                 folders, notes, backend):
+        self.config = config
+        self.commands = commands
+        self.output_directory = output_directory
+        self.images_directory = images_directory
+        self.folders = folders
+        self.notes = notes
+        self.backend = backend
+
+
+def build_plan(config):
+    """
+    Description: Turn a config into the stages of a run, without running a tool or writing a file.
+                 It does read the host and the scene: with --run-openmvs and an --mvs-quality other
+                 than off, openmvs_resolutions reads the headers of the scene images, probes the host
+                 memory and cores with psutil and, with --mvs-time-budget, loads the run reports.
+                 --cluster-size lists the images, --update reads the images of sparse/0
+    Args:
+        config: PipelineConfig
+        return: Plan
+    Raises:
+        ValueError: the options do not describe a valid run
+    """
+    inputDirectory = config.input
+    if not os.path.isabs(inputDirectory):
+        inputDirectory = os.path.join(os.path.abspath("."), inputDirectory)
+
+    if config.output:
+        outputDirectory = config.output
+    else:
+        outputDirectory = os.path.join(inputDirectory, "output")
+    if not os.path.isabs(outputDirectory):
+        outputDirectory = os.path.join(os.path.abspath("."), outputDirectory)
+    # A scene folder keeps its images in images/, otherwise the input is the image folder
+    imagesDirectory = os.path.join(inputDirectory, "images")
+    if not os.path.isdir(imagesDirectory):
+        imagesDirectory = inputDirectory
+
+    backend = create_backend(config, imagesDirectory, inputDirectory,
+                             outputDirectory)
+    commands = []
+    folders = []
+    notes = []
+    if config.run_colmap or config.run_openmvg:
+        commands += backend.stages()
+    if config.run_openmvs:
+        commands += backend.export_stages()
+        openmvsCommands, openmvsFolders, openmvsNotes = openmvs_stages(
+            config, backend)
+        commands += openmvsCommands
+        folders += openmvsFolders
+        notes += openmvsNotes
+    folders = backend.folders + folders
+    commands = select_stages(commands, config.from_stage, config.to_stage)
+    try:
+        apply_timeouts(commands, config.stage_timeout, config.idle_timeout)
+    except ValueError as err:
+        raise ValueError("Invalid timeout: {0}".format(err))
+    if config.executor == "queue" and not config.queue_dir:
+        raise ValueError("--executor queue requires --queue-dir")
+    return Plan(config, commands, outputDirectory, imagesDirectory, folders,
+                backend.notes + notes, backend)
+
+
+def openmvs_resolutions(config, backend):
+    """
+    Description: Resolution levels of the OpenMVS stages for --mvs-quality, see dpg.resolution
+    Args:
+        config: PipelineConfig
+        backend: SfmBackend, its images are the ones OpenMVS reads
+        return: (dict stage -> cost, empty with --mvs-quality off, notes)
+    """
+    if config.mvs_quality == "off":
+        return {}, []
+    sizes = [
+        scaled_size(width, height, config.max_image_size)
+        for width, height in image_sizes(backend.images_folder)
+    ]
+    memory = psutil.virtual_memory().total * MEMORY_SHARE
+    if config.mvs_memory is not None:
+        memory = config.mvs_memory * GB
+    timeBudget = None
+    rates = {}
+    if config.mvs_time_budget is not None:
+        timeBudget = config.mvs_time_budget * 60
+        rates = {
+            tool: rate["seconds"]
+            for tool, rate in load_rates([
+                REPORT_PATTERN,
+                os.path.join(backend.output_folder, REPORT_PATTERN)
+            ])[0].items()
+        }
+    fixed = {
+        stage: level
+        for stage, level in [("DensifyPointCloud", config.dreslevel), (
+            "RefineMesh", config.rmlevel), ("TextureMesh", config.txreslevel)]
+        if level is not None
+    }
+    return choose_resolutions(sizes,
+                              psutil.cpu_count() or 1,
+                              memory,
+                              quality=config.mvs_quality,
+                              time_budget=timeBudget,
+                              rates=rates,
+                              fixed=fixed)
+
+
+def openmvs_stages(config, backend):
+    """
+    Description: OpenMVS stages continuing from the scene exported by an SfM backend
+    Args:
+        config: PipelineConfig
+        backend: SfmBackend whose scene_file and mvs_folder the stages use
+        return: (list of command dicts, folders the stages write into without creating them, notes)
+    """
+    densifyPointCloudOptions = []
+    reconstructMeshOptions = []
+    refineMeshOptions = []
+    textureMeshOptions = []
+    commands = []
+    stageFolders = []
+    openmvsBin = openmvs_binaries(config)
+    mvsFolder = backend.mvs_folder
+
+    # OpenMVS Output Format
+    openmvsOutputFormat = []
+    if config.output_obj:
+        openmvsOutputFormat = ["--export-type", "obj"]
+
+    resolutions, notes = openmvs_resolutions(config, backend)
+
+    # OpenMVS Densify Mesh
+    if config.dnumviewsfuse != None:
+        densifyPointCloudOptions += ["--number-views-fuse", config.dnumviewsfuse]
+    if config.dnumviews != None:
+        densifyPointCloudOptions += ["--number-views", config.dnumviews]
+    if config.dreslevel != None:
+        densifyPointCloudOptions += ["--resolution-level", config.dreslevel]
+    elif "DensifyPointCloud" in resolutions:
+        densifyPointCloudOptions += [
+            "--resolution-level", resolutions["DensifyPointCloud"]["level"]
+        ]
+        if resolutions["DensifyPointCloud"]["max_resolution"] is not None:
+            densifyPointCloudOptions += [
+                "--max-resolution",
+                resolutions["DensifyPointCloud"]["max_resolution"]
+            ]
+
+    # OpenMVS Reconstruct Mesh
+    if config.rcthickness != None:
+        reconstructMeshOptions += ["--thickness-factor", config.rcthickness]
+    if config.rcdistance != None:
+        reconstructMeshOptions += ["--min-point-distance", config.rcdistance]
+    reconstructMeshOptions += openmvsOutputFormat
+
+    # OpenMVS Refine Mesh
+    if config.rmiterations != None:
+        refineMeshOptions += ["--scales", config.rmiterations]
+    if config.rmlevel != None:
+        refineMeshOptions += ["--resolution-level", config.rmlevel]
+    elif "RefineMesh" in resolutions:
+        refineMeshOptions += [
+            "--resolution-level", resolutions["RefineMesh"]["level"]
+        ]
+    else:
+        refineMeshOptions += ["--resolution-level", 3]
+    refineMeshOptions += ["--min-resolution", MIN_RESOLUTION]
+    refineMeshOptions += openmvsOutputFormat
+
+    # OpenMVS Texture Mesh
+    if config.txemptycolor != None:
+        textureMeshOptions += ["--empty-color", config.txemptycolor]
+    if config.txreslevel != None:
+        textureMeshOptions += ["--resolution-level", config.txreslevel]
+    elif "TextureMesh" in resolutions:
+        textureMeshOptions += [
+            "--resolution-level", resolutions["TextureMesh"]["level"]
+        ]
+    textureMeshOptions += openmvsOutputFormat
+
+    sceneFileName = ["scene"]
+
+    reconstructMeshInput = [
+        "--input-file",
+        os.path.join(mvsFolder, "model_dense.mvs")
+    ]
+    # Do densifyPointCloud or not
+    if (config.densify or config.densify_only) and config.densify_tiles > 1:
+        # Densify view subsets concurrently, bounding the memory of each run,
+        # then merge their point clouds
+        densify_tiles_folder = os.path.join(mvsFolder,
+                                            "densify_tiles")
+        tile_folders = [
+            os.path.join(densify_tiles_folder, "tile_{0}".format(index))
+            for index in range(config.densify_tiles)
+        ]
+        stageFolders.append(densify_tiles_folder)
+        densifyTilesScript = os.path.join(SCRIPTS_DIR, "densify_tiles.py")
+        commands.append({
+            "title":
+            "Densify view neighbors",
+            "command": [
+                os.path.join(openmvsBin, "DensifyPointCloud"),
+                "--input-file",
+                backend.scene_file,
+                "--working-folder",
+                os.path.join(mvsFolder),
+                "--output-view-neighbors-file",
+                os.path.join(densify_tiles_folder, "neighbors.txt"),
+            ] + densifyPointCloudOptions,
+            "inputs":
+            [backend.scene_file],
+            "outputs":
+            [os.path.join(densify_tiles_folder, "neighbors.txt")],
+        })
+        commands.append({
+            "title":
+            "Densify tiles plan",
+            "command": [
+                sys.executable,
+                densifyTilesScript,
+                "plan",
+                "--neighbors",
+                os.path.join(densify_tiles_folder, "neighbors.txt"),
+                "--tiles",
+                config.densify_tiles,
+                "--output",
+                densify_tiles_folder,
+            ],
+            "inputs":
+            [os.path.join(densify_tiles_folder, "neighbors.txt")],
+            "outputs": [
+                os.path.join(folder, "neighbors.txt")
+                for folder in tile_folders
+            ],
+        })
+        for index, folder in enumerate(tile_folders):
+            commands.append({
+                "title":
+                "Densify tile {0}".format(index),
+                "command": [
+                    os.path.join(openmvsBin, "DensifyPointCloud"),
+                    "--input-file",
+                    backend.scene_file,
+                    "--working-folder",
+                    os.path.join(mvsFolder),
+                    "--view-neighbors-file",
+                    os.path.join(folder, "neighbors.txt"),
+                    "--output-file",
+                    os.path.join(folder, "model_dense.mvs"),
+                ] + densifyPointCloudOptions,
+                "inputs": [
+                    backend.scene_file,
+                    os.path.join(folder, "neighbors.txt")
+                ],
+                "outputs": [
+                    os.path.join(folder, "model_dense.mvs"),
+                    os.path.join(folder, "model_dense.ply")
+                ],
+                "scene_share":
+                1.0 / config.densify_tiles,
+            })
+        commands.append({
+            "title":
+            "Merge dense tiles",
+            "command": [
+                sys.executable,
+                densifyTilesScript,
+                "merge",
+                "--output",
+                os.path.join(mvsFolder, "model_dense.ply"),
+            ] + [
+                os.path.join(folder, "model_dense.ply")
+                for folder in tile_folders
+            ],
+            "inputs": [
+                os.path.join(folder, "model_dense.ply")
+                for folder in tile_folders
+            ],
+            "outputs":
+            [os.path.join(mvsFolder, "model_dense.ply")],
+        })
+        reconstructMeshInput = [
+            "--input-file",
+            backend.scene_file,
+            "--pointcloud-file",
+            os.path.join(mvsFolder, "model_dense.ply"),
+        ]
+        sceneFileName.append("dense")
+    elif config.densify or config.densify_only:
+        commands.append({
+            "title":
+            "Densify point cloud",
+            "command": [
+                os.path.join(openmvsBin, "DensifyPointCloud"),
+                "--input-file",
+                backend.scene_file,
+                "--working-folder",
+                os.path.join(mvsFolder),
+                "--output-file",
+                os.path.join(mvsFolder, "model_dense.mvs"),
+            ] + densifyPointCloudOptions,
+            "inputs":
+            [backend.scene_file],
+            "outputs":
+            [os.path.join(mvsFolder, "model_dense.mvs")],
+        })
+        sceneFileName.append("dense")
+
+    if not config.densify_only:
+        mvsFileName = "_".join(sceneFileName) + ".mvs"
+        commands.append({
+            "title":
+            "Reconstruct mesh",
+            "command": [
+                os.path.join(openmvsBin, "ReconstructMesh"),
+            ] + reconstructMeshInput + [
+                "--working-folder",
+                os.path.join(mvsFolder),
+                "--output-file",
+                os.path.join(mvsFolder,
+                             "model_dense_mesh.mvs"),
+            ] + reconstructMeshOptions,
+            "inputs":
+            reconstructMeshInput[1::2],
+            "outputs":
+            [os.path.join(mvsFolder, "model_dense_mesh.mvs")],
+        })
+        sceneFileName.append("mesh")
+
+        mvsFileName = "_".join(sceneFileName) + ".mvs"
+        rmCudaOk = False
+        if not config.no_refine:
+            if config.rmcuda:
+                commands.append({
+                    "title":
+                    "Refine mesh",
+                    "command": [
+                        os.path.join(openmvsBin, "RefineMesh"),
+                        "--input-file",
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh.mvs"),
+                        "--working-folder",
+                        os.path.join(mvsFolder),
+                        "--cuda-device",
+                        "-1",
+                        "--output-file",
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh_refine.mvs"),
+                    ] + refineMeshOptions,
+                    "inputs": [
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh.mvs")
+                    ],
+                    "outputs": [
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh_refine.mvs")
+                    ],
+                })
+            else:
+                commands.append({
+                    "title":
+                    "Refine mesh",
+                    "command": [
+                        os.path.join(openmvsBin, "RefineMesh"),
+                        "--input-file",
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh.mvs"),
+                        "--working-folder",
+                        os.path.join(mvsFolder),
+                        "--output-file",
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh_refine.mvs"),
+                    ] + refineMeshOptions,
+                    "inputs": [
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh.mvs")
+                    ],
+                    "outputs": [
+                        os.path.join(mvsFolder,
+                                     "model_dense_mesh_refine.mvs")
+                    ],
+                })
+
+        sceneFileName.append("refine")
+        mvsFileName = "_".join(sceneFileName) + ".mvs"
+        if config.no_refine:
+            refine_mvs_name = "model_dense_mesh.mvs"
+        else:
+            refine_mvs_name = "model_dense_mesh_refine.mvs"
+        commands.append({
+            "title":
+            "Texture mesh",
+            "command": [
+                os.path.join(openmvsBin, "TextureMesh"),
+                "--export-type",
+                "obj",
+                "--input-file",
+                os.path.join(mvsFolder, refine_mvs_name),
+                "--working-folder",
+                os.path.join(mvsFolder),
+                "--output-file",
+                os.path.join(mvsFolder, "model.obj"),
+            ] + textureMeshOptions,
+            "inputs":
+            [os.path.join(mvsFolder, refine_mvs_name)],
+            "outputs": [os.path.join(mvsFolder, "model.obj")],
+        })
+    return commands, stageFolders, notes
+
+
+def print_plan(plan):
+    """
+    Description: Print the commands of a plan, for --debug
+    """
+    for instruction in plan.commands:
+        print(instruction["title"])
+        print(
+            "========================================================================="
+        )
+        print(" ".join(map(str, instruction["command"])))
+        print("")
+
+
+def run_command(cmd,
+                prefix="",
+                on_start=None,
+                executor=None,
+                job=None,
+                timeout=None,
+                idle_timeout=None,
+                env=None):
+    """
+        Description: Run a command with an executor, streaming its output to the logger
+        Args: cmd: Command to run
+              prefix: Prepended to every output line, to tell concurrent stages apart
+              on_start: Called with the pid of the subprocess once it started, for local commands
+              executor: LocalExecutor (default) or QueueExecutor
+              job: Stage information shipped with queued commands
+              timeout: Wall-clock limit of the command in seconds, None for none
+              idle_timeout: Longest time in seconds the command may print nothing, None for none
+              env: Variables added to the environment of the command
+              returns: Return code of the command
+        Author: thomas (thomas@graphopti.com)
+        Date: 2023-03-10
+    """
+
+    def output(line):
+        line = prefix + line
+        logger.info(line)
+        print(line, flush=True)
+
+    try:
+        return (executor or LocalExecutor()).run(cmd,
+                                                 output,
+                                                 on_start,
+                                                 env=env,
+                                                 job=job,
+                                                 timeout=timeout,
+                                                 idle_timeout=idle_timeout)
+    except OSError as err:
+        print("Could not run command flag1: {0}".format(err))
+        logger.error("Could not run command flag1: {0}".format(err))
+        return -1
+    except:
+        print("Could not run command")
+        return -1
+
+
+def create_executor(config):
+    """
+    Description: Executor chosen by the --executor option of a config
+    """
+    if config.executor == "queue":
+        return QueueExecutor(config.queue_dir)
+    return LocalExecutor()
+
+
+def run(plan, executor=None, admission=None, cancel=None):
+    """
+    Description: Run the stages of a plan as a dependency graph, skipping stages whose cached outputs are up to date
+    Args:
+        plan: Plan from build_plan
+        executor: runs the stage commands, by default the one chosen by the config
+        admission: AdmissionController shared by several runs, by default one per run unless the config disables admission
+        cancel: threading.Event, once set no further stage starts and the report says "interrupted".
+                The running stages are stopped through their executor, see run_pipeline
+        return: run report dict, its status is "succeeded", "failed" or "interrupted"
+    Raises:
+        KeyboardInterrupt: once the running tools are stopped and the report says "interrupted"
+    """
+    config = plan.config
+    log_path = os.path.abspath(config.log_file or "GraphEngine_{}.log".format(
+        datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')))
+    report_path = config.report or os.path.splitext(log_path)[0] + "_report.json"
+    handler = open_log(log_path)
+    uploader = None
+    if config.upload_url:
+        uploader = LogUploader(config.upload_url, config.upload_interval)
+        uploader.add(log_path)
+        # Rewritten after every stage, sent once the run is over
+        uploader.add(report_path, final=True)
+    try:
+        logger.info(
+            f"Running the pipeline with the {plan.backend.name} SfM backend on {platform.node()}"
+        )
+        logger.info(f"The start time is {datetime.datetime.now()}")
+        # Described in the background, the first stage does not wait for it
+        probe = HostProbe([config.input, plan.output_directory],
+                          config.host_cache_ttl)
+        for note in plan.notes:
+            logger.info(note)
+        for folder in plan.folders:
+            os.makedirs(folder, exist_ok=True)
+        if executor is None:
+            executor = create_executor(config)
+        # Queued stages are admitted by the worker that runs them
+        if admission is None and not config.no_admission and not executor.remote:
+            admission = AdmissionController(
+                state_dir=config.admission_dir,
+                cpu_budget=config.cpu_budget,
+                thread_budget=not config.no_thread_budget,
+                affinity=not config.no_affinity)
+        return run_commands(plan, log_path, report_path, probe, executor,
+                            admission, cancel)
+    finally:
+        close_log(handler)
+        if uploader is not None:
+            # The last sync happens on the upload thread, the run returns now
+            uploader.close()
+
+
+async def run_pipeline(config, executor=None, admission=None):
+    """
+    Description: Build the plan of a config and run it like run, awaited on the caller's event loop
+    Args:
+        config: PipelineConfig
+        executor, admission: see run
+        return: run report dict
+    Raises:
+        ValueError: the options do not describe a valid run
+        asyncio.CancelledError: the task was cancelled, raised once the tools of the run are
+                                stopped and the report says "interrupted". Jobs already handed
+                                to queue workers run to their end
+    """
+    plan = build_plan(config)
+    if executor is None:
+        executor = create_executor(config)
+    cancel = threading.Event()
+    # The stages run on the threads of the scheduler, as for run
+    future = asyncio.get_running_loop().run_in_executor(
+        None, run, plan, executor, admission, cancel)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        if not executor.remote:
+            await asyncio.get_running_loop().run_in_executor(
+                None, executor.cancel)
+        await asyncio.wait([future])
+        raise
+
+
+def run_commands(plan,
+                 log_path,
+                 report_path,
+                 probe,
+                 executor,
+                 admission,
+                 cancel=None):
+    """
+        Description: Run the commands of a plan, see run
+        Args: plan: Plan to run
+              log_path: Log file of the run, the profiles are written next to it
+              report_path: JSON run report to write
+              probe: HostProbe describing the host for the log and the report
+              executor: Runs the stage commands
+              admission: AdmissionController holding each stage until the host has room for it, or None
+              cancel: threading.Event stopping the run once set, or None
+              returns: Run report dict
+    """
+    config = plan.config
+    commands = plan.commands
+    jobs = config.jobs
+    commands_time_cost = {}
+    cache = StageCache(os.path.join(plan.output_directory, ".stage_cache"))
+    runReport = RunReport(report_path,
+                          argv=config.argv,
+                          sfm_backend=plan.backend.name)
+    finished = threading.Event()
+
+    def hostReady(host):
+        # Called on the probe thread, which belongs to this run
+        current_run.log_path = log_path
+        if not finished.is_set():
+            log_host(host)
+            runReport.set_host(host)
+
+    def finish(status, wait=None):
+        finished.set()
+        runReport.set_host(probe.result(wait))
+        runReport.finish(status)
+
+    probe.start(hostReady)
+    binaries = set(str(instruction["command"][0]) for instruction in commands)
+    for binary in sorted(binaries):
+        runReport.set_tool(binary, cache.hash_path(binary))
+    runState = RunState(os.path.join(cache.cache_dir, "run_state.json"), cache)
+    if config.resume:
+        remaining = []
+        for instruction in commands:
+            if runState.completed(instruction):
+                print("Resume: {0} already completed".format(
+                    instruction["title"]))
+                logger.info("Resume: {0} already completed".format(
+                    instruction["title"]))
+            else:
+                remaining.append(instruction)
+        commands = remaining
+    runState.start_run(commands, config.argv)
+    # The cache is shared by the worker threads of the scheduler
+    cache_lock = threading.Lock()
+    # Sizes the admission of the stages, here or on the queue workers, and
+    # gives the amount of work of every stage for later estimates
+    scene = describe_scene(plan.images_directory, config.max_image_size)
+    megapixels = scene["megapixels"]
+    logger.info("Scene: {0} images, {1:.1f} megapixels".format(
+        scene["images"], megapixels))
+    runReport.set_scene(scene)
+    profileReport = None
+    if config.profile_interval > 0:
+        profileReport = ProfileReport(os.path.splitext(log_path)[0])
+
+    def runStage(instruction):
+        # Records of the scheduler threads go to the log of this run only
+        current_run.log_path = log_path
+        if cancel is not None and cancel.is_set():
+            return -1
+        command_start_time = runReport.elapsed()
+        with cache_lock:
+            fresh = not config.recompute and cache.is_fresh(instruction)
+            if not fresh:
+                input_hashes = cache.snapshot_inputs(instruction)
+        if fresh:
+            print("Skipping {0}: outputs are up to date".format(
+                instruction["title"]))
+            logger.info("Skipping {0}: outputs are up to date".format(
+                instruction["title"]))
+            commands_time_cost[instruction["title"]] = 0
+            with cache_lock:
+                runState.mark(instruction, "completed")
+            runReport.add_stage(instruction,
+                                command_start_time,
+                                runReport.elapsed(),
+                                0,
+                                skipped=True,
+                                work=stage_work(instruction, scene)[0])
+            return 0
+        print(instruction["title"])
+        print(
+            "========================================================================="
+        )
+        logger.info(
+            "========================================================================="
+        )
+        logger.info("Excuting commannd:" +
+                     " ".join(map(str, instruction["command"])))
+        logger.info(
+            "========================================================================="
+        )
+
+        prefix = "[{0}] ".format(instruction["title"]) if jobs > 1 else ""
+        command = list(map(str, instruction["command"]))
+        reservation = None
+        if admission is not None:
+            reservation = admission.admit(
+                instruction["title"], command,
+                megapixels * instruction.get("scene_share", 1.0))
+        env = None
+        if reservation is not None and reservation.threads:
+            command = with_threads(command, reservation.tool,
+                                   reservation.threads)
+            env = thread_env(reservation.threads)
+        profilers = []
+
+        def onStart(pid):
+            if reservation is not None:
+                admission.attach(reservation, pid)
+            if profileReport is not None:
+                profiler = StageProfiler(instruction["title"], pid,
+                                         config.profile_interval)
+                profiler.start()
+                profilers.append(profiler)
+
+        rc = -1
+        profile = None
+        job = {
+            "title": instruction["title"],
+            "megapixels": megapixels * instruction.get("scene_share", 1.0),
+        }
+        try:
+            clean_folders(instruction)
+            rc = run_command(command, prefix, onStart, executor, job,
+                             instruction.get("timeout"),
+                             instruction.get("idle_timeout"), env)
+        finally:
+            for profiler in profilers:
+                profile = profiler.stop()
+                profileReport.add(profiler, profile)
+            if reservation is not None:
+                admission.release(reservation, success=rc == 0)
+        with cache_lock:
+            if rc != 0:
+                cache.invalidate(instruction["title"])
+                runState.mark(instruction, "failed")
+            else:
+                cache.record(instruction, input_hashes)
+                runState.mark(instruction, "completed")
+        command_end_time = runReport.elapsed()
+        commands_time_cost[
+            instruction["title"]] = command_end_time - command_start_time
+        runReport.add_stage(instruction,
+                            command_start_time,
+                            command_end_time,
+                            rc,
+                            profile=profile,
+                            work=stage_work(instruction, scene)[0])
+        return rc
+
+    try:
+        # The tools run in process groups of their own and do not see the Ctrl-C
+        failed = run_graph(commands, runStage, jobs, on_interrupt=terminate_all)
+    except KeyboardInterrupt:
+        finish("interrupted", 0)
+        raise
+    if cancel is not None and cancel.is_set():
+        logger.info("The run was cancelled")
+        finish("interrupted", 0)
+        return runReport.data
+    if failed is not None:
+        print("Failed while executing: ")
+        print(" ".join(map(str, failed["command"])))
+        logger.error("Failed while executing: ")
+        logger.error(" ".join(map(str, failed["command"])))
+        print("Fix the problem and rerun with --resume to continue from there")
+        finish("failed")
+        return runReport.data
+    finish("succeeded")
+    timeDifference = runReport.data["total_time"]
+    hours = int(math.floor(timeDifference / 60 / 60))
+    minutes = int(math.floor((timeDifference - hours * 60 * 60) / 60))
+    seconds = int(math.floor(timeDifference -
+                             (hours * 60 * 60 + minutes * 60)))
+    print("\n\nFinished without errors (I guess) - Time used:: {0}:{1}:{2}".
+          format(
+              ("00" + str(hours))[-2:],
+              ("00" + str(minutes))[-2:],
+              ("00" + str(seconds))[-2:],
+          ))
+    logger.info("\n\nFinished without errors (I guess) - Time used:: {0} seconds".
+            format((hours * 60 * 60) + (minutes * 60) + seconds))
+    table = []
+    for instruction in commands:
+        if instruction["title"] in commands_time_cost:
+            table.append([
+                instruction["title"],
+                commands_time_cost[instruction["title"]]
+            ])
+    headers = ["Command", "Time (s)"]
+    logger.info(tabulate(table, headers=headers, floatfmt=".2f"))
+    print(tabulate(table, headers=headers, floatfmt=".2f"))
+    logger.info("Run report written to {0}".format(runReport.path))
+    return runReport.data
+
+
+
+# Log file of the run the current thread works for, None outside of runs
+current_run = threading.local()
+
+
+class RunLogFilter(logging.Filter):
+    """
+    Description: Keep the records of other runs out of a run log, for runs sharing a process
+    """
+
+    def __init__(self, log_path):
+        super().__init__()
+        self.log_path = log_path
+
+    def filter(self, record):
+        owner = getattr(current_run, "log_path", None)
+        return owner is None or owner == self.log_path
+
+
+def open_log(log_path):
+    """
+    Description: Send the GraphEngine records of the calling thread's run to a log file
+    Args:
+        log_path: log file of the run
+        return: the handler, for close_log
+    """
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    handler.addFilter(RunLogFilter(log_path))
+    logger.addHandler(handler)
+    current_run.log_path = log_path
+    return handler
+
+
+def close_log(handler):
+    logger.removeHandler(handler)
+    handler.close()
+    current_run.log_path = None
+
+
+def log_host(host):
+    """
+    Description: Write the host information to the run log
+    """
+    logger.info(f"Machine: {host.get('machine')}")
+    logger.info(f"Platform: {host.get('platform')}")
+    logger.info(f"Processor: {host.get('processor')}")
+    logger.info(f"Operating system: {host.get('os')}")
+    logger.info(f"CPU count: {host.get('cpu_count')}")
+    logger.info(f"CPU frequency: {host.get('cpu_freq')}")
+    for mount, disk in host.get("disks", {}).items():
+        logger.info(
+            f"Disk {mount}: {disk['used']/(1024*1024*1024):.2f}GB used, {disk['free']/(1024*1024*1024):.2f}GB free"
+        )
+    if "gpus" not in host:
+        logger.warning("GPUtil module not found.")
+        return
+    for i, gpu in enumerate(host["gpus"]):
+        logger.info(f"GPU {i}: {gpu['name']}, memory {gpu['memory_total']}")
+
+
+def main(argv=None):
+    parser = create_parser()
+    config = PipelineConfig.from_args(argv, parser)
+    try:
+        plan = build_plan(config)
+    except ValueError as err:
+        parser.error(str(err))
+    if config.debug:
+        print_plan(plan)
+        return 0
+    if config.estimate:
+        estimate = estimate_plan(plan, config.estimate_reports)
+        print_estimate(estimate)
+        if config.estimate_output:
+            write_estimate(estimate, config.estimate_output)
+        return 1 if estimate["problems"] else 0
+    report = run(plan)
+    return 0 if report["status"] == "succeeded" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Description: Image preprocessing stage, applies the EXIF orientation and downsizes the input images.
+
+Processed images are stored in an object store keyed by the hash of the
+source file and the preprocessing settings, so a rerun only processes new or
+changed images. The working image set handed to COLMAP is a folder of hard
+links into that store, with the original file names. Images that need
+neither rotation nor downsizing are linked to the source file as they are.
+
+Usage:
+    preprocess_images.py --input images --output images_preprocessed --store .image_cache --max-size 3200
+"""
+
+import argparse, hashlib, os, shutil, sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from dpg.cache import FileIndex
+from dpg.images import list_images
+
+# Bump when the processing changes, so cached images are regenerated
+VERSION = 1
+ORIENTATION = 0x0112
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Orient and downsize the input images")
+    parser.add_argument("--input",
+                        type=str,
+                        required=True,
+                        help="Folder with the source images")
+    parser.add_argument("--output",
+                        type=str,
+                        required=True,
+                        help="Folder receiving the working image set")
+    parser.add_argument("--store",
+                        type=str,
+                        required=True,
+                        help="Folder caching the processed images")
+    parser.add_argument("--max-size",
+                        type=int,
+                        required=True,
+                        help="Largest width or height of the output images")
+    parser.add_argument("--quality",
+                        type=int,
+                        default=95,
+                        help="JPEG quality. Default: 95")
+    parser.add_argument("--workers",
+                        type=int,
+                        help="Number of worker processes. Default: all cores")
+    return parser
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def process_image(task):
+    """
+    Description: Orient and downsize one image into the store, runs in a worker process
+    Args:
+        task: (source path, store path, max size, jpeg quality)
+    """
+    source, destination, max_size, quality = task
+    tmp_path = destination + ".tmp" + os.path.splitext(destination)[1]
+    with Image.open(source) as image:
+        exif = image.getexif()
+        orientation = exif.get(ORIENTATION, 1)
+        if orientation == 1 and max(image.size) <= max_size:
+            link_or_copy(source, tmp_path)
+            os.replace(tmp_path, destination)
+            return
+        processed = ImageOps.exif_transpose(image)
+        if max(processed.size) > max_size:
+            processed.thumbnail((max_size, max_size), Image.LANCZOS)
+        # GPS and focal length tags are kept, the pixels are now upright
+        exif[ORIENTATION] = 1
+        options = {"exif": exif.tobytes()}
+        if destination.lower().endswith(JPEG_EXTENSIONS):
+            options.update(format="JPEG", quality=quality)
+            if processed.mode not in ("RGB", "L"):
+                processed = processed.convert("RGB")
+        processed.save(tmp_path, **options)
+    os.replace(tmp_path, destination)
+
+
+def preprocess(images_dir, output_dir, store_dir, max_size, quality=95,
+               workers=None):
+    """
+    Description: Build the working image set
+    Args:
+        images_dir: folder with the source images
+        output_dir: folder receiving the working image set
+        store_dir: folder caching the processed images
+        max_size: largest width or height of the output images
+        quality: JPEG quality
+        workers: number of worker processes, None for all cores
+        return: number of images that had to be processed
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    # Only the source hashes, the store holds no stage manifest
+    hasher = FileIndex(os.path.join(store_dir, "file_index.json"))
+    settings = "{0}-{1}-{2}".format(VERSION, max_size, quality)
+    plan = {}
+    tasks = []
+    for source in list_images(images_dir):
+        name = os.path.basename(source)
+        key = hashlib.sha256("{0}-{1}".format(hasher.hash_file(source),
+                                              settings).encode()).hexdigest()
+        stored = os.path.join(store_dir,
+                              key[:32] + os.path.splitext(name)[1].lower())
+        plan[name] = stored
+        if not os.path.exists(stored):
+            tasks.append((source, stored, max_size, quality))
+    hasher.save()
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(process_image, tasks, chunksize=4):
+                pass
+
+    for name in os.listdir(output_dir):
+        if name not in plan:
+            os.remove(os.path.join(output_dir, name))
+    for name, stored in plan.items():
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path) and os.path.samefile(path, stored):
+            continue
+        if os.path.exists(path):
+            os.remove(path)
+        link_or_copy(stored, path)
+    return len(tasks)
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    processed = preprocess(args.input, args.output, args.store, args.max_size,
+                           args.quality, args.workers)
+    print("Preprocessed {0} images into {1} ({2} reused from {3})".format(
+        processed, args.output,
+        len(list_images(args.output)) - processed, args.store))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
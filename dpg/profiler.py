@@ -0,0 +1,196 @@
+"""
+Description: Per-stage resource profiler.
+
+A background thread polls the process tree of a running stage with psutil at a
+fixed interval and records resident memory, CPU usage in cores, cumulative
+disk read/write bytes and, when GPUtil is available, the GPU memory the stage
+added on top of what was in use when it started. ProfileReport collects the
+samples of every stage and writes them next to the run log as a JSON summary
+and a CSV timeline.
+"""
+
+import csv, json, logging, os, threading, time
+import psutil
+
+logger = logging.getLogger("GraphEngine")
+
+CSV_FIELDS = [
+    "stage", "time", "rss", "cpu_cores", "read_bytes", "write_bytes",
+    "gpu_mem"
+]
+
+
+def process_tree(pid):
+    try:
+        process = psutil.Process(pid)
+        return [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def gpu_memory_used():
+    """
+    Description: GPU memory in use on all devices in bytes, or None without GPUtil or GPU
+    """
+    try:
+        import GPUtil
+        gpus = GPUtil.getGPUs()
+    except ModuleNotFoundError:
+        return None
+    if not gpus:
+        return None
+    return sum(gpu.memoryUsed for gpu in gpus) * 1024 * 1024
+
+
+class StageProfiler:
+    """
+    Description: Sample the resources of one stage until stop() is called
+    Args:
+        title: stage title
+        pid: pid of the launched tool
+        interval: seconds between two samples
+    """
+
+    def __init__(self, title, pid, interval=1.0):
+        self.title = title
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.start_time = None
+        self.gpu_baseline = None
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.gpu_baseline = gpu_memory_used()
+        self.thread.start()
+
+    def run(self):
+        last_time = time.monotonic()
+        # cpu times per pid, so processes that exit between samples do not skew the delta
+        last_cpu = {}
+        while True:
+            now = time.monotonic()
+            rss = 0
+            cpu_delta = 0.0
+            read_bytes = 0
+            write_bytes = 0
+            cpu = {}
+            for process in process_tree(self.pid):
+                try:
+                    with process.oneshot():
+                        rss += process.memory_info().rss
+                        times = process.cpu_times()
+                        cpu[process.pid] = times.user + times.system
+                        try:
+                            io = process.io_counters()
+                            read_bytes += io.read_bytes
+                            write_bytes += io.write_bytes
+                        except (psutil.AccessDenied, AttributeError):
+                            pass
+                except psutil.NoSuchProcess:
+                    continue
+                cpu_delta += cpu[process.pid] - last_cpu.get(process.pid, 0.0)
+            gpu_mem = None
+            if self.gpu_baseline is not None:
+                used = gpu_memory_used()
+                if used is not None:
+                    gpu_mem = max(0, used - self.gpu_baseline)
+            if cpu:
+                elapsed = max(now - last_time, 1e-6)
+                # The first sample has no earlier cpu times to compare against
+                cpu_cores = round(cpu_delta / elapsed, 3) if last_cpu else 0.0
+                self.samples.append({
+                    "time": round(now - self.start_time, 3),
+                    "rss": rss,
+                    "cpu_cores": cpu_cores,
+                    "read_bytes": read_bytes,
+                    "write_bytes": write_bytes,
+                    "gpu_mem": gpu_mem,
+                })
+            last_cpu = cpu
+            last_time = now
+            if self.stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        """
+        Description: Stop sampling
+        Args:
+            return: summary dict of the stage
+        """
+        self.stopped.set()
+        self.thread.join()
+        return self.summary()
+
+    def summary(self):
+        samples = self.samples
+        summary = {
+            "stage": self.title,
+            "samples": len(samples),
+            "duration": round(time.monotonic() - self.start_time, 3),
+            "peak_rss": max((sample["rss"] for sample in samples), default=0),
+            "mean_rss": 0,
+            "peak_cpu_cores": max(
+                (sample["cpu_cores"] for sample in samples), default=0),
+            "mean_cpu_cores": 0,
+            "read_bytes": max(
+                (sample["read_bytes"] for sample in samples), default=0),
+            "write_bytes": max(
+                (sample["write_bytes"] for sample in samples), default=0),
+            "peak_gpu_mem": None,
+        }
+        if samples:
+            summary["mean_rss"] = int(
+                sum(sample["rss"] for sample in samples) / len(samples))
+            cpu_samples = samples[1:] or samples
+            summary["mean_cpu_cores"] = round(
+                sum(sample["cpu_cores"]
+                    for sample in cpu_samples) / len(cpu_samples), 3)
+        # Share of all the cores of the host the stage kept busy
+        summary["mean_cpu_utilization"] = round(
+            summary["mean_cpu_cores"] / (psutil.cpu_count() or 1), 3)
+        gpu = [
+            sample["gpu_mem"] for sample in samples
+            if sample["gpu_mem"] is not None
+        ]
+        if gpu:
+            summary["peak_gpu_mem"] = max(gpu)
+        return summary
+
+
+class ProfileReport:
+    """
+    Description: Write the profiles of all stages to <base>_profile.json and <base>_profile.csv
+    Args:
+        base_path: path prefix, usually the log file without its extension
+    """
+
+    def __init__(self, base_path):
+        self.json_path = base_path + "_profile.json"
+        self.csv_path = base_path + "_profile.csv"
+        self.stages = []
+        self.lock = threading.Lock()
+        with open(self.csv_path, "w", newline="") as file:
+            csv.writer(file).writerow(CSV_FIELDS)
+
+    def add(self, profiler, summary):
+        """
+        Description: Append the samples of a finished stage and rewrite the summary
+        """
+        with self.lock:
+            self.stages.append(summary)
+            with open(self.csv_path, "a", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+                for sample in profiler.samples:
+                    writer.writerow(dict(sample, stage=profiler.title))
+            with open(self.json_path + ".tmp", "w") as file:
+                json.dump({"stages": self.stages}, file, indent=1)
+            os.replace(self.json_path + ".tmp", self.json_path)
+        logger.info(
+            "Profile of {0}: peak RSS {1:.2f}GB, mean CPU {2} cores, read {3:.1f}MB, written {4:.1f}MB"
+            .format(summary["stage"], summary["peak_rss"] / 1024**3,
+                    summary["mean_cpu_cores"],
+                    summary["read_bytes"] / 1024**2,
+                    summary["write_bytes"] / 1024**2))
@@ -0,0 +1,226 @@
+"""
+Description: Machine-readable run report, and a tool to compare two of them.
+
+The report is a JSON file rewritten after every stage, so a failed or killed
+run still leaves the stages it completed. Stage times come from
+time.monotonic and are given in seconds relative to the start of the run.
+
+Usage:
+    python -m dpg.report old_report.json new_report.json [--threshold 10]
+"""
+
+import argparse, json, os, sys, threading, time, datetime
+from tabulate import tabulate
+
+
+def artifact_size(path):
+    """
+    Description: Size in bytes of a file, or of all the files below a directory, None if missing
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    if not os.path.isdir(path):
+        return None
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class RunReport:
+    """
+    Description: Collect the stages of a run and write them to a JSON file
+    Args:
+        path: file the report is written to
+        host: host information, see dpg.host
+        argv: command line of the pipeline
+        sfm_backend: name of the SfM backend of the run, see dpg.sfm
+    """
+
+    def __init__(self, path, host=None, argv=None, sfm_backend=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.data = {
+            "version": 1,
+            "status": "running",
+            "started_at": datetime.datetime.now().isoformat(),
+            "argv": list(argv if argv is not None else sys.argv),
+            "host": host or {},
+            "sfm_backend": sfm_backend,
+            "tools": {},
+            "stages": [],
+            "total_time": None,
+        }
+
+    def elapsed(self):
+        return round(time.monotonic() - self.start, 6)
+
+    def add_stage(self,
+                  instruction,
+                  start,
+                  end,
+                  exit_code,
+                  skipped=False,
+                  profile=None,
+                  work=None):
+        """
+        Description: Record a finished stage
+        Args:
+            instruction: command dict of the stage
+            start: run-relative start time from elapsed()
+            end: run-relative end time from elapsed()
+            exit_code: return code of the tool, 0 for skipped stages
+            skipped: True when the stage cache made the run unnecessary
+            profile: summary from the resource profiler, if any
+            work: amount of work of the stage, see dpg.estimate.stage_work
+        """
+        stage = {
+            "title": instruction["title"],
+            "argv": list(map(str, instruction["command"])),
+            "start": start,
+            "end": end,
+            "duration": round(end - start, 6),
+            "exit_code": exit_code,
+            "skipped": skipped,
+            "artifacts": {
+                str(path): artifact_size(str(path))
+                for path in instruction.get("outputs", [])
+            },
+        }
+        if profile is not None:
+            stage["profile"] = profile
+        if work is not None:
+            stage["work"] = work
+        with self.lock:
+            self.data["stages"].append(stage)
+            self.write()
+
+    def set_host(self, host):
+        with self.lock:
+            self.data["host"] = host
+            self.write()
+
+    def set_scene(self, scene):
+        with self.lock:
+            self.data["scene"] = scene
+            self.write()
+
+    def set_tool(self, path, digest):
+        with self.lock:
+            self.data["tools"][path] = digest
+
+    def finish(self, status):
+        with self.lock:
+            self.data["status"] = status
+            self.data["total_time"] = self.elapsed()
+            self.write()
+
+    def write(self):
+        with open(self.path + ".tmp", "w") as file:
+            json.dump(self.data, file, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def load_report(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def diff_reports(old, new):
+    """
+    Description: Compare the stage durations of two reports
+    Args:
+        old: baseline report dict
+        new: report dict to compare against the baseline
+        return: list of [title, old seconds, new seconds, delta, percent, note]
+    """
+    old_stages = {stage["title"]: stage for stage in old["stages"]}
+    new_stages = {stage["title"]: stage for stage in new["stages"]}
+    titles = [stage["title"] for stage in old["stages"]]
+    titles += [title for title in new_stages if title not in old_stages]
+    rows = []
+    for title in titles:
+        before = old_stages.get(title)
+        after = new_stages.get(title)
+        notes = []
+        if before is None or after is None:
+            notes.append("only in new" if before is None else "only in old")
+        else:
+            if before["exit_code"] != after["exit_code"]:
+                notes.append("exit code {0} -> {1}".format(
+                    before["exit_code"], after["exit_code"]))
+            if before["skipped"] != after["skipped"]:
+                notes.append("cached" if after["skipped"] else "not cached")
+            # By file name, the SfM backends keep the OpenMVS files in different folders
+            before_sizes = {
+                os.path.basename(path): size
+                for path, size in before["artifacts"].items()
+            }
+            for path, size in after["artifacts"].items():
+                name = os.path.basename(path)
+                if before_sizes.get(name) != size:
+                    notes.append("{0} size {1} -> {2}".format(
+                        name, before_sizes.get(name), size))
+        rows.append(
+            duration_row(title, before and before["duration"], after
+                         and after["duration"], notes))
+    rows.append(
+        duration_row("Total", old.get("total_time"), new.get("total_time"),
+                     []))
+    return rows
+
+
+def duration_row(title, before, after, notes):
+    delta = percent = None
+    if before is not None and after is not None:
+        delta = round(after - before, 3)
+        if before > 0:
+            percent = round(100.0 * delta / before, 1)
+    return [title, before, after, delta, percent, ", ".join(notes)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two run reports")
+    parser.add_argument("old", help="Baseline report")
+    parser.add_argument("new", help="Report to compare")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="Exit with 1 if a stage got slower by more than this many percent",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=1.0,
+        help="Stages faster than this in the baseline are ignored by --threshold. Default: 1",
+    )
+    args = parser.parse_args(argv)
+    old = load_report(args.old)
+    new = load_report(args.new)
+    rows = diff_reports(old, new)
+    print(
+        tabulate(rows,
+                 headers=["Stage", "Old (s)", "New (s)", "Delta (s)", "%",
+                          "Notes"]))
+    if old.get("tools") != new.get("tools"):
+        print("\nTool binaries differ between the two runs")
+    if old.get("sfm_backend") != new.get("sfm_backend"):
+        print("SfM backends: {0} -> {1}".format(old.get("sfm_backend"),
+                                                new.get("sfm_backend")))
+    if args.threshold is not None:
+        regressions = [
+            row for row in rows if row[4] is not None
+            and row[1] >= args.min_seconds and row[4] > args.threshold
+        ]
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Description: Resolution of the images the OpenMVS stages work on, from the scene and the host.
+
+DensifyPointCloud, RefineMesh and TextureMesh scale the images down by
+2**--resolution-level, then clamp their long side to --max-resolution and
+--min-resolution. A quality preset gives the long side every stage aims at;
+the levels reaching it are derived from the image sizes, read from the image
+headers. The costliest stage is then made one level coarser until the stages
+fit the memory of the host and, when given, the time budget:
+
+    memory   base + bytes per pixel of all the views (loaded or fused at once)
+             + bytes per pixel of a view for every thread (depth-map estimation)
+    time     seconds per working megapixel, from earlier run reports or
+             the defaults of dpg.estimate
+
+The models are rough, the point is to stay clear of the levels that swap or
+take all night, not to predict the run. Levels set on the command line
+(--dreslevel, --rmlevel, --txreslevel) are kept as they are.
+"""
+
+import math
+
+import numpy as np
+
+from dpg.estimate import DEFAULT_RATES
+
+GB = 1024**3
+OPENMVS_STAGES = ["DensifyPointCloud", "RefineMesh", "TextureMesh"]
+# Long side in pixels every stage aims at, None for the full resolution
+QUALITY_PRESETS = {
+    "low": {
+        "DensifyPointCloud": 1024,
+        "RefineMesh": 640,
+        "TextureMesh": 2048
+    },
+    "medium": {
+        "DensifyPointCloud": 2048,
+        "RefineMesh": 1024,
+        "TextureMesh": 4096
+    },
+    "high": {
+        "DensifyPointCloud": 3200,
+        "RefineMesh": 1024,
+        "TextureMesh": None
+    },
+    "max": {
+        "DensifyPointCloud": None,
+        "RefineMesh": 2048,
+        "TextureMesh": None
+    },
+}
+QUALITY = "high"
+# OpenMVS does not scale the images below this long side
+MIN_RESOLUTION = 640
+MAX_LEVEL = 4
+# [base GB, bytes per pixel of all the views, bytes per pixel of a view and thread]
+MEMORY_PROFILES = {
+    # Depth, normal and confidence maps fused at once; the reference and
+    # neighbor images plus the maps of the view each thread estimates
+    "DensifyPointCloud": [1.0, 24, 64],
+    # Every image as float, with its gradients
+    "RefineMesh": [1.0, 16, 0],
+    # Every image in color
+    "TextureMesh": [1.0, 8, 0],
+}
+# Share of the host memory the stages may plan for
+MEMORY_SHARE = 0.8
+
+
+def level_for(long_side, target, round_up):
+    """
+    Description: Resolution level bringing a long side to a target
+    Args:
+        round_up: True for the first level at or below the target, False for the last one above
+    """
+    if target is None or long_side <= target:
+        return 0
+    levels = math.log2(long_side / float(target))
+    return min(MAX_LEVEL, int(math.ceil(levels) if round_up else levels))
+
+
+def working_sizes(sizes, level, max_resolution=None):
+    """
+    Description: Size of the images once OpenMVS scaled them for a stage
+    Args:
+        sizes: int array of (width, height)
+        level: --resolution-level
+        max_resolution: --max-resolution, None for no limit
+        return: float array of (width, height)
+    """
+    long_sides = sizes.max(axis=1).astype(float)
+    target = long_sides / 2**level
+    if max_resolution is not None:
+        target = np.minimum(target, max_resolution)
+    target = np.maximum(target, np.minimum(long_sides, MIN_RESOLUTION))
+    return sizes * (target / long_sides)[:, None]
+
+
+def stage_cost(stage, sizes, level, max_resolution, cores, seconds_rate):
+    """
+    Description: Estimated memory and time of a stage at a resolution
+    Args:
+        return: dict with level, max_resolution, long_side, megapixels, memory (bytes) and seconds
+    """
+    scaled = working_sizes(sizes, level, max_resolution)
+    pixels = scaled.prod(axis=1)
+    base, per_pixel, per_thread_pixel = MEMORY_PROFILES[stage]
+    threads = min(cores, len(sizes))
+    return {
+        "level": level,
+        "max_resolution": max_resolution,
+        "long_side": int(scaled.max()),
+        "megapixels": float(pixels.sum()) / 1e6,
+        "memory":
+        int(base * GB + per_pixel * pixels.sum() +
+            per_thread_pixel * pixels.max() * threads),
+        "seconds": seconds_rate * float(pixels.sum()) / 1e6,
+    }
+
+
+def choose_resolutions(sizes,
+                       cores,
+                       memory,
+                       quality=QUALITY,
+                       time_budget=None,
+                       rates=None,
+                       fixed=None):
+    """
+    Description: Resolution level of every OpenMVS stage
+    Args:
+        sizes: list of (width, height) of the images the stages read
+        cores: CPU cores of the host
+        memory: bytes the stages may use
+        quality: key of QUALITY_PRESETS
+        time_budget: seconds the three stages may take together, None for no limit
+        rates: dict tool -> seconds per working megapixel, DEFAULT_RATES for the others
+        fixed: dict stage -> level set on the command line, left alone
+        return: (dict stage -> stage_cost, list of notes)
+    """
+    rates = rates or {}
+    fixed = fixed or {}
+    if not sizes:
+        return {}, ["OpenMVS resolution: no images to size the stages on"]
+    sizes = np.array(sizes, dtype=np.int64)
+    long_side = int(sizes.max())
+    preset = QUALITY_PRESETS[quality]
+    settings = {}
+    for stage in OPENMVS_STAGES:
+        target = preset[stage]
+        if stage in fixed:
+            settings[stage] = [fixed[stage], None]
+        elif stage == "DensifyPointCloud":
+            # The last level above the target, then clamped to it exactly
+            settings[stage] = [level_for(long_side, target, False), target]
+        else:
+            settings[stage] = [level_for(long_side, target, True), None]
+
+    def cost(stage):
+        level, max_resolution = settings[stage]
+        seconds_rate = rates.get(stage, DEFAULT_RATES[stage][0])
+        return stage_cost(stage, sizes, level, max_resolution, cores,
+                          seconds_rate)
+
+    notes = []
+    coarser = {}
+    while True:
+        costs = {stage: cost(stage) for stage in OPENMVS_STAGES}
+        adjustable = [
+            stage for stage in OPENMVS_STAGES
+            if stage not in fixed and costs[stage]["long_side"] >
+            MIN_RESOLUTION and settings[stage][0] < MAX_LEVEL
+        ]
+        over_memory = [
+            stage for stage in adjustable if costs[stage]["memory"] > memory
+        ]
+        total_seconds = sum(cost["seconds"] for cost in costs.values())
+        if over_memory:
+            stage = over_memory[0]
+            reason = "memory"
+        elif time_budget is not None and total_seconds > time_budget and adjustable:
+            stage = max(adjustable, key=lambda stage: costs[stage]["seconds"])
+            reason = "time budget"
+        else:
+            break
+        settings[stage][0] += 1
+        if settings[stage][1] is not None:
+            settings[stage][1] = max(MIN_RESOLUTION, settings[stage][1] // 2)
+        coarser[(stage, reason)] = coarser.get((stage, reason), 0) + 1
+    for (stage, reason), levels in coarser.items():
+        notes.append(
+            "OpenMVS resolution: {0} {1} level(s) coarser for the {2}".format(
+                stage, levels, reason))
+    for stage in OPENMVS_STAGES:
+        if costs[stage]["memory"] > memory:
+            notes.append(
+                "OpenMVS resolution: {0} still needs about {1:.1f}GB, more than {2:.1f}GB"
+                .format(stage, costs[stage]["memory"] / GB, memory / GB))
+    if time_budget is not None and total_seconds > time_budget:
+        notes.append(
+            "OpenMVS resolution: about {0:.0f} min at the coarsest levels, over the {1:.0f} min budget"
+            .format(total_seconds / 60, time_budget / 60))
+    notes.append("OpenMVS resolution ({0}): {1}".format(
+        quality, ", ".join(
+            "{0} level {1} ({2}px, ~{3:.1f}GB, ~{4:.0f} min)".format(
+                stage, costs[stage]["level"], costs[stage]["long_side"],
+                costs[stage]["memory"] / GB, costs[stage]["seconds"] / 60)
+            for stage in OPENMVS_STAGES)))
+    return costs, notes
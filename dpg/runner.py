@@ -0,0 +1,208 @@
+"""
+Description: Asyncio process runner with timeouts.
+
+Every tool is started in its own session, so it leads a process group holding
+everything it spawns. A stage that exceeds its wall-clock timeout, or prints
+nothing for longer than its idle timeout, is stopped by sending SIGTERM to
+the whole group and, after a grace period, SIGKILL to whatever is left. The
+same happens when the coroutine running it is cancelled or fails, e.g. on an
+output line longer than LINE_LIMIT.
+
+run_process is used by LocalExecutor (on one event loop per scheduler thread)
+and by the queue workers. dpg.pipeline.run_pipeline runs a whole pipeline on
+the caller's event loop.
+"""
+
+import asyncio, logging, os, shutil, signal, threading, time
+
+from dpg.admission import stage_tool
+
+logger = logging.getLogger("GraphEngine")
+
+# Exit code of a stage stopped by a timeout, as for GNU timeout
+TIMEOUT_EXIT_CODE = 124
+# Seconds between SIGTERM and SIGKILL
+KILL_GRACE = 10
+# Longest output line read at once
+LINE_LIMIT = 16 * 1024 * 1024
+
+# Process groups of the running tools, stopped by terminate_all
+process_groups = set()
+process_groups_lock = threading.Lock()
+
+
+def group_alive(pgid):
+    try:
+        os.killpg(pgid, 0)
+    except (ProcessLookupError, PermissionError):
+        return False
+    return True
+
+
+def signal_group(pgid, signum):
+    try:
+        os.killpg(pgid, signum)
+    except ProcessLookupError:
+        pass
+
+
+async def terminate(process, grace=KILL_GRACE):
+    """
+    Description: SIGTERM the process group of a tool, SIGKILL what is left after the grace period
+    """
+    signal_group(process.pid, signal.SIGTERM)
+    deadline = time.monotonic() + grace
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except asyncio.TimeoutError:
+        pass
+    # Children of the tool may outlive it, they share its group
+    while group_alive(process.pid) and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if group_alive(process.pid):
+        signal_group(process.pid, signal.SIGKILL)
+    await process.wait()
+
+
+def terminate_groups(groups, grace=KILL_GRACE):
+    """
+    Description: SIGTERM some process groups, SIGKILL what is left of them after the grace period
+    """
+    for pgid in groups:
+        signal_group(pgid, signal.SIGTERM)
+    deadline = time.monotonic() + grace
+    while any(group_alive(pgid)
+              for pgid in groups) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    for pgid in groups:
+        if group_alive(pgid):
+            signal_group(pgid, signal.SIGKILL)
+
+
+def terminate_all(grace=KILL_GRACE):
+    """
+    Description: Stop every running tool, for an interrupted pipeline whose stages run on other threads
+    """
+    with process_groups_lock:
+        groups = list(process_groups)
+    terminate_groups(groups, grace)
+
+
+async def run_process(command,
+                      output,
+                      timeout=None,
+                      idle_timeout=None,
+                      on_start=None,
+                      cwd=None,
+                      env=None,
+                      grace=KILL_GRACE):
+    """
+    Description: Run a command in its own process group, streaming its output
+    Args:
+        command: argv
+        output: called with every output line
+        timeout: wall-clock limit in seconds, None for none
+        idle_timeout: longest silence in seconds, None for none
+        on_start: called with the pid once the command started
+        cwd: working directory, None for the current one
+        env: variables added to the environment
+        grace: seconds between SIGTERM and SIGKILL
+        return: exit code, TIMEOUT_EXIT_CODE after a timeout
+    """
+    process = await asyncio.create_subprocess_exec(
+        *map(str, command),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=cwd,
+        env=dict(os.environ, **env) if env else None,
+        start_new_session=True,
+        limit=LINE_LIMIT)
+    with process_groups_lock:
+        process_groups.add(process.pid)
+    try:
+        if on_start is not None:
+            on_start(process.pid)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        while True:
+            wait = idle_timeout or None
+            if deadline is not None:
+                remaining = max(0.0, deadline - loop.time())
+                wait = remaining if wait is None else min(wait, remaining)
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), wait)
+            except asyncio.TimeoutError:
+                if deadline is not None and loop.time() >= deadline:
+                    reason = "ran longer than {0}s".format(timeout)
+                else:
+                    reason = "printed nothing for {0}s".format(idle_timeout)
+                message = "Stopping {0}: it {1}".format(
+                    os.path.basename(str(command[0])), reason)
+                output(message)
+                await terminate(process, grace)
+                return TIMEOUT_EXIT_CODE
+            if not line:
+                break
+            output(line.decode(errors="replace").rstrip("\r\n"))
+        return await process.wait()
+    except BaseException:
+        # Cancelled, or the output could not be read or handled: the tool
+        # must not keep running once the stage is reported failed
+        await terminate(process, grace)
+        raise
+    finally:
+        with process_groups_lock:
+            process_groups.discard(process.pid)
+
+
+def clean_folders(instruction):
+    """
+    Description: Empty the "clean" folders of a stage, to be called right before running it
+    Args:
+        instruction: command dict, its optional "clean" list holds folders that must not
+                     keep the files of an earlier run, e.g. the numbered models of the mapper
+    """
+    for folder in instruction.get("clean", []):
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder, exist_ok=True)
+
+
+def parse_timeouts(values):
+    """
+    Description: Parse timeout options given as SECONDS or STAGE=SECONDS
+    Args:
+        values: list of option values
+        return: (default seconds or None, dict lowercase stage name -> seconds)
+    """
+    default = None
+    per_stage = {}
+    for value in values or []:
+        name, _, seconds = value.rpartition("=")
+        if name:
+            per_stage[name.lower()] = float(seconds)
+        else:
+            default = float(seconds)
+    return default, per_stage
+
+
+def apply_timeouts(commands, timeouts=None, idle_timeouts=None):
+    """
+    Description: Store the timeouts of every stage in its command dict, as "timeout" and "idle_timeout"
+    Args:
+        commands: list of command dicts
+        timeouts: wall-clock timeout option values, see parse_timeouts
+        idle_timeouts: idle timeout option values, see parse_timeouts
+    """
+    for key, values in (("timeout", timeouts), ("idle_timeout",
+                                                 idle_timeouts)):
+        default, per_stage = parse_timeouts(values)
+        for instruction in commands:
+            names = [
+                instruction["title"].lower(),
+                stage_tool(instruction["command"]).lower()
+            ]
+            seconds = next(
+                (per_stage[name] for name in names if name in per_stage),
+                default)
+            if seconds is not None:
+                instruction[key] = seconds
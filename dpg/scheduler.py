@@ -0,0 +1,122 @@
+"""
+Description: Dependency graph scheduler for pipeline stages.
+
+Stages are the command dicts built by createCommands. Dependencies are derived
+from the declared "inputs" and "outputs" paths: a stage waits for every
+earlier stage that writes something it reads or writes, and for every earlier
+stage that reads something it overwrites. Extra edges can be given with a
+"depends" list of stage titles. Stages that declare neither inputs nor
+outputs are treated as barriers, so they keep the strict ordering of the old
+flat command list.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def paths_overlap(first, second):
+    """
+    Description: Check whether two paths are the same or one contains the other
+    """
+    first = os.path.normpath(str(first))
+    second = os.path.normpath(str(second))
+    return (first == second or first.startswith(second + os.sep)
+            or second.startswith(first + os.sep))
+
+
+def any_overlap(first_paths, second_paths):
+    return any(
+        paths_overlap(first, second) for first in first_paths
+        for second in second_paths)
+
+
+def is_declared(stage):
+    return "inputs" in stage or "outputs" in stage or "depends" in stage
+
+
+def conflicts(earlier, later):
+    """
+    Description: Check whether the later stage has to wait for the earlier one
+    """
+    earlier_inputs = earlier.get("inputs", [])
+    earlier_outputs = earlier.get("outputs", [])
+    later_inputs = later.get("inputs", [])
+    later_outputs = later.get("outputs", [])
+    return (any_overlap(earlier_outputs, later_inputs + later_outputs)
+            or any_overlap(earlier_inputs, later_outputs))
+
+
+def resolve_dependencies(commands):
+    """
+    Description: Compute the dependencies of every stage
+    Args:
+        commands: list of command dicts, in the order createCommands produced them
+        return: list of sets, the indices each stage has to wait for
+    """
+    dependencies = []
+    for index, stage in enumerate(commands):
+        if not is_declared(stage):
+            dependencies.append(set(range(index)))
+            continue
+        required = set()
+        for earlier_index in range(index):
+            earlier = commands[earlier_index]
+            if not is_declared(earlier) or conflicts(earlier, stage):
+                required.add(earlier_index)
+        for title in stage.get("depends", []):
+            matches = [
+                earlier_index for earlier_index in range(index)
+                if commands[earlier_index]["title"] == title
+            ]
+            if not matches:
+                raise ValueError("Stage '{0}' depends on unknown stage '{1}'".
+                                 format(stage["title"], title))
+            required.add(matches[-1])
+        dependencies.append(required)
+    return dependencies
+
+
+def run_graph(commands, run_stage, jobs=1, on_interrupt=None):
+    """
+    Description: Run the stages, starting each one as soon as its dependencies succeeded
+    Args:
+        commands: list of command dicts
+        run_stage: callable taking a command dict and returning its exit code,
+                   called from worker threads
+        jobs: maximum number of stages running at the same time
+        on_interrupt: called on Ctrl-C before waiting for the running stages,
+                      to stop them
+        return: the first command dict that failed, or None
+    """
+    dependencies = resolve_dependencies(commands)
+    pending = list(range(len(commands)))
+    succeeded = set()
+    running = {}
+    failed = None
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        try:
+            while pending or running:
+                # After a failure nothing new is started, running stages are allowed to finish
+                if failed is None:
+                    for index in list(pending):
+                        if len(running) >= jobs:
+                            break
+                        if dependencies[index] <= succeeded:
+                            pending.remove(index)
+                            future = pool.submit(run_stage, commands[index])
+                            running[future] = index
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    if future.result() == 0:
+                        succeeded.add(index)
+                    elif failed is None:
+                        failed = commands[index]
+        except KeyboardInterrupt:
+            # Leaving the pool waits for the running stages, stop them first
+            if on_interrupt is not None:
+                on_interrupt()
+            raise
+    return failed
@@ -0,0 +1,927 @@
+"""
+Description: Structure-from-motion backends feeding the OpenMVS stages.
+
+A backend turns the images of a scene into a sparse model, then converts the
+model into an OpenMVS scene, which the densify/mesh/refine/texture stages of
+the pipeline continue from whichever backend produced it:
+
+    backend = create_backend(config, images_folder, working_folder, output_folder)
+    commands = backend.stages()          # --run-colmap or --run-openmvg
+    commands += backend.export_stages()  # first stage of --run-openmvs
+    # OpenMVS reads backend.scene_file and works in backend.mvs_folder
+
+ColmapBackend runs COLMAP in the scene folder, with image preprocessing,
+matcher selection and clustered mapping; with --update it registers the
+images added since the last run into the existing model instead of mapping
+the scene again. OpenMVGBackend runs the OpenMVG global or incremental SfM in
+the output folder. Both read the same images and write to the same stage
+cache, so a scene run once per backend can be compared stage for stage with
+python -m dpg.report.
+"""
+
+import math, os, sys
+
+from dpg.images import list_images
+from dpg.matchers import scene_metadata, select_matcher, matcher_options
+from dpg.update import new_images
+
+# Folder of the helper scripts run as stages, next to the dpg package
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SFM_BACKENDS = ["colmap", "openmvg"]
+# Engine of openMVG_main_SfM for every --sfm-type
+OPENMVG_ENGINES = {
+    "global": "GLOBAL",
+    "incremental": "INCREMENTAL",
+    "incrementalv2": "INCREMENTALV2",
+}
+
+
+def colmap_binary(config):
+    if config.colmap != None:
+        return os.path.join(config.colmap)
+    return "/opt/colmap/bin/colmap"
+
+
+def openmvg_folder(config):
+    return config.openmvg if config.openmvg != None else "/opt/openmvg"
+
+
+def openmvs_binaries(config):
+    if config.openmvs != None:
+        return os.path.join(config.openmvs, "bin", "OpenMVS")
+    return "/opt/openmvs/bin/OpenMVS"
+
+
+class SfmBackend:
+    """
+    Description: Base of the SfM backends, see the module description
+    Args:
+        config: PipelineConfig
+        images_folder: source images of the scene
+        working_folder: scene folder
+        output_folder: output folder of the run
+    Attributes:
+        name: backend name stored in the run report
+        scene_file: OpenMVS scene written by export_stages
+        mvs_folder: working folder of the OpenMVS stages
+        folders: folders the stages write into without creating them
+        notes: decisions taken while planning, logged when the run starts
+    """
+
+    name = None
+
+    def __init__(self, config, images_folder, working_folder, output_folder):
+        self.config = config
+        self.images_folder = images_folder
+        self.working_folder = working_folder
+        self.output_folder = output_folder
+        self.folders = []
+        self.notes = []
+
+    def stages(self):
+        """
+        Description: Stages computing the sparse model
+        Args:
+            return: list of command dicts
+        Raises:
+            ValueError: the options do not describe a valid run
+        """
+        raise NotImplementedError
+
+    def export_stages(self):
+        """
+        Description: Stages converting the sparse model into scene_file
+        Args:
+            return: list of command dicts
+        """
+        raise NotImplementedError
+
+
+class ColmapBackend(SfmBackend):
+    """
+    Description: COLMAP feature extraction, matching and mapping, in the scene folder
+    """
+
+    name = "colmap"
+
+    def __init__(self, config, images_folder, working_folder, output_folder):
+        super().__init__(config, images_folder, working_folder, output_folder)
+        self.mvs_folder = working_folder
+        self.scene_file = os.path.join(working_folder, "model_colmap.mvs")
+        self.dense_folder = os.path.join(working_folder, "dense")
+        self.dense_model_bin = [
+            os.path.join(self.dense_folder, "sparse", name + ".bin")
+            for name in ["cameras", "images", "points3D"]
+        ]
+        self.dense_model_stats = os.path.join(self.dense_folder,
+                                              "model_stats.json")
+        # Files InterfaceCOLMAP reads the model from
+        if config.model_converter:
+            self.dense_model = [
+                os.path.join(self.dense_folder, "sparse", name + ".txt")
+                for name in ["cameras", "images", "points3D"]
+            ]
+        else:
+            # The stats stage also removes the text files of older runs, which InterfaceCOLMAP reads first
+            self.dense_model = self.dense_model_bin + [self.dense_model_stats]
+
+    def stages(self):
+        config = self.config
+        commands = []
+        colmapBin = colmap_binary(config)
+        colmap_working_folder = self.working_folder
+        colmap_images_folder = self.images_folder
+        colmap_database_folder = os.path.join(colmap_working_folder,
+                                              "database.db")
+        colmap_output_folder = os.path.join(colmap_working_folder, "sparse")
+        colmap_view_graph = os.path.join(colmap_working_folder,
+                                         "view_graph.json")
+        colmap_partition_folder = os.path.join(colmap_working_folder,
+                                               "partitions")
+        stageFolders = [colmap_output_folder]
+        clusterCount = 1
+        if config.cluster_size:
+            clusterCount = max(
+                1,
+                int(
+                    math.ceil(
+                        len(list_images(self.images_folder)) /
+                        float(config.cluster_size))))
+        if config.max_image_size:
+            # Working image set, every later stage reads the downsized images
+            preprocessed_images_folder = os.path.join(colmap_working_folder,
+                                                      "images_preprocessed")
+            command = [
+                sys.executable,
+                os.path.join(SCRIPTS_DIR, "preprocess_images.py"),
+                "--input",
+                colmap_images_folder,
+                "--output",
+                preprocessed_images_folder,
+                "--store",
+                os.path.join(colmap_working_folder, ".image_cache"),
+                "--max-size",
+                config.max_image_size,
+                "--quality",
+                config.image_quality,
+            ]
+            if config.preprocess_workers:
+                command += ["--workers", config.preprocess_workers]
+            commands.append({
+                "title": "Preprocess images",
+                "command": command,
+                "inputs": [colmap_images_folder],
+                "outputs": [preprocessed_images_folder],
+            })
+            colmap_images_folder = preprocessed_images_folder
+        if config.update:
+            commands += self.update_stages(colmap_images_folder)
+            commands += self.check_stages()
+            commands += self.undistort_stages(colmap_images_folder)
+            return commands
+
+        # colmap feature_extractor \
+        # --SiftExtraction.use_gpu $use_gpu \
+        # --ImageReader.camera_model OPENCV \
+        # --database_path $database_folder \
+        # --image_path $images_folder \
+        commands.append({
+            "title":
+            "Colmap feature_extractor",
+            "command": [
+                os.path.join(colmapBin),
+                "feature_extractor",
+                "--SiftExtraction.use_gpu",
+                "1",
+                "--ImageReader.camera_model",
+                "SIMPLE_RADIAL",
+                "--database_path",
+                colmap_database_folder,
+                "--image_path",
+                colmap_images_folder,
+            ],
+            "inputs": [colmap_images_folder],
+            "outputs": [colmap_database_folder],
+        })
+        # colmap exhaustive_matcher \
+        # --SiftMatching.use_gpu $use_gpu \
+        # --database_path $database_folder \
+        matcher = config.matcher
+        if matcher == "auto":
+            metadata = scene_metadata(self.images_folder)
+            matcher = select_matcher(metadata, config.exhaustive_limit,
+                                     config.vocab_tree)
+            self.notes.append(
+                "Matcher: {0} ({1} images, {2:.0%} with GPS, sequential names: {3})"
+                .format(matcher, metadata["image_count"],
+                        metadata["gps_ratio"], metadata["sequential"]))
+        if matcher == "vocab_tree" and not config.vocab_tree:
+            raise ValueError("--matcher vocab_tree needs --vocab-tree")
+        commands.append({
+            "title":
+            "colmap {0}_matcher".format(matcher),
+            "command": [
+                os.path.join(colmapBin),
+                "{0}_matcher".format(matcher),
+                "--SiftMatching.use_gpu",
+                "1",
+                "--database_path",
+                colmap_database_folder,
+            ] + matcher_options(config, matcher),
+            "inputs": [colmap_database_folder],
+            "outputs": [colmap_database_folder],
+        })
+        # Match graph check, reads database.db in seconds before the long mapper run
+        command = [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "view_graph.py"),
+            "--database",
+            colmap_database_folder,
+            "--output",
+            colmap_view_graph,
+        ]
+        if config.min_component_ratio is not None:
+            command += ["--min-component-ratio", config.min_component_ratio]
+        commands.append({
+            "title": "Colmap view graph",
+            "command": command,
+            "inputs": [colmap_database_folder],
+            "outputs": [colmap_view_graph],
+        })
+        # colmap mapper \
+        # --database_path $database_folder \
+        # --image_path $images_folder \
+        # --output_path $output_folder \
+        if clusterCount == 1:
+            commands.append({
+                "title":
+                "colmap mapper",
+                "command": [
+                    os.path.join(colmapBin),
+                    "mapper",
+                    "--database_path",
+                    colmap_database_folder,
+                    "--image_path",
+                    colmap_images_folder,
+                    "--output_path",
+                    colmap_output_folder,
+                ],
+                "inputs": [
+                    colmap_database_folder, colmap_images_folder,
+                    colmap_view_graph
+                ],
+                "outputs": [colmap_output_folder],
+                # The mapper leaves the numbered models of an earlier run in place
+                "clean": [colmap_output_folder],
+            })
+        else:
+            # Large scene: map overlapping clusters in parallel, then merge the models
+            cluster_folders = [
+                os.path.join(colmap_partition_folder,
+                             "cluster_{0}".format(index))
+                for index in range(clusterCount)
+            ]
+            commands.append({
+                "title":
+                "Colmap partition",
+                "command": [
+                    sys.executable,
+                    os.path.join(SCRIPTS_DIR, "partition_scene.py"),
+                    "--database",
+                    colmap_database_folder,
+                    "--clusters",
+                    clusterCount,
+                    "--overlap",
+                    config.cluster_overlap,
+                    "--output",
+                    colmap_partition_folder,
+                ],
+                "inputs": [colmap_database_folder, colmap_view_graph],
+                "outputs": [
+                    os.path.join(folder, "images.txt")
+                    for folder in cluster_folders
+                ],
+            })
+            for index, folder in enumerate(cluster_folders):
+                commands.append({
+                    "title":
+                    "colmap mapper cluster {0}".format(index),
+                    "command": [
+                        os.path.join(colmapBin),
+                        "mapper",
+                        "--database_path",
+                        colmap_database_folder,
+                        "--image_path",
+                        colmap_images_folder,
+                        "--image_list_path",
+                        os.path.join(folder, "images.txt"),
+                        "--output_path",
+                        os.path.join(folder, "sparse"),
+                    ],
+                    "inputs": [
+                        colmap_database_folder, colmap_images_folder,
+                        os.path.join(folder, "images.txt")
+                    ],
+                    "outputs": [os.path.join(folder, "sparse")],
+                    # Share of the scene the stage maps, for admission control
+                    "scene_share":
+                    (1.0 + config.cluster_overlap) / clusterCount,
+                })
+                stageFolders.append(os.path.join(folder, "sparse"))
+            merged = os.path.join(cluster_folders[0], "sparse", "0")
+            for index, folder in enumerate(cluster_folders[1:], 1):
+                output = os.path.join(colmap_partition_folder,
+                                      "merged_{0}".format(index))
+                commands.append({
+                    "title":
+                    "colmap model_merger {0}".format(index),
+                    "command": [
+                        os.path.join(colmapBin),
+                        "model_merger",
+                        "--input_path1",
+                        merged,
+                        "--input_path2",
+                        os.path.join(folder, "sparse", "0"),
+                        "--output_path",
+                        output,
+                    ],
+                    "inputs": [merged,
+                               os.path.join(folder, "sparse", "0")],
+                    "outputs": [output],
+                })
+                stageFolders.append(output)
+                merged = output
+            # One global bundle adjustment over the merged model
+            commands.append({
+                "title":
+                "colmap bundle_adjuster",
+                "command": [
+                    os.path.join(colmapBin),
+                    "bundle_adjuster",
+                    "--input_path",
+                    merged,
+                    "--output_path",
+                    os.path.join(colmap_output_folder, "0"),
+                ],
+                "inputs": [merged],
+                "outputs": [os.path.join(colmap_output_folder, "0")],
+                # Models of an earlier unclustered run would compete with this one
+                "clean": [
+                    colmap_output_folder,
+                    os.path.join(colmap_output_folder, "0")
+                ],
+            })
+            stageFolders.append(
+                os.path.join(colmap_output_folder, "0"))
+        commands += self.check_stages()
+        commands += self.undistort_stages(colmap_images_folder)
+        self.folders += stageFolders
+        return commands
+
+    def update_stages(self, colmap_images_folder):
+        """
+        Description: Stages registering the images added since the last run into sparse/0 (--update)
+        Args:
+            colmap_images_folder: image folder the model was built from
+            return: list of command dicts, empty when there are no new images
+        Raises:
+            ValueError: the scene has no model to update
+        """
+        config = self.config
+        commands = []
+        colmapBin = colmap_binary(config)
+        colmap_database_folder = os.path.join(self.working_folder,
+                                              "database.db")
+        colmap_model_folder = os.path.join(self.working_folder, "sparse", "0")
+        update_folder = os.path.join(self.working_folder, "update")
+        new_images_list = os.path.join(update_folder, "new_images.txt")
+        match_pairs_list = os.path.join(update_folder, "match_pairs.txt")
+        if not os.path.isfile(colmap_database_folder) or not os.path.isfile(
+                os.path.join(colmap_model_folder, "images.bin")):
+            raise ValueError(
+                "--update needs the database.db and sparse/0 of an earlier --run-colmap in {0}"
+                .format(self.working_folder))
+        # Decided on the source images, the working image set may not be refreshed yet
+        imageCount = len(list_images(self.images_folder))
+        newImages = new_images(self.images_folder, colmap_model_folder)
+        if not newImages:
+            self.notes.append(
+                "Update: no new images, sparse/0 is kept as it is")
+            return commands
+        # Share of the scene extracted and matched, for admission control
+        share = len(newImages) / float(imageCount)
+        self.notes.append(
+            "Update: {0} new images of {1} registered into sparse/0".format(
+                len(newImages), imageCount))
+        commands.append({
+            "title":
+            "Colmap update image lists",
+            "command": [
+                sys.executable,
+                os.path.join(SCRIPTS_DIR, "update_scene.py"),
+                "--images",
+                colmap_images_folder,
+                "--model",
+                colmap_model_folder,
+                "--output",
+                update_folder,
+            ],
+            "inputs": [colmap_images_folder, colmap_model_folder],
+            "outputs": [new_images_list, match_pairs_list],
+        })
+        # feature_extractor skips the images already in database.db
+        commands.append({
+            "title":
+            "Colmap update feature_extractor",
+            "command": [
+                os.path.join(colmapBin),
+                "feature_extractor",
+                "--SiftExtraction.use_gpu",
+                "1",
+                "--ImageReader.camera_model",
+                "SIMPLE_RADIAL",
+                "--database_path",
+                colmap_database_folder,
+                "--image_path",
+                colmap_images_folder,
+                "--image_list_path",
+                new_images_list,
+            ],
+            "inputs": [colmap_images_folder, new_images_list],
+            "outputs": [colmap_database_folder],
+            "scene_share": share,
+        })
+        if config.vocab_tree:
+            # Only the nearest images of the new ones by the vocabulary tree
+            command = [
+                os.path.join(colmapBin),
+                "vocab_tree_matcher",
+                "--SiftMatching.use_gpu",
+                "1",
+                "--database_path",
+                colmap_database_folder,
+            ] + matcher_options(config, "vocab_tree") + [
+                "--VocabTreeMatching.match_list_path", new_images_list
+            ]
+            matchList = new_images_list
+        else:
+            command = [
+                os.path.join(colmapBin),
+                "matches_importer",
+                "--SiftMatching.use_gpu",
+                "1",
+                "--database_path",
+                colmap_database_folder,
+                "--match_list_path",
+                match_pairs_list,
+                "--match_type",
+                "pairs",
+            ]
+            matchList = match_pairs_list
+        commands.append({
+            "title": "Colmap update matching",
+            "command": command,
+            "inputs": [colmap_database_folder, matchList],
+            "outputs": [colmap_database_folder],
+            "scene_share": share,
+        })
+        # The registered images keep their poses, the new ones are added to the model
+        commands.append({
+            "title":
+            "colmap image_registrator",
+            "command": [
+                os.path.join(colmapBin),
+                "image_registrator",
+                "--database_path",
+                colmap_database_folder,
+                "--input_path",
+                colmap_model_folder,
+                "--output_path",
+                colmap_model_folder,
+            ],
+            "inputs": [colmap_database_folder, colmap_model_folder],
+            "outputs": [colmap_model_folder],
+        })
+        commands.append({
+            "title":
+            "colmap update bundle_adjuster",
+            "command": [
+                os.path.join(colmapBin),
+                "bundle_adjuster",
+                "--input_path",
+                colmap_model_folder,
+                "--output_path",
+                colmap_model_folder,
+            ],
+            "inputs": [colmap_model_folder],
+            "outputs": [colmap_model_folder],
+        })
+        self.folders.append(update_folder)
+        return commands
+
+    def check_stages(self):
+        """
+        Description: Gate between the mapper and the dense stages, moving the best model to sparse/0
+        Args:
+            return: list of command dicts, empty with --no-model-check
+        """
+        config = self.config
+        if config.no_model_check:
+            return []
+        colmap_database_folder = os.path.join(self.working_folder,
+                                              "database.db")
+        colmap_output_folder = os.path.join(self.working_folder, "sparse")
+        colmap_model_check = os.path.join(self.working_folder,
+                                          "model_check.json")
+        command = [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "colmap_model.py"),
+            "check",
+            colmap_output_folder,
+            "--database",
+            colmap_database_folder,
+            "--json",
+            colmap_model_check,
+            "--min-registered-ratio",
+            config.min_registered_ratio,
+            "--max-mean-error",
+            config.max_mean_error,
+            "--min-points",
+            config.min_model_points,
+        ]
+        if config.min_mean_track_length is not None:
+            command += [
+                "--min-mean-track-length", config.min_mean_track_length
+            ]
+        # Fails the run when the model is too weak, before hours of dense reconstruction
+        return [{
+            "title": "Colmap model check",
+            "command": command,
+            "inputs": [colmap_output_folder, colmap_database_folder],
+            "outputs": [colmap_output_folder, colmap_model_check],
+        }]
+
+    def undistort_stages(self, colmap_images_folder):
+        """
+        Description: Stages undistorting the images of sparse/0 into the dense folder
+        Args:
+            colmap_images_folder: image folder the model was built from
+            return: list of command dicts
+        """
+        commands = []
+        colmapBin = colmap_binary(self.config)
+        colmap_working_folder = self.working_folder
+        colmap_output_folder = os.path.join(colmap_working_folder, "sparse")
+        colmap_dense_folder = self.dense_folder
+        colmap_dense_model_bin = self.dense_model_bin
+        # colmap image_undistorter \
+        # --image_path $images_folder \
+        # --input_path $output_folder/0 \
+        # --output_path $working_folder/dense \
+        # --output_type COLMAP \
+        commands.append({
+            "title":
+            "colmap image_undistorter",
+            "command": [
+                os.path.join(colmapBin),
+                "image_undistorter",
+                "--image_path",
+                colmap_images_folder,
+                "--input_path",
+                os.path.join(colmap_output_folder, "0"),
+                "--output_path",
+                os.path.join(colmap_working_folder, "dense"),
+                "--output_type",
+                "COLMAP",
+            ],
+            "inputs": [
+                colmap_images_folder,
+                os.path.join(colmap_output_folder, "0")
+            ],
+            "outputs": [os.path.join(colmap_dense_folder, "images")] +
+            colmap_dense_model_bin,
+        })
+        if not self.config.model_converter:
+            # InterfaceCOLMAP reads the binary model, only summarize it
+            commands.append({
+                "title":
+                "Colmap model stats",
+                "command": [
+                    sys.executable,
+                    os.path.join(SCRIPTS_DIR, "colmap_model.py"),
+                    "stats",
+                    os.path.join(colmap_dense_folder, "sparse"),
+                    "--json",
+                    self.dense_model_stats,
+                    "--drop-text",
+                ],
+                "inputs": colmap_dense_model_bin,
+                "outputs": [self.dense_model_stats],
+            })
+            return commands
+        # colmap model_converter \
+        # --input_path $working_folder/dense/sparse \
+        # --output_path $working_folder/dense/sparse \
+        # --output_type TXT
+        commands.append({
+            "title":
+            "colmap model_converter",
+            "command": [
+                os.path.join(colmapBin),
+                "model_converter",
+                "--input_path",
+                os.path.join(colmap_working_folder, "dense", "sparse"),
+                "--output_path",
+                os.path.join(colmap_working_folder, "dense", "sparse"),
+                "--output_type",
+                "TXT",
+            ],
+            "inputs": colmap_dense_model_bin,
+            "outputs": self.dense_model,
+        })
+        return commands
+
+    def export_stages(self):
+        colmap_working_folder = self.working_folder
+        # sudo ./InterfaceCOLMAP \
+        # --working-folder $working_folder \
+        # -i $working_folder/dense/ \
+        # --output-file $working_folder/model_colmap.mvs
+        return [{
+            "title":
+            "Convert Colmap project to OpenMVS",
+            "command": [
+                os.path.join(openmvs_binaries(self.config), "InterfaceCOLMAP"),
+                "--working-folder",
+                os.path.join(colmap_working_folder),
+                "-i",
+                self.dense_folder,
+                "--output-file",
+                self.scene_file,
+            ],
+            "inputs": [os.path.join(self.dense_folder, "images")] +
+            self.dense_model,
+            "outputs": [self.scene_file],
+        }]
+
+
+class OpenMVGBackend(SfmBackend):
+    """
+    Description: OpenMVG global or incremental SfM (--sfm-type), in the output folder
+    """
+
+    def __init__(self, config, images_folder, working_folder, output_folder):
+        super().__init__(config, images_folder, working_folder, output_folder)
+        self.name = "openmvg-" + config.sfm_type
+        self.matches_folder = os.path.join(output_folder, "matches")
+        # One folder per SfM type, so the types can be compared on one scene
+        self.reconstruction_folder = os.path.join(
+            output_folder, "reconstruction_" + config.sfm_type)
+        self.mvs_folder = os.path.join(output_folder, "omvs")
+        self.scene_file = os.path.join(self.mvs_folder, "scene.mvs")
+
+    def stages(self):
+        config = self.config
+        imageListingOptions = []
+        computeFeaturesOptions = []
+        computeMatchesOptions = []
+        geometricFilterOptions = []
+        incrementalSFMOptions = []
+        globalSFMOptions = []
+        commands = []
+        openmvgBin = os.path.join(openmvg_folder(config), "bin")
+        cameraSensorsDB = os.path.join(openmvg_folder(config), "share",
+                                       "openMVG",
+                                       "sensor_width_camera_database.txt")
+        matchesDirectory = self.matches_folder
+        reconstructionDirectory = self.reconstruction_folder
+        sfmData = os.path.join(matchesDirectory, "sfm_data.json")
+
+        # Recompute
+        if config.recompute:
+            computeFeaturesOptions += ["-f", "1"]
+            computeMatchesOptions += ["-f", "1"]
+
+        # OpenMVG Image Listing
+        if config.cgroup:
+            imageListingOptions += ["-g", "0"]
+        if config.flength != None:
+            imageListingOptions += ["-f", config.flength]
+        if config.cmodel != None:
+            imageListingOptions += ["-c", config.cmodel]
+
+        # OpenMVG Compute Features
+        if config.descmethod != None:
+            computeFeaturesOptions += ["-m", config.descmethod.upper()]
+        if config.dpreset != None:
+            computeFeaturesOptions += ["-p", config.dpreset.upper()]
+        if config.upright:
+            computeFeaturesOptions += ["-u", "1"]
+
+        # Geometric filter options, the global SfM needs essential matrices
+        geometricModel = config.geomodel
+        if geometricModel == None:
+            geometricModel = "e" if config.sfm_type == "global" else "f"
+        geometricFilterOptions += ["-g", geometricModel]
+        filteredMatches = os.path.join(matchesDirectory,
+                                       "matches.{0}.bin".format(geometricModel))
+
+        # OpenMVG Match Matches
+        if config.ratio != None:
+            computeMatchesOptions += ["-r", config.ratio]
+        if config.matching != None:
+            computeMatchesOptions += ["-n", config.matching]
+
+        # OpenMVG Inremental SfM
+        if config.icmodel != None:
+            incrementalSFMOptions += ["-c", config.icmodel]
+
+        # OpenMVG Global SfM
+        if config.grotavg != None:
+            globalSFMOptions += ["-r", config.grotavg]
+        if config.gtransavg != None:
+            globalSFMOptions += ["-t", config.gtransavg]
+
+        commands.append({
+            "title":
+            "Instrics analysis",
+            "command": [
+                os.path.join(openmvgBin, "openMVG_main_SfMInit_ImageListing"),
+                "-i",
+                self.images_folder,
+                "-o",
+                matchesDirectory,
+                "-d",
+                cameraSensorsDB,
+            ] + imageListingOptions,
+            "inputs": [self.images_folder],
+            "outputs": [sfmData],
+        })
+
+        commands.append({
+            "title":
+            "Compute features",
+            "command": [
+                os.path.join(openmvgBin, "openMVG_main_ComputeFeatures"),
+                "-i",
+                sfmData,
+                "-o",
+                matchesDirectory,
+                "-m",
+                "SIFT",
+            ] + computeFeaturesOptions,
+            "inputs": [sfmData],
+            # The .feat/.desc files of the images are written next to it
+            "outputs": [os.path.join(matchesDirectory, "image_describer.json")],
+        })
+
+        commands.append({
+            "title":
+            "Compute matching pairs",
+            "command": [
+                os.path.join(openmvgBin, "openMVG_main_PairGenerator"),
+                "-i",
+                sfmData,
+                "-o",
+                os.path.join(matchesDirectory, "pairs.bin"),
+            ],
+            "inputs": [sfmData],
+            "outputs": [os.path.join(matchesDirectory, "pairs.bin")],
+        })
+
+        commands.append({
+            "title":
+            "Compute matches",
+            "command": [
+                os.path.join(openmvgBin, "openMVG_main_ComputeMatches"),
+                "-i",
+                sfmData,
+                "-p",
+                os.path.join(matchesDirectory, "pairs.bin"),
+                "-o",
+                os.path.join(matchesDirectory, "matches.putative.bin"),
+            ] + computeMatchesOptions,
+            "inputs": [
+                sfmData,
+                os.path.join(matchesDirectory, "image_describer.json"),
+                os.path.join(matchesDirectory, "pairs.bin")
+            ],
+            "outputs":
+            [os.path.join(matchesDirectory, "matches.putative.bin")],
+        })
+
+        commands.append({
+            "title":
+            "Filter matches",
+            "command": [
+                os.path.join(openmvgBin, "openMVG_main_GeometricFilter"),
+                "-i",
+                sfmData,
+                "-m",
+                os.path.join(matchesDirectory, "matches.putative.bin"),
+                "-o",
+                filteredMatches,
+            ] + geometricFilterOptions,
+            "inputs":
+            [sfmData,
+             os.path.join(matchesDirectory, "matches.putative.bin")],
+            "outputs": [filteredMatches],
+        })
+
+        # Select pipeline type
+        if config.sfm_type == "global":
+            title = "Do Global reconstruction"
+            sfmOptions = globalSFMOptions
+        else:
+            title = "Do incremental/sequential reconstruction"
+            sfmOptions = incrementalSFMOptions
+        commands.append({
+            "title":
+            title,
+            "command": [
+                os.path.join(openmvgBin, "openMVG_main_SfM"),
+                "-s",
+                OPENMVG_ENGINES[config.sfm_type],
+                "-i",
+                sfmData,
+                "-m",
+                matchesDirectory,
+                "-M",
+                filteredMatches,
+                "-o",
+                reconstructionDirectory,
+            ] + sfmOptions,
+            "inputs": [sfmData, filteredMatches],
+            "outputs": [os.path.join(reconstructionDirectory, "sfm_data.bin")],
+        })
+
+        if config.colorize:
+            commands.append({
+                "title":
+                "Colorize sparse point cloud",
+                "command": [
+                    os.path.join(openmvgBin,
+                                 "openMVG_main_ComputeSfM_DataColor"),
+                    "-i",
+                    os.path.join(reconstructionDirectory, "sfm_data.bin"),
+                    "-o",
+                    os.path.join(reconstructionDirectory, "colorized.ply"),
+                ],
+                "inputs":
+                [os.path.join(reconstructionDirectory, "sfm_data.bin")],
+                "outputs":
+                [os.path.join(reconstructionDirectory, "colorized.ply")],
+            })
+        self.folders += [matchesDirectory, reconstructionDirectory]
+        return commands
+
+    def export_stages(self):
+        sfmData = os.path.join(self.reconstruction_folder, "sfm_data.bin")
+        undistorted = os.path.join(self.mvs_folder, "undistorted_images")
+        self.folders.append(self.mvs_folder)
+        return [{
+            "title":
+            "Convert OpenMVG project to OpenMVS",
+            "command": [
+                os.path.join(openmvg_folder(self.config), "bin",
+                             "openMVG_main_openMVG2openMVS"),
+                "-i",
+                sfmData,
+                "-o",
+                self.scene_file,
+                "-d",
+                undistorted,
+            ],
+            "inputs": [sfmData],
+            "outputs": [self.scene_file, undistorted],
+        }]
+
+
+def create_backend(config, images_folder, working_folder, output_folder):
+    """
+    Description: SfM backend of a run, OpenMVG with --run-openmvg, COLMAP with --run-colmap
+    Args:
+        config: PipelineConfig
+        images_folder: source images of the scene
+        working_folder: scene folder
+        output_folder: output folder of the run
+        return: SfmBackend
+    Raises:
+        ValueError: the options ask for more than one backend, or --update with OpenMVG
+    """
+    if config.run_colmap and config.run_openmvg:
+        raise ValueError(
+            "--run-colmap and --run-openmvg select the SfM backend, run the pipeline once per backend to compare them"
+        )
+    name = config.sfm_backend
+    if name is None:
+        name = "openmvg" if config.run_openmvg else "colmap"
+    if (config.run_colmap and name != "colmap") or (config.run_openmvg
+                                                    and name != "openmvg"):
+        raise ValueError("--sfm-backend {0} does not match --run-{1}".format(
+            name, "colmap" if config.run_colmap else "openmvg"))
+    if config.update and name != "colmap":
+        raise ValueError("--update needs the COLMAP backend")
+    backend = OpenMVGBackend if name == "openmvg" else ColmapBackend
+    return backend(config, images_folder, working_folder, output_folder)
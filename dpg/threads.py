@@ -0,0 +1,155 @@
+"""
+Description: Thread counts and CPU affinity of the tools a stage runs.
+
+Left alone, COLMAP (num_threads -1) and OpenMVS (--max-threads 0) start one
+thread per core, so two scenes on one host run twice as many threads as there
+are cores and both slow down. The admission control hands every stage a
+thread count out of a host-wide CPU budget, and this module turns the count
+into the options of the tool:
+
+    COLMAP     --SiftExtraction.num_threads, --SiftMatching.num_threads,
+               --Mapper.num_threads, --StereoFusion.num_threads
+    OpenMVS    --max-threads
+    OpenMVG    --numThreads (ComputeFeatures), OMP_NUM_THREADS for the others
+
+OMP_NUM_THREADS is set for every stage, which also bounds the OpenMP loops
+and the NumPy of the python stages. Options already on the command line are
+kept. The running stages are also pinned to disjoint blocks of cores, so the
+threads of one stage do not compete with the threads of another one.
+"""
+
+import os
+import psutil
+
+# Option of the tool taking the number of threads
+THREAD_OPTIONS = {
+    "feature_extractor": "--SiftExtraction.num_threads",
+    "exhaustive_matcher": "--SiftMatching.num_threads",
+    "sequential_matcher": "--SiftMatching.num_threads",
+    "vocab_tree_matcher": "--SiftMatching.num_threads",
+    "spatial_matcher": "--SiftMatching.num_threads",
+    "transitive_matcher": "--SiftMatching.num_threads",
+    "matches_importer": "--SiftMatching.num_threads",
+    "mapper": "--Mapper.num_threads",
+    "image_registrator": "--Mapper.num_threads",
+    "point_triangulator": "--Mapper.num_threads",
+    "stereo_fusion": "--StereoFusion.num_threads",
+    "InterfaceCOLMAP": "--max-threads",
+    "DensifyPointCloud": "--max-threads",
+    "ReconstructMesh": "--max-threads",
+    "RefineMesh": "--max-threads",
+    "TextureMesh": "--max-threads",
+    "openMVG_main_ComputeFeatures": "--numThreads",
+}
+
+AFFINITY_SUPPORTED = hasattr(os, "sched_setaffinity")
+
+
+def available_cores():
+    """
+    Description: Cores this process may run on, sorted
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(psutil.cpu_count() or 1))
+
+
+def has_option(command, option):
+    return any(
+        argument == option or argument.startswith(option + "=")
+        for argument in command)
+
+
+def with_threads(command, tool, threads):
+    """
+    Description: Command running its tool with a number of threads
+    Args:
+        command: argv of the stage
+        tool: name of the tool, see dpg.admission.stage_tool
+        threads: number of threads
+        return: new argv, the same one when the tool has no thread option or already got one
+    """
+    command = list(map(str, command))
+    option = THREAD_OPTIONS.get(tool)
+    if option is None or has_option(command, option):
+        return command
+    return command + [option, str(threads)]
+
+
+def thread_env(threads):
+    """
+    Description: Environment bounding the OpenMP threads of a stage
+    """
+    return {"OMP_NUM_THREADS": str(threads)}
+
+
+def place_cores(threads, cores):
+    """
+    Description: Split the cores into one contiguous block per stage
+    Args:
+        threads: list of the thread counts of the running stages, oldest first
+        cores: list of the cores to hand out
+        return: list of core lists, one per stage. The blocks shrink in proportion
+                to the thread counts when there are more threads than cores
+    """
+    if not threads:
+        return []
+    total = sum(threads)
+    sizes = list(threads)
+    if total > len(cores):
+        shares = [count * len(cores) / float(total) for count in threads]
+        sizes = [max(1, int(share)) for share in shares]
+        # The cores left by the rounding go to the largest remainders
+        order = sorted(range(len(threads)),
+                       key=lambda index: int(shares[index]) - shares[index])
+        for index in order[:max(0, len(cores) - sum(sizes))]:
+            sizes[index] += 1
+        # Stages raised to one core take it from the largest blocks
+        while sum(sizes) > len(cores) and max(sizes) > 1:
+            sizes[sizes.index(max(sizes))] -= 1
+    blocks = []
+    start = 0
+    for size in sizes:
+        # More stages than cores wrap around
+        blocks.append(
+            [cores[(start + offset) % len(cores)] for offset in range(size)])
+        start += size
+    return blocks
+
+
+def pin_process_tree(pid, cores):
+    """
+    Description: Restrict a process, its children and all their threads to some cores
+    Args:
+        return: False when the process is gone or may not be changed
+    """
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+    pinned = False
+    for process in processes:
+        try:
+            # Threads started later inherit the affinity of the thread starting them
+            for thread in process.threads():
+                os.sched_setaffinity(thread.id, cores)
+            pinned = True
+        except (psutil.NoSuchProcess, psutil.AccessDenied, OSError):
+            pass
+    return pinned
+
+
+def format_cores(cores):
+    """
+    Description: Cores as ranges, e.g. 0-3,8
+    """
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(
+        str(first) if first == last else "{0}-{1}".format(first, last)
+        for first, last in ranges)
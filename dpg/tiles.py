@@ -0,0 +1,433 @@
+"""
+Description: Split DensifyPointCloud into view subsets and merge their point clouds.
+
+DensifyPointCloud --output-view-neighbors-file writes one line per view:
+the view ID followed by the IDs of its neighbor views. "plan" orders the
+views so that neighbors stay close (see dpg.partition), cuts them into tiles
+and writes one neighbors file per tile with the lines of its views. Each tile
+is then densified with --view-neighbors-file. This assumes DensifyPointCloud
+then estimates and fuses only the depth maps of the views listed in the file,
+still matching them against their neighbors in other tiles, so that its peak
+memory follows the tile size rather than the scene size. Whether it does
+depends on the OpenMVS version; compare the memory profile of a tiled and an
+untiled run (--profile-interval) before relying on it.
+
+"merge" joins the PLY point clouds of the tiles. Surfaces seen by views of
+two tiles are fused by both, so the overlaps would hold every point twice.
+The PLY files do not say which views a point comes from, so the overlaps are
+found on a voxel grid: a voxel holding points of several tiles keeps the
+points of the tile with the most points in it and drops the others. The voxel
+is sized from the point density, about POINTS_PER_VOXEL points of one tile,
+so it is coarse enough for the two fusions of a surface to meet in it and
+fine enough to keep apart surfaces that only one tile saw. The vertex records
+are copied as they are, only the vertex count in the header changes. The
+tiles are memory mapped and read CHUNK_VERTICES points at a time, one tile
+after the other: the memory used is the chunk plus one entry per occupied
+voxel, not the merged cloud.
+--keep-overlap concatenates the tiles without looking at the points.
+
+Usage:
+    densify_tiles.py plan --neighbors neighbors.txt --tiles 4 --output densify_tiles
+    densify_tiles.py merge --output model_dense.ply tile_0/model_dense.ply tile_1/model_dense.ply
+"""
+
+import argparse, os, shutil, sys
+import numpy as np
+
+from dpg.partition import spatial_order
+
+# Points of one tile in a voxel of the overlap grid
+POINTS_PER_VOXEL = 16
+# Voxel sizes tried when sizing the grid, between the extent of the cloud
+# divided by this and the extent itself
+MAX_VOXELS_PER_AXIS = 1 << 20
+# Bisection steps sizing the grid, each one a pass over the largest tile
+VOXEL_SIZE_STEPS = 12
+# Vertices read at once from a memory mapped tile
+CHUNK_VERTICES = 1 << 20
+PLY_TYPES = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "<i2",
+    "int16": "<i2",
+    "ushort": "<u2",
+    "uint16": "<u2",
+    "int": "<i4",
+    "int32": "<i4",
+    "uint": "<u4",
+    "uint32": "<u4",
+    "float": "<f4",
+    "float32": "<f4",
+    "double": "<f8",
+    "float64": "<f8",
+}
+
+
+def read_view_neighbors(path):
+    """
+    Description: Parse a view neighbors file
+    Args:
+        return: dict view ID -> (list of neighbor IDs, original line)
+    """
+    views = {}
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if not fields or not fields[0].isdigit():
+                continue
+            views[int(fields[0])] = ([int(field) for field in fields[1:]],
+                                     line.rstrip("\n"))
+    return views
+
+
+def plan(views, tiles):
+    """
+    Description: Split the views into tiles of neighboring views
+    Args:
+        views: result of read_view_neighbors
+        tiles: number of tiles
+        return: list of lists of view IDs
+    """
+    graph = {view: {} for view in views}
+    for view, (neighbors, _) in views.items():
+        for rank, neighbor in enumerate(neighbors):
+            if neighbor not in graph:
+                continue
+            # Best ranked neighbors weigh the most
+            weight = len(neighbors) - rank
+            graph[view][neighbor] = max(graph[view].get(neighbor, 0), weight)
+            graph[neighbor][view] = max(graph[neighbor].get(view, 0), weight)
+    order = spatial_order(graph)
+    return [
+        order[len(order) * index // tiles:len(order) * (index + 1) // tiles]
+        for index in range(tiles)
+    ]
+
+
+def read_ply_header(file):
+    """
+    Description: Read a PLY header, leaving the file at the start of the data
+    Args:
+        return: (list of header lines, vertex count)
+    """
+    lines = []
+    count = None
+    while True:
+        line = file.readline()
+        if not line:
+            raise ValueError("{0}: no end_header".format(file.name))
+        line = line.decode("ascii").rstrip("\r\n")
+        lines.append(line)
+        fields = line.split()
+        if fields[:1] == ["element"]:
+            if fields[1] != "vertex":
+                raise ValueError("{0}: element {1} cannot be merged".format(
+                    file.name, fields[1]))
+            count = int(fields[2])
+        if line == "end_header":
+            return lines, count
+
+
+def vertex_dtype(lines):
+    """
+    Description: Record type of the vertices of a binary little endian PLY
+    Args:
+        lines: header lines from read_ply_header
+        return: numpy dtype
+    Raises:
+        ValueError: another format, or list properties
+    """
+    if "format binary_little_endian 1.0" not in lines:
+        raise ValueError("only binary little endian PLY files are supported")
+    fields = []
+    for line in lines:
+        parts = line.split()
+        if parts[:1] != ["property"]:
+            continue
+        if parts[1] == "list" or parts[1] not in PLY_TYPES:
+            raise ValueError("unsupported property: {0}".format(line))
+        fields.append((parts[2], PLY_TYPES[parts[1]]))
+    dtype = np.dtype(fields)
+    if not {"x", "y", "z"} <= set(dtype.names or ()):
+        raise ValueError("no x, y and z vertex properties")
+    return dtype
+
+
+def map_vertices(path):
+    """
+    Description: Vertex records of a PLY file, memory mapped
+    Args:
+        return: read-only structured array with the properties of the file
+    """
+    with open(path, "rb") as file:
+        lines, count = read_ply_header(file)
+        offset = file.tell()
+        size = os.fstat(file.fileno()).st_size
+    dtype = vertex_dtype(lines)
+    if size - offset < count * dtype.itemsize:
+        raise ValueError("{0}: {1} of {2} vertices".format(
+            path, (size - offset) // dtype.itemsize, count))
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=count)
+
+
+def chunk_points(vertices):
+    """
+    Description: Points of a tile, CHUNK_VERTICES at a time
+    Args:
+        vertices: structured array from map_vertices
+        return: iterator of (first vertex index, (n, 3) float array)
+    """
+    for first in range(0, len(vertices), CHUNK_VERTICES):
+        chunk = vertices[first:first + CHUNK_VERTICES]
+        yield first, np.stack([chunk["x"], chunk["y"], chunk["z"]],
+                              axis=1).astype(np.float64)
+
+
+def tile_bounds(vertices):
+    """
+    Description: Corners of the bounding box of a non-empty tile
+    """
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    for _, xyz in chunk_points(vertices):
+        low = np.minimum(low, xyz.min(axis=0))
+        high = np.maximum(high, xyz.max(axis=0))
+    return low, high
+
+
+def voxel_keys(xyz, origin, size, shape):
+    """
+    Description: Index of the voxel of every point, in a grid shared by all the tiles
+    """
+    cells = np.floor((xyz - origin) / size).astype(np.int64)
+    cells = np.clip(cells, 0, shape - 1)
+    return (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+
+
+def voxel_counts(vertices, origin, size, shape):
+    """
+    Description: Occupied voxels of a tile with the number of its points in each
+    Args:
+        vertices: structured array from map_vertices
+        origin, size, shape: grid, see voxel_keys
+        return: (sorted voxel indices, point counts)
+    """
+    voxels = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    for _, xyz in chunk_points(vertices):
+        keys, chunk_counts = np.unique(voxel_keys(xyz, origin, size, shape),
+                                       return_counts=True)
+        voxels, inverse = np.unique(np.concatenate([voxels, keys]),
+                                    return_inverse=True)
+        counts = np.bincount(inverse.ravel(),
+                             weights=np.concatenate([counts, chunk_counts]),
+                             minlength=len(voxels)).astype(np.int64)
+    return voxels, counts
+
+
+def voxel_size(vertices, bounds, extent):
+    """
+    Description: Voxel size holding about POINTS_PER_VOXEL points of a cloud
+    Args:
+        vertices: structured array of one tile, from map_vertices
+        bounds: corners of the bounding box of the tile
+        extent: largest side of the bounding box of all the tiles
+        return: voxel size
+    """
+    low = extent / MAX_VOXELS_PER_AXIS
+    high = extent
+    origin, corner = bounds
+    # Points per occupied voxel grows with the voxel size, bisect on a log scale
+    for _ in range(VOXEL_SIZE_STEPS):
+        size = np.sqrt(low * high)
+        shape = np.floor((corner - origin) / size).astype(np.int64) + 1
+        occupied = len(voxel_counts(vertices, origin, size, shape)[0])
+        if len(vertices) / float(occupied) < POINTS_PER_VOXEL:
+            low = size
+        else:
+            high = size
+    return high
+
+
+def voxel_owners(tiles):
+    """
+    Description: Tile owning every voxel of the overlap grid, from passes over one tile at a time
+    Args:
+        tiles: list of structured arrays from map_vertices
+        return: dict with grid (origin, size, shape for voxel_keys), voxels (sorted occupied
+                voxels), owners (tile index of each voxel) and kept (points each tile keeps),
+                None when fewer than two tiles have points
+    """
+    filled = [index for index, vertices in enumerate(tiles) if len(vertices)]
+    if len(filled) < 2:
+        return None
+    bounds = {index: tile_bounds(tiles[index]) for index in filled}
+    origin = np.min([low for low, _ in bounds.values()], axis=0)
+    corner = np.max([high for _, high in bounds.values()], axis=0)
+    extent = float((corner - origin).max()) or 1.0
+    largest = max(filled, key=lambda index: len(tiles[index]))
+    size = voxel_size(tiles[largest], bounds[largest], extent)
+    shape = np.floor((corner - origin) / size).astype(np.int64) + 1
+    # Points of every tile in every voxel, as many entries as occupied voxels
+    voxels, counts, tile_ids = [], [], []
+    for index in filled:
+        tile_voxels, tile_counts = voxel_counts(tiles[index], origin, size,
+                                                shape)
+        voxels.append(tile_voxels)
+        counts.append(tile_counts)
+        tile_ids.append(np.full(len(tile_voxels), index))
+    voxels = np.concatenate(voxels)
+    counts = np.concatenate(counts)
+    tile_ids = np.concatenate(tile_ids)
+    # Per voxel, the tile with the most points comes first, ties go to the first tile
+    order = np.lexsort((-counts, voxels))
+    voxels, counts, tile_ids = voxels[order], counts[order], tile_ids[order]
+    first = np.ones(len(voxels), dtype=bool)
+    first[1:] = voxels[1:] != voxels[:-1]
+    return {
+        "grid": (origin, size, shape),
+        "voxels": voxels[first],
+        "owners": tile_ids[first],
+        "kept": np.bincount(tile_ids[first],
+                            weights=counts[first],
+                            minlength=len(tiles)).astype(np.int64),
+    }
+
+
+def owned_points(xyz, index, owners):
+    """
+    Description: Points of a tile outside the overlaps it does not own
+    Args:
+        xyz: (n, 3) points of the tile
+        index: index of the tile
+        owners: result of voxel_owners
+        return: boolean mask
+    """
+    keys = voxel_keys(xyz, *owners["grid"])
+    return owners["owners"][np.searchsorted(owners["voxels"], keys)] == index
+
+
+def merge_ply(paths, output, keep_overlap=False):
+    """
+    Description: Merge point clouds with the same vertex layout
+    Args:
+        paths: PLY files of the tiles
+        output: merged PLY file
+        keep_overlap: True to concatenate the tiles as they are
+        return: (vertex count of the merged cloud, vertices dropped in the overlaps)
+    Raises:
+        ValueError: the tiles have different layouts, or their points cannot be read
+                    to find the overlaps
+    """
+    layout = None
+    total = 0
+    for path in paths:
+        with open(path, "rb") as file:
+            lines, count = read_ply_header(file)
+        tile_layout = [
+            line for line in lines
+            if not line.startswith(("comment", "obj_info", "element vertex"))
+        ]
+        if layout is None:
+            layout = tile_layout
+            header = lines
+        elif tile_layout != layout:
+            raise ValueError("{0} does not have the vertex layout of {1}".format(
+                path, paths[0]))
+        total += count
+    owners = None
+    if not keep_overlap:
+        tiles = [map_vertices(path) for path in paths]
+        owners = voxel_owners(tiles)
+    dropped = 0
+    if owners is not None:
+        dropped = total - int(owners["kept"].sum())
+        total -= dropped
+    header = [
+        "element vertex {0}".format(total)
+        if line.startswith("element vertex") else line for line in header
+    ]
+    with open(output + ".tmp", "wb") as merged:
+        merged.write(("\n".join(header) + "\n").encode("ascii"))
+        for index, path in enumerate(paths):
+            if owners is not None:
+                vertices = tiles[index]
+                for first, xyz in chunk_points(vertices):
+                    chunk = vertices[first:first + CHUNK_VERTICES]
+                    np.asarray(chunk)[owned_points(xyz, index,
+                                                   owners)].tofile(merged)
+                continue
+            with open(path, "rb") as file:
+                read_ply_header(file)
+                shutil.copyfileobj(file, merged, 16 * 1024 * 1024)
+    os.replace(output + ".tmp", output)
+    return total, dropped
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Tiled DensifyPointCloud helper")
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+    plan_parser = subparsers.add_parser(
+        "plan", help="Split a view neighbors file into tiles")
+    plan_parser.add_argument("--neighbors",
+                             type=str,
+                             required=True,
+                             help="View neighbors file of the whole scene")
+    plan_parser.add_argument("--tiles",
+                             type=int,
+                             required=True,
+                             help="Number of tiles")
+    plan_parser.add_argument("--output",
+                             type=str,
+                             required=True,
+                             help="Folder receiving tile_<n>/neighbors.txt")
+    merge_parser = subparsers.add_parser(
+        "merge", help="Merge the point clouds of the tiles")
+    merge_parser.add_argument("--output",
+                              type=str,
+                              required=True,
+                              help="Merged PLY file")
+    merge_parser.add_argument(
+        "--keep-overlap",
+        action="store_true",
+        help="Concatenate the tiles, keeping the points every tile fused in the overlaps")
+    merge_parser.add_argument("inputs", nargs="+", help="PLY files to merge")
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    if args.action == "merge":
+        try:
+            total, dropped = merge_ply(args.inputs, args.output,
+                                       args.keep_overlap)
+        except ValueError as err:
+            print("Cannot merge the tiles: {0}".format(err))
+            if not args.keep_overlap:
+                print("--keep-overlap concatenates them without reading their points")
+            return 1
+        print("Merged {0} points from {1} tiles into {2}, {3} overlap duplicates dropped".
+              format(total, len(args.inputs), args.output, dropped))
+        return 0
+    views = read_view_neighbors(args.neighbors)
+    if len(views) < args.tiles:
+        print("{0} views cannot be split into {1} tiles".format(
+            len(views), args.tiles))
+        return 1
+    for index, tile in enumerate(plan(views, args.tiles)):
+        folder = os.path.join(args.output, "tile_{0}".format(index))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "neighbors.txt"), "w") as file:
+            file.writelines(views[view][1] + "\n" for view in sorted(tile))
+        print("Tile {0}: {1} views".format(index, len(tile)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
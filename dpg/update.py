@@ -0,0 +1,105 @@
+"""
+Description: Find the images added to a scene since its sparse model was built.
+
+An image is new when it is in the image folder but not registered in the
+sparse model, so images the mapper dropped earlier are tried again. The
+update stages of the pipeline (--update) read the two lists written here:
+
+    new_images.txt     the new images, for colmap feature_extractor
+                       --image_list_path and vocab_tree_matcher
+                       --VocabTreeMatching.match_list_path
+    match_pairs.txt    every new image paired with every other image of the
+                       folder, for colmap matches_importer --match_type pairs
+
+Usage:
+    update_scene.py --images images --model sparse/0 --output update
+"""
+
+import argparse, os, sys
+
+from dpg.images import list_images
+from dpg.model import read_images
+
+
+def registered_images(model_folder):
+    """
+    Description: Names of the images registered in a COLMAP sparse model
+    Args:
+        model_folder: folder with images.bin, e.g. sparse/0
+        return: set of image names, relative to the image folder
+    """
+    images, _ = read_images(os.path.join(model_folder, "images.bin"))
+    return set(images["name"])
+
+
+def new_images(images_dir, model_folder):
+    """
+    Description: Images of the folder missing from the sparse model
+    Args:
+        images_dir: image folder of the scene
+        model_folder: folder with images.bin
+        return: sorted list of image names
+    """
+    registered = registered_images(model_folder)
+    return [
+        name for name in map(os.path.basename, list_images(images_dir))
+        if name not in registered
+    ]
+
+
+def match_pairs(new, names):
+    """
+    Description: Image pairs an update has to match
+    Args:
+        new: names of the new images
+        names: names of all the images, new ones included
+        return: list of (name, name), every unordered pair once
+    """
+    pairs = []
+    done = set()
+    for first in new:
+        done.add(first)
+        pairs += [(first, second) for second in names if second not in done]
+    return pairs
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="List the images to add to a COLMAP sparse model")
+    parser.add_argument("--images",
+                        type=str,
+                        required=True,
+                        help="Image folder of the scene")
+    parser.add_argument("--model",
+                        type=str,
+                        required=True,
+                        help="Sparse model folder, e.g. sparse/0")
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="Folder receiving new_images.txt and match_pairs.txt")
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    new = new_images(args.images, args.model)
+    if not new:
+        # An empty image list would make feature_extractor read every image
+        print("No new images in {0}".format(args.images))
+        return 1
+    names = [os.path.basename(path) for path in list_images(args.images)]
+    pairs = match_pairs(new, names)
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "new_images.txt"), "w") as file:
+        file.writelines(name + "\n" for name in new)
+    with open(os.path.join(args.output, "match_pairs.txt"), "w") as file:
+        file.writelines("{0} {1}\n".format(*pair) for pair in pairs)
+    print("{0} new images of {1}, {2} pairs to match".format(
+        len(new), len(names), len(pairs)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Description: Background upload of run logs and reports, in gzip chunks that resume after failures.
+
+An upload is a file appended to on the server, so a log can be sent while it
+grows and an interrupted upload continues where the server stopped:
+
+    HEAD <url>/<name>    200 with "Upload-Offset: <bytes received>", 404 for a new file
+    POST <url>/<name>    body: the gzip of the bytes starting at the "Upload-Offset"
+                         header, answered with the new "Upload-Offset", or 409 with
+                         the server offset when it does not match
+
+Chunks are gzip members compressed on their own, so the server may keep them
+as they come and still hold one valid gzip stream. Requests go through a
+pooled session and are retried with exponential backoff on connection errors
+and 5xx answers. LogUploader does all of this on its own thread and never
+blocks the pipeline; the files it follows are synced every interval and once
+more when it is closed. Files rewritten as a whole, like the run report
+replaced after every stage, do not fit an append-only upload: they are
+followed with final=True and only sent by the last sync, once complete.
+
+"serve" runs a stand-in server for tests, writing the files it receives to a
+folder and failing a share of the requests on purpose.
+
+Usage:
+    python -m dpg.upload send --url http://host:8000/logs GraphEngine.log
+    python -m dpg.upload serve --port 8000 --output received [--fail-rate 0.3]
+"""
+
+import argparse, atexit, gzip, logging, os, random, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+import requests
+
+logger = logging.getLogger("GraphEngine")
+
+# Uncompressed bytes sent per request
+CHUNK_SIZE = 1024 * 1024
+# Seconds between two syncs of a growing file
+UPLOAD_INTERVAL = 30
+RETRIES = 5
+# Seconds before the first retry, doubled for every further one
+BACKOFF = 1.0
+REQUEST_TIMEOUT = 30
+# Seconds an exiting process waits for the last sync
+EXIT_TIMEOUT = 60
+
+
+class UploadError(Exception):
+    pass
+
+
+class LogUploader:
+    """
+    Description: Keep files in sync with an upload server from a background thread
+    Args:
+        url: base URL, files are sent to <url>/<name>
+        interval: seconds between two syncs of the followed files
+        chunk_size: uncompressed bytes per request
+        retries: attempts after the first failed request
+        backoff: seconds before the first retry
+        session: requests session, one with a connection pool by default
+    """
+
+    def __init__(self,
+                 url,
+                 interval=UPLOAD_INTERVAL,
+                 chunk_size=CHUNK_SIZE,
+                 retries=RETRIES,
+                 backoff=BACKOFF,
+                 session=None):
+        self.url = url.rstrip("/")
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                    pool_maxsize=2)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.files = {}
+        self.files_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.work,
+                                       name="dpg-upload",
+                                       daemon=True)
+        self.thread.start()
+        # The last sync gets a chance to finish before the process exits
+        atexit.register(self.close, EXIT_TIMEOUT)
+
+    def add(self, path, name=None, final=False):
+        """
+        Description: Follow a file, it does not need to exist yet
+        Args:
+            path: local file
+            name: name on the server, default the file name
+            final: True for a file rewritten rather than appended to, sent by the last sync only
+        """
+        with self.files_lock:
+            self.files[path] = (name or os.path.basename(path), final)
+
+    def close(self, timeout=0):
+        """
+        Description: Sync the followed files one last time and stop
+        Args:
+            timeout: seconds to wait for the last sync, 0 to return at once, None to wait until done
+        """
+        self.stopping.set()
+        if timeout != 0:
+            self.thread.join(timeout)
+
+    def work(self):
+        while not self.stopping.wait(self.interval):
+            self.sync_all()
+        self.sync_all(last=True)
+        self.session.close()
+        atexit.unregister(self.close)
+
+    def sync_all(self, last=False):
+        with self.files_lock:
+            files = list(self.files.items())
+        for path, (name, final) in files:
+            if final and not last:
+                continue
+            try:
+                self.sync(path, name)
+            except (UploadError, OSError) as err:
+                # Picked up again from the server offset by the next sync
+                logger.warning("Upload of {0} failed: {1}".format(name, err))
+
+    def request(self, method, name, **kwargs):
+        """
+        Description: Send a request, retrying connection errors and server errors
+        Args:
+            return: requests response with a status below 500
+        """
+        url = "{0}/{1}".format(self.url, quote(name))
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                # Jitter keeps the pipelines of a batch from retrying in step
+                time.sleep(self.backoff * 2**(attempt - 1) *
+                           random.uniform(0.5, 1.5))
+            try:
+                response = self.session.request(method,
+                                                url,
+                                                timeout=REQUEST_TIMEOUT,
+                                                **kwargs)
+            except requests.RequestException as err:
+                error = err
+                continue
+            if response.status_code < 500:
+                return response
+            error = "status {0}".format(response.status_code)
+        raise UploadError("{0} {1}: {2}".format(method, url, error))
+
+    def server_offset(self, name):
+        response = self.request("HEAD", name)
+        if response.status_code == 404:
+            return 0
+        if response.status_code != 200:
+            raise UploadError("HEAD {0}: status {1}".format(
+                name, response.status_code))
+        return int(response.headers.get("Upload-Offset", 0))
+
+    def sync(self, path, name):
+        """
+        Description: Send the part of a file the server does not have yet
+        Args:
+            return: bytes sent, before compression
+        """
+        if not os.path.exists(path):
+            return 0
+        size = os.path.getsize(path)
+        offset = self.server_offset(name)
+        if offset > size:
+            raise UploadError("server has {0} bytes of {1}, the file has {2}".
+                              format(offset, name, size))
+        sent = 0
+        with open(path, "rb") as file:
+            while offset < size:
+                file.seek(offset)
+                chunk = file.read(min(self.chunk_size, size - offset))
+                response = self.request("POST",
+                                        name,
+                                        data=gzip.compress(chunk),
+                                        headers={
+                                            "Upload-Offset": str(offset),
+                                            "Content-Encoding": "gzip",
+                                            "Content-Type":
+                                            "application/octet-stream",
+                                        })
+                if response.status_code == 409:
+                    # The server is elsewhere, e.g. an earlier request landed after all
+                    offset = int(response.headers["Upload-Offset"])
+                    continue
+                if response.status_code not in (200, 201, 204):
+                    raise UploadError("POST {0}: status {1}".format(
+                        name, response.status_code))
+                offset += len(chunk)
+                sent += len(chunk)
+        return sent
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Description: Upload server for tests, see the module description
+    """
+
+    def target(self):
+        name = unquote(self.path.lstrip("/")).replace("/", "_")
+        return os.path.join(self.server.output, name)
+
+    def answer(self, status, offset=None):
+        self.send_response(status)
+        if offset is not None:
+            self.send_header("Upload-Offset", str(offset))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        path = self.target()
+        if not os.path.exists(path):
+            self.answer(404)
+        else:
+            self.answer(200, os.path.getsize(path))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if random.random() < self.server.fail_rate:
+            self.answer(503)
+            return
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        path = self.target()
+        with self.server.lock:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if int(self.headers.get("Upload-Offset", 0)) != size:
+                self.answer(409, size)
+                return
+            with open(path, "ab") as file:
+                file.write(body)
+            self.answer(204, size + len(body))
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port, output, fail_rate=0.0):
+    """
+    Description: Run the stand-in upload server until interrupted
+    """
+    os.makedirs(output, exist_ok=True)
+    server = ThreadingHTTPServer(("", port), StandInHandler)
+    server.output = output
+    server.fail_rate = fail_rate
+    server.lock = threading.Lock()
+    print("Receiving uploads on port {0} into {1}".format(
+        server.server_address[1], output),
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Upload run logs")
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+    send_parser = subparsers.add_parser("send",
+                                        help="Upload files and wait for it")
+    send_parser.add_argument("--url",
+                             type=str,
+                             required=True,
+                             help="Base URL of the upload server")
+    send_parser.add_argument("files", nargs="+", help="Files to upload")
+    serve_parser = subparsers.add_parser("serve",
+                                         help="Run a stand-in upload server")
+    serve_parser.add_argument("--port",
+                              type=int,
+                              default=8000,
+                              help="Port to listen on. Default: 8000")
+    serve_parser.add_argument("--output",
+                              type=str,
+                              required=True,
+                              help="Folder receiving the uploaded files")
+    serve_parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="Share of the chunks answered with 503, to exercise the retries. Default: 0",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if args.action == "serve":
+        serve(args.port, args.output, args.fail_rate)
+        return 0
+    uploader = LogUploader(args.url)
+    failed = False
+    for path in args.files:
+        try:
+            sent = uploader.sync(path, os.path.basename(path))
+            print("{0}: {1} bytes sent".format(path, sent))
+        except (UploadError, OSError) as err:
+            print("{0}: {1}".format(path, err))
+            failed = True
+    uploader.close(timeout=None)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
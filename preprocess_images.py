@@ -0,0 +1,6 @@
+#!/usr/bin/python
+
+import sys
+from dpg.preprocess import main
+
+sys.exit(main())
@@ -0,0 +1,75 @@
+import json, os, subprocess, sys
+
+import pytest
+
+from dpg import admission
+from dpg.admission import AdmissionController, process_created
+
+
+@pytest.fixture
+def sleeper():
+    process = subprocess.Popen([sys.executable, "-c",
+                                "import time; time.sleep(60)"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+def write_reservation(controller, name, **fields):
+    reservation = {
+        "id": name,
+        "owner": os.getpid(),
+        "owner_created": process_created(os.getpid()),
+        "pid": None,
+        "created": None,
+        "title": name,
+        "mem": 0,
+        "cpus": 1,
+        "gpu_mem": 0,
+        "threads": 1,
+        "cores": [],
+        "start": 0,
+    }
+    reservation.update(fields)
+    controller.write_dict(reservation)
+
+
+def test_place_only_pins_verified_processes(tmp_path, sleeper, monkeypatch):
+    pinned = []
+    monkeypatch.setattr(admission, "pin_process_tree",
+                        lambda pid, cores: pinned.append(pid))
+    controller = AdmissionController(state_dir=str(tmp_path))
+    controller.affinity = True
+    created = process_created(sleeper.pid)
+    write_reservation(controller, "live", pid=sleeper.pid, created=created)
+    # Same pid, another start time: the tool exited and the pid was reused
+    write_reservation(controller,
+                      "reused",
+                      pid=sleeper.pid,
+                      created=created - 100)
+    write_reservation(controller, "unknown", pid=sleeper.pid)
+    with controller.host_lock():
+        controller.place()
+    assert pinned == [sleeper.pid]
+    with open(str(tmp_path / "reused.json")) as file:
+        assert json.load(file)["pid"] is None
+
+
+def test_reservations_of_dead_or_reused_owners_are_dropped(
+        tmp_path, sleeper):
+    controller = AdmissionController(state_dir=str(tmp_path))
+    write_reservation(controller, "mine")
+    write_reservation(controller,
+                      "reused",
+                      owner=sleeper.pid,
+                      owner_created=process_created(sleeper.pid) - 100)
+    write_reservation(controller, "other", owner=sleeper.pid,
+                      owner_created=process_created(sleeper.pid))
+    sleeper.kill()
+    sleeper.wait()
+    write_reservation(controller, "dead", owner=sleeper.pid,
+                      owner_created=None)
+    names = sorted(reservation["id"]
+                   for reservation in controller.live_reservations())
+    assert names == ["mine"]
+    assert os.listdir(str(tmp_path)) == ["mine.json"]
@@ -0,0 +1,166 @@
+import sys
+
+from dpg.cache import StageCache
+
+
+def stage(title, inputs, outputs, *options):
+    return {
+        "title": title,
+        "command": ["/bin/sh", "-c", "true"] + list(options),
+        "inputs": [str(path) for path in inputs],
+        "outputs": [str(path) for path in outputs],
+    }
+
+
+def run(cache, stages, write):
+    """
+    Run the stages that are not fresh, write(instruction) producing their outputs
+    """
+    executed = []
+    for instruction in stages:
+        if cache.is_fresh(instruction):
+            continue
+        inputs = cache.snapshot_inputs(instruction)
+        write(instruction)
+        cache.record(instruction, inputs)
+        executed.append(instruction["title"])
+    return executed
+
+
+def chain(tmp_path, extract_option="--a", unrelated_option="--u"):
+    images = tmp_path / "images.txt"
+    features = tmp_path / "features.txt"
+    model = tmp_path / "model.txt"
+    other = tmp_path / "other.txt"
+    return [
+        stage("extract", [images], [features], extract_option),
+        stage("map", [features], [model]),
+        stage("unrelated", [images], [other], unrelated_option),
+    ]
+
+
+def write_options(instruction):
+    # Outputs depend on the command, like a tool honoring its flags
+    with open(instruction["outputs"][0], "w") as file:
+        file.write(" ".join(instruction["command"]))
+
+
+def test_unchanged_stages_are_fresh(tmp_path):
+    (tmp_path / "images.txt").write_text("a b c")
+    cache = StageCache(str(tmp_path / "cache"))
+    assert run(cache, chain(tmp_path), write_options) == [
+        "extract", "map", "unrelated"
+    ]
+    cache = StageCache(str(tmp_path / "cache"))
+    assert run(cache, chain(tmp_path), write_options) == []
+
+
+def test_changed_flag_reruns_the_stage_and_its_dependents(tmp_path):
+    (tmp_path / "images.txt").write_text("a b c")
+    cache = StageCache(str(tmp_path / "cache"))
+    run(cache, chain(tmp_path), write_options)
+    assert run(cache, chain(tmp_path, extract_option="--b"),
+               write_options) == ["extract", "map"]
+
+
+def test_changed_input_reruns_the_stages_reading_it(tmp_path):
+    (tmp_path / "images.txt").write_text("a b c")
+    cache = StageCache(str(tmp_path / "cache"))
+    run(cache, chain(tmp_path), write_options)
+    (tmp_path / "images.txt").write_text("a b c d")
+    assert run(cache, chain(tmp_path),
+               write_options) == ["extract", "unrelated"]
+
+
+def test_modified_output_is_not_fresh(tmp_path):
+    (tmp_path / "images.txt").write_text("a b c")
+    cache = StageCache(str(tmp_path / "cache"))
+    run(cache, chain(tmp_path), write_options)
+    (tmp_path / "model.txt").write_text("edited")
+    assert run(cache, chain(tmp_path), write_options) == ["map"]
+
+
+def test_signature_covers_the_command(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+    first, _, _ = chain(tmp_path)
+    changed, _, _ = chain(tmp_path, extract_option="--b")
+    assert cache.signature(first) == cache.signature(dict(first))
+    assert cache.signature(first) != cache.signature(changed)
+
+
+def test_in_place_update_keeps_the_creator_fresh(tmp_path):
+    database = tmp_path / "database.db"
+    images = tmp_path / "images.txt"
+    images.write_text("a b c")
+    create = stage("create", [images], [database])
+    update = stage("update", [database], [database])
+    cache = StageCache(str(tmp_path / "cache"))
+
+    def append(instruction):
+        with open(str(database), "a") as file:
+            file.write(instruction["title"] + "\n")
+
+    assert run(cache, [create, update], append) == ["create", "update"]
+    # The database now derives from the state create left it in
+    assert cache.is_fresh(create)
+    assert cache.is_fresh(update)
+    assert cache.derives_from(cache.hash_path(str(database)),
+                              cache.manifest["stages"]["create"]["outputs"][
+                                  str(database)])
+    # A change made outside the stages breaks the chain
+    database.write_text("rewritten")
+    assert not cache.is_fresh(create)
+    assert not cache.is_fresh(update)
+
+
+def test_edited_helper_script_is_not_fresh(tmp_path):
+    script = tmp_path / "helper.py"
+    script.write_text("print(1)\n")
+    output = tmp_path / "out.txt"
+    instruction = {
+        "title": "helper",
+        "command": [sys.executable, str(script)],
+        "inputs": [],
+        "outputs": [str(output)],
+    }
+    package = tmp_path / "package"
+    package.mkdir()
+    (package / "module.py").write_text("VALUE = 1\n")
+    cache = StageCache(str(tmp_path / "cache"), package_dir=str(package))
+    output.write_text("1")
+    cache.record(instruction, {})
+    assert cache.is_fresh(instruction)
+
+    script.write_text("print(2)\n")
+    assert not StageCache(str(tmp_path / "cache"),
+                          package_dir=str(package)).is_fresh(instruction)
+
+
+def test_edited_package_module_is_not_fresh(tmp_path):
+    script = tmp_path / "helper.py"
+    script.write_text("from package.module import VALUE\n")
+    output = tmp_path / "out.txt"
+    instruction = {
+        "title": "helper",
+        "command": [sys.executable, str(script)],
+        "inputs": [],
+        "outputs": [str(output)],
+    }
+    package = tmp_path / "package"
+    package.mkdir()
+    (package / "module.py").write_text("VALUE = 1\n")
+    cache = StageCache(str(tmp_path / "cache"), package_dir=str(package))
+    output.write_text("1")
+    cache.record(instruction, {})
+
+    (package / "module.py").write_text("VALUE = 2\n")
+    assert not StageCache(str(tmp_path / "cache"),
+                          package_dir=str(package)).is_fresh(instruction)
+    # Compiled files do not count
+    (package / "__pycache__").mkdir()
+    (package / "__pycache__" / "module.pyc").write_bytes(b"\0")
+    cache = StageCache(str(tmp_path / "cache"), package_dir=str(package))
+    cache.record(instruction, {})
+    (package / "__pycache__" / "module.pyc").write_bytes(b"\1")
+    assert StageCache(str(tmp_path / "cache"),
+                      package_dir=str(package)).is_fresh(instruction)
@@ -0,0 +1,91 @@
+import pytest
+
+from dpg.cache import StageCache
+from dpg.checkpoint import RunState, select_stages
+
+
+def stage(title, inputs, outputs, *options):
+    return {
+        "title": title,
+        "command": ["/bin/sh", "-c", "true"] + list(options),
+        "inputs": [str(path) for path in inputs],
+        "outputs": [str(path) for path in outputs],
+    }
+
+
+def run_state(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+    return RunState(str(tmp_path / "cache" / "run_state.json"), cache)
+
+
+def complete(state, instruction, content="done"):
+    inputs = state.cache.snapshot_inputs(instruction)
+    with open(instruction["outputs"][0], "a") as file:
+        file.write(content)
+    state.cache.record(instruction, inputs)
+    state.mark(instruction, "completed")
+
+
+def test_completed_stage_is_skipped_after_a_reload(tmp_path):
+    extract = stage("extract", [], [tmp_path / "database.db"])
+    state = run_state(tmp_path)
+    state.start_run([extract], argv=["pipeline"])
+    assert not state.completed(extract)
+    complete(state, extract)
+    assert run_state(tmp_path).completed(extract)
+
+
+def test_changed_command_is_not_completed(tmp_path):
+    state = run_state(tmp_path)
+    complete(state, stage("extract", [], [tmp_path / "database.db"]))
+    assert not state.completed(
+        stage("extract", [], [tmp_path / "database.db"], "--changed"))
+
+
+def test_changed_output_is_not_completed(tmp_path):
+    extract = stage("extract", [], [tmp_path / "database.db"])
+    state = run_state(tmp_path)
+    complete(state, extract)
+    (tmp_path / "database.db").write_text("edited")
+    assert not state.completed(extract)
+
+
+def test_output_updated_by_a_later_stage_stays_completed(tmp_path):
+    database = tmp_path / "database.db"
+    extract = stage("extract", [], [database])
+    match = stage("match", [database], [database])
+    state = run_state(tmp_path)
+    complete(state, extract, "features")
+    complete(state, match, "matches")
+    assert state.completed(extract)
+    assert state.completed(match)
+    # Unless something else changed it afterwards
+    database.write_text("edited")
+    assert not state.completed(extract)
+
+
+def test_failed_or_restarted_stages_are_not_completed(tmp_path):
+    extract = stage("extract", [], [tmp_path / "database.db"])
+    state = run_state(tmp_path)
+    complete(state, extract)
+    state.mark(extract, "failed")
+    assert not state.completed(extract)
+    complete(state, extract)
+    # A run about to execute the stage again drops its completion
+    state.start_run([extract], argv=["pipeline"])
+    assert not run_state(tmp_path).completed(extract)
+
+
+def test_select_stages():
+    commands = [
+        {"title": "Feature extraction", "command": ["colmap", "feature_extractor"]},
+        {"title": "Mapper", "command": ["colmap", "mapper"]},
+        {"title": "Refine mesh", "command": ["/openmvs/RefineMesh"]},
+    ]
+    assert select_stages(commands, "mapper") == commands[1:]
+    assert select_stages(commands, to_stage="MAPPER") == commands[:2]
+    assert select_stages(commands, "refinemesh", "RefineMesh") == commands[2:]
+    with pytest.raises(ValueError):
+        select_stages(commands, "Refine mesh", "mapper")
+    with pytest.raises(ValueError):
+        select_stages(commands, "missing")
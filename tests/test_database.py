@@ -0,0 +1,59 @@
+import sqlite3
+
+import numpy as np
+
+from dpg.database import MAX_IMAGE_ID, analyze
+
+
+def make_database(path, image_count, pairs, keypoints=100):
+    """
+    COLMAP tables the analysis reads, pairs as (image_id1, image_id2, matches)
+    """
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE images (image_id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute("CREATE TABLE keypoints (image_id INTEGER PRIMARY KEY, "
+               "rows INTEGER, cols INTEGER, data BLOB)")
+    db.execute("CREATE TABLE two_view_geometries (pair_id INTEGER PRIMARY KEY, "
+               "rows INTEGER, cols INTEGER, data BLOB, config INTEGER)")
+    for image_id in range(1, image_count + 1):
+        db.execute("INSERT INTO images VALUES (?, ?)",
+                   (image_id, "{0}.jpg".format(image_id)))
+        db.execute(
+            "INSERT INTO keypoints VALUES (?, ?, 2, ?)",
+            (image_id, keypoints, np.zeros(
+                (keypoints, 2), dtype=np.float32).tobytes()))
+    for first, second, matches in pairs:
+        db.execute("INSERT INTO two_view_geometries VALUES (?, ?, 2, ?, 2)",
+                   (first * MAX_IMAGE_ID + second, len(matches),
+                    np.array(matches, dtype=np.uint32).tobytes()))
+    db.commit()
+    db.close()
+    return str(path)
+
+
+def matches(count, offset=0):
+    return [(index + offset, index) for index in range(count)]
+
+
+def test_analyze(tmp_path):
+    # 1-2-3-4 are linked to each other, 5 only to 4 and 6 to nothing usable
+    pairs = [(first, second, matches(20)) for first in range(1, 5)
+             for second in range(first + 1, 5)]
+    pairs += [(4, 5, matches(20, offset=50)), (5, 6, matches(5))]
+    # A ? # or % in the path is not part of the URI
+    folder = tmp_path / "scene?#%20"
+    folder.mkdir()
+    stats = analyze(make_database(folder / "database.db", 6, pairs))
+    assert stats["images"] == 6
+    assert stats["verified_pairs"] == 8
+    assert stats["usable_pairs"] == 7
+    assert stats["components"] == [5, 1]
+    assert stats["mapper_images"] == 5
+    assert stats["mapper_correspondences"] == 7 * 20
+    weak = {image["name"]: image for image in stats["weak_images"]}
+    assert sorted(weak) == ["5.jpg", "6.jpg"]
+    assert weak["5.jpg"]["neighbors"] == 1
+    # 20 keypoints matched with 4, 5 of them also with 6
+    assert weak["5.jpg"]["matched_keypoints"] == 20
+    assert weak["6.jpg"]["matched_keypoints"] == 5
+    assert weak["6.jpg"]["keypoints"] == 100
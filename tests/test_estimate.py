@@ -0,0 +1,32 @@
+import os
+
+from PIL import Image
+
+from dpg.admission import AdmissionController
+from dpg.estimate import estimate_plan
+from dpg.pipeline import PipelineConfig, build_plan
+
+
+def make_scene(folder, count=3, size=(64, 48)):
+    images = folder / "images"
+    images.mkdir(parents=True)
+    for index in range(count):
+        Image.new("RGB", size).save(str(images / "{0}.jpg".format(index)))
+    return folder
+
+
+def test_estimate_plan_without_reports(tmp_path):
+    scene = make_scene(tmp_path / "scene")
+    config = PipelineConfig(str(scene),
+                            output=str(tmp_path / "output"),
+                            run_colmap=True)
+    plan = build_plan(config)
+    admission = AdmissionController(
+        state_dir=str(tmp_path / "admission"),
+        history_path=str(tmp_path / "history.json"))
+    estimate = estimate_plan(plan, [str(tmp_path / "*_report.json")],
+                             admission)
+    assert estimate["reports"] == 0
+    assert len(estimate["stages"]) == len(plan.commands)
+    assert all(stage["basis"] == "default" for stage in estimate["stages"])
+    assert not os.path.exists(str(tmp_path / "output"))
@@ -0,0 +1,93 @@
+import json, os, threading, time
+
+from dpg import executor
+from dpg.executor import QueueExecutor, Worker
+
+
+def pending_jobs(queue):
+    return sorted(os.listdir(str(queue / "pending")))
+
+
+def test_claim_takes_the_oldest_job_once(tmp_path):
+    submitter = QueueExecutor(str(tmp_path))
+    first = submitter.submit(["true"], job={"title": "first"})
+    time.sleep(1.1)
+    second = submitter.submit(["true"], job={"title": "second"})
+    # Still being written by a submitter
+    (tmp_path / "pending" / "partial.json.tmp").write_text("{")
+    worker = Worker(str(tmp_path))
+    other = Worker(str(tmp_path))
+    assert worker.claim()["id"] == first
+    assert other.claim()["id"] == second
+    assert worker.claim() is None
+    assert pending_jobs(tmp_path) == ["partial.json.tmp"]
+    assert sorted(os.listdir(str(tmp_path / "running"))) == [
+        first + ".json", second + ".json"
+    ]
+
+
+def test_execute_publishes_the_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(executor, "HEARTBEAT_INTERVAL", 0.05)
+    submitter = QueueExecutor(str(tmp_path))
+    job_id = submitter.submit(
+        ["/bin/sh", "-c", "echo working; sleep 0.5; exit 3"],
+        job={"title": "stage"})
+    worker = Worker(str(tmp_path))
+    job = worker.claim()
+    running = tmp_path / "running" / (job_id + ".json")
+    claimed_at = os.path.getmtime(str(running))
+    touched = []
+
+    def watch():
+        while running.exists():
+            try:
+                touched.append(os.path.getmtime(str(running)))
+            except OSError:
+                pass
+            time.sleep(0.05)
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    worker.slots.acquire()
+    worker.execute(job)
+    watcher.join()
+    # The heartbeat touched the running job while the command ran
+    assert max(touched) > claimed_at
+    assert not running.exists()
+    with open(str(tmp_path / "done" / (job_id + ".json"))) as file:
+        result = json.load(file)
+    assert result["exit_code"] == 3
+    assert (tmp_path / "logs" /
+            (job_id + ".log")).read_text() == "working\n"
+    # The slot is free again
+    assert worker.slots.acquire(blocking=False)
+
+
+def test_queue_executor_follows_a_worker(tmp_path):
+    worker = Worker(str(tmp_path), poll_interval=0.05)
+    serving = threading.Thread(target=worker.serve, kwargs={"max_idle": 2})
+    serving.start()
+    lines = []
+    rc = QueueExecutor(str(tmp_path), poll_interval=0.05).run(
+        ["/bin/sh", "-c", "echo one; echo two"],
+        lines.append,
+        job={"title": "stage"})
+    serving.join()
+    assert rc == 0
+    assert lines == ["one", "two"]
+
+
+def test_lost_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(executor, "HEARTBEAT_TIMEOUT", 0.2)
+    worker = Worker(str(tmp_path))
+
+    def claim_and_vanish():
+        while worker.claim() is None:
+            time.sleep(0.01)
+
+    claimer = threading.Thread(target=claim_and_vanish)
+    claimer.start()
+    rc = QueueExecutor(str(tmp_path), poll_interval=0.05).run(["true"],
+                                                              lambda line: None)
+    claimer.join()
+    assert rc == -1
@@ -0,0 +1,220 @@
+import json, os, sqlite3, struct
+
+import numpy as np
+
+from dpg.model import (CAMERA_DTYPE, POINT2D_DTYPE, POINT3D_DTYPE,
+                       TRACK_DTYPE, check_models, filter_points, image_dtype,
+                       main, model_stats, read_model, write_model)
+
+PINHOLE = 1
+FULL_OPENCV = 6
+
+
+def write_raw_model(folder, cameras, images, points):
+    """
+    Write the .bin files byte by byte, the way COLMAP lays them out
+    """
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "cameras.bin"), "wb") as file:
+        file.write(struct.pack("<Q", len(cameras)))
+        for camera_id, model, width, height, params in cameras:
+            file.write(struct.pack("<IiQQ", camera_id, model, width, height))
+            file.write(struct.pack("<{0}d".format(len(params)), *params))
+    with open(os.path.join(folder, "images.bin"), "wb") as file:
+        file.write(struct.pack("<Q", len(images)))
+        for image_id, qvec, tvec, camera_id, name, points2D in images:
+            file.write(struct.pack("<I4d3dI", image_id, *qvec, *tvec,
+                                   camera_id))
+            file.write(name.encode("utf-8") + b"\x00")
+            file.write(struct.pack("<Q", len(points2D)))
+            for x, y, point3D_id in points2D:
+                file.write(struct.pack("<2dq", x, y, point3D_id))
+    with open(os.path.join(folder, "points3D.bin"), "wb") as file:
+        file.write(struct.pack("<Q", len(points)))
+        for point3D_id, xyz, rgb, error, track in points:
+            file.write(struct.pack("<Q3d3BdQ", point3D_id, *xyz, *rgb, error,
+                                   len(track)))
+            for image_id, point2D_idx in track:
+                file.write(struct.pack("<II", image_id, point2D_idx))
+
+
+def synthetic_model(folder):
+    cameras = [
+        (1, PINHOLE, 640, 480, [500.0, 500.0, 320.0, 240.0]),
+        # All 12 parameters are written, not only the focal and principal point
+        (2, FULL_OPENCV, 800, 600,
+         [600.0, 601.0, 400.0, 300.0, 0.1, -0.2, 0.001, 0.002, 0.01, -0.01,
+          0.003, 0.004]),
+    ]
+    images = [
+        (1, (1.0, 0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 1, "a.jpg",
+         [(10.5, 20.5, 1), (30.0, 40.0, 2), (50.0, 60.0, -1)]),
+        (2, (0.9, 0.1, 0.2, 0.3), (1.0, 2.0, 3.0), 2, "sub/b.jpg",
+         [(11.0, 21.0, 1), (31.0, 41.0, 2), (70.0, 80.0, 3)]),
+        # Registered, but none of its features reached a 3D point
+        (3, (0.5, 0.5, 0.5, 0.5), (-1.0, 0.0, 1.0), 1, "c.jpg", []),
+    ]
+    points = [
+        (1, (0.1, 0.2, 5.0), (255, 0, 0), 0.5, [(1, 0), (2, 0)]),
+        (2, (1.0, -1.0, 6.0), (0, 255, 0), 1.5, [(1, 1), (2, 1)]),
+        (3, (2.0, 0.5, 7.0), (0, 0, 255), 3.0, [(2, 2)]),
+    ]
+    write_raw_model(folder, cameras, images, points)
+
+
+def read_bytes(folder, name):
+    with open(os.path.join(folder, name), "rb") as file:
+        return file.read()
+
+
+def test_round_trip_is_byte_identical(tmp_path):
+    source = str(tmp_path / "source")
+    copy = str(tmp_path / "copy")
+    synthetic_model(source)
+    model = read_model(source)
+    write_model(copy, model)
+    for name in ["cameras.bin", "images.bin", "points3D.bin"]:
+        assert read_bytes(source, name) == read_bytes(copy, name)
+
+
+def test_read_model(tmp_path):
+    synthetic_model(str(tmp_path))
+    model = read_model(str(tmp_path))
+    assert list(model["cameras"]["camera_id"]) == [1, 2]
+    assert model["cameras"]["params"][1, 11] == 0.004
+    assert not model["cameras"]["params"][0, 4:].any()
+    assert list(model["images"]["name"]) == ["a.jpg", "sub/b.jpg", "c.jpg"]
+    assert list(model["images"]["num_points2D"]) == [3, 3, 0]
+    assert list(model["points2D"]["point3D_id"]) == [1, 2, -1, 1, 2, 3]
+    assert list(model["points3D"]["track_length"]) == [2, 2, 1]
+    assert list(model["points3D"]["track_start"]) == [0, 2, 4]
+    assert [tuple(element) for element in model["tracks"]
+            ] == [(1, 0), (2, 0), (1, 1), (2, 1), (2, 2)]
+
+
+def test_model_stats(tmp_path):
+    synthetic_model(str(tmp_path))
+    stats = model_stats(read_model(str(tmp_path)))
+    assert stats["cameras"] == 2
+    assert stats["images"] == 3
+    assert stats["points"] == 3
+    assert stats["observations"] == 5
+    assert np.isclose(stats["mean_track_length"], 5 / 3.0)
+    assert np.isclose(stats["mean_error"], 5 / 3.0)
+    assert stats["median_error"] == 1.5
+    assert np.isclose(stats["mean_observations_per_image"], 5 / 3.0)
+    assert stats["min_observations_per_image"] == 0
+
+
+def test_filter_points(tmp_path):
+    synthetic_model(str(tmp_path / "source"))
+    model = read_model(str(tmp_path / "source"))
+    points = model["points3D"]
+    filtered = filter_points(model, points["track_length"] >= 2)
+    assert list(filtered["points3D"]["point3D_id"]) == [1, 2]
+    assert list(filtered["points3D"]["track_start"]) == [0, 2]
+    assert len(filtered["tracks"]) == 4
+    # The observation of the dropped point is unlinked, the others stay
+    assert list(filtered["points2D"]["point3D_id"]) == [1, 2, -1, 1, 2, -1]
+    assert list(model["points2D"]["point3D_id"]) == [1, 2, -1, 1, 2, 3]
+
+    write_model(str(tmp_path / "filtered"), filtered)
+    again = read_model(str(tmp_path / "filtered"))
+    assert list(again["points2D"]["point3D_id"]) == [1, 2, -1, 1, 2, -1]
+    assert [tuple(element) for element in again["tracks"]
+            ] == [(1, 0), (2, 0), (1, 1), (2, 1)]
+    stats = model_stats(again)
+    assert stats["points"] == 2
+    assert stats["min_observations_per_image"] == 0
+
+
+def mapper_model(folder, image_count, point_count, error=0.5):
+    """
+    Model with every point seen by the first two images
+    """
+    cameras = np.zeros(1, dtype=CAMERA_DTYPE)
+    cameras[0] = (1, PINHOLE, 64, 48, np.zeros(16))
+    images = np.zeros(image_count, dtype=image_dtype(8))
+    images["image_id"] = np.arange(1, image_count + 1)
+    images["qvec"][:, 0] = 1
+    images["camera_id"] = 1
+    images["name"] = ["{0}.jpg".format(index) for index in images["image_id"]]
+    points = np.zeros(point_count, dtype=POINT3D_DTYPE)
+    points["point3D_id"] = np.arange(1, point_count + 1)
+    points["error"] = error
+    points["track_length"] = 2
+    points["track_start"] = 2 * np.arange(point_count)
+    tracks = np.zeros(2 * point_count, dtype=TRACK_DTYPE)
+    tracks["image_id"] = np.tile([1, 2], point_count)
+    write_model(
+        str(folder), {
+            "cameras": cameras,
+            "images": images,
+            "points2D": np.zeros(0, dtype=POINT2D_DTYPE),
+            "points3D": points,
+            "tracks": tracks,
+        })
+
+
+def image_database(path, image_count):
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE images (image_id INTEGER PRIMARY KEY, name TEXT)")
+    db.executemany("INSERT INTO images VALUES (?, ?)",
+                   [(index, "{0}.jpg".format(index))
+                    for index in range(1, image_count + 1)])
+    db.commit()
+    db.close()
+    return str(path)
+
+
+def test_check_promotes_the_best_model(tmp_path):
+    sparse = tmp_path / "sparse"
+    # The mapper split the scene, the second piece is the larger one
+    mapper_model(sparse / "0", 2, 150)
+    mapper_model(sparse / "1", 6, 120)
+    database = image_database(tmp_path / "database.db", 10)
+    scores = str(tmp_path / "model_check.json")
+    assert main(["check", str(sparse), "--database", database, "--json",
+                 scores]) == 0
+    with open(scores) as file:
+        result = json.load(file)
+    assert result["selected"] == "1"
+    assert result["problems"] == []
+    assert [stats["images"] for stats in result["models"]] == [2, 6]
+    # The later stages read sparse/0
+    assert model_stats(read_model(str(sparse / "0")))["images"] == 6
+    assert model_stats(read_model(str(sparse / "1")))["images"] == 2
+    # Checking again keeps it there
+    assert main(["check", str(sparse), "--database", database]) == 0
+    assert model_stats(read_model(str(sparse / "0")))["images"] == 6
+
+
+def test_check_thresholds(tmp_path):
+    sparse = tmp_path / "sparse"
+    mapper_model(sparse / "0", 4, 80, error=2.5)
+    result = check_models(str(sparse), 10)
+    assert result["selected"] == "0"
+    assert len(result["problems"]) == 3
+    assert result["problems"][0].startswith("4 of 10 images registered")
+    assert "mean reprojection error 2.50px" in result["problems"][1]
+    assert result["problems"][2] == "80 points, fewer than 100"
+    assert check_models(str(sparse), 8, max_mean_error=None,
+                        min_points=50)["problems"] == []
+    assert check_models(str(sparse), 8, min_points=None,
+                        max_mean_error=None,
+                        min_mean_track_length=3)["problems"] == [
+                            "mean track length 2.00, less than 3"
+                        ]
+    database = image_database(tmp_path / "database.db", 10)
+    assert main(["check", str(sparse), "--database", database]) == 1
+    assert main([
+        "check",
+        str(sparse), "--database", database, "--min-registered-ratio",
+        "0.4", "--max-mean-error", "3", "--min-points", "50"
+    ]) == 0
+
+
+def test_check_without_model(tmp_path):
+    result = check_models(str(tmp_path / "sparse"), 10)
+    assert result["selected"] is None
+    assert result["problems"] == ["the mapper produced no model"]
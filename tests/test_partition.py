@@ -0,0 +1,84 @@
+import json, sqlite3
+
+from dpg.database import MAX_IMAGE_ID
+from dpg.partition import main, partition, spatial_order
+
+
+def chain(count, inliers=100):
+    """
+    View graph of images taken along a path, each one matching the next two
+    """
+    graph = {image_id: {} for image_id in range(1, count + 1)}
+    for image_id in graph:
+        for step, weight in ((1, inliers), (2, inliers // 2)):
+            if image_id + step in graph:
+                graph[image_id][image_id + step] = weight
+                graph[image_id + step][image_id] = weight
+    return graph
+
+
+def test_spatial_order_keeps_neighbors_close():
+    order = spatial_order(chain(20))
+    assert order in (list(range(1, 21)), list(range(20, 0, -1)))
+
+
+def test_spatial_order_walks_every_component():
+    graph = chain(6)
+    graph.update({10: {11: 50}, 11: {10: 50}, 12: {}})
+    order = spatial_order(graph)
+    assert sorted(order) == [1, 2, 3, 4, 5, 6, 10, 11, 12]
+    assert sorted(order[:6]) == list(range(1, 7))
+
+
+def test_partition_chunks_with_overlap():
+    clusters = partition(chain(40), 4, overlap=0.15, min_overlap=2)
+    assert len(clusters) == 4
+    if clusters[0][0] != 1:
+        clusters = clusters[::-1]
+    cores = [set(range(1 + 10 * index, 11 + 10 * index)) for index in range(4)]
+    for index, cluster in enumerate(clusters):
+        assert cores[index] <= set(cluster)
+        assert cluster == sorted(cluster)
+    # Each chunk grows by the images of its neighbors it matches best
+    assert clusters[0] == list(range(1, 13))
+    assert clusters[1] == list(range(10, 22))
+    assert clusters[3] == list(range(29, 41))
+    for first, second in zip(clusters, clusters[1:]):
+        assert len(set(first) & set(second)) >= 2
+
+
+def make_database(path, graph):
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE images (image_id INTEGER PRIMARY KEY, name TEXT)")
+    db.execute("CREATE TABLE two_view_geometries (pair_id INTEGER PRIMARY KEY, "
+               "rows INTEGER, cols INTEGER, data BLOB, config INTEGER)")
+    for image_id, neighbors in graph.items():
+        db.execute("INSERT INTO images VALUES (?, ?)",
+                   (image_id, "{0:03d}.jpg".format(image_id)))
+        for neighbor, inliers in neighbors.items():
+            if neighbor > image_id:
+                db.execute(
+                    "INSERT INTO two_view_geometries VALUES (?, ?, 2, NULL, 2)",
+                    (image_id * MAX_IMAGE_ID + neighbor, inliers))
+    db.commit()
+    db.close()
+    return str(path)
+
+
+def test_main_writes_the_image_lists(tmp_path):
+    database = make_database(tmp_path / "database.db", chain(30))
+    output = tmp_path / "partitions"
+    assert main(["--database", database, "--clusters", "3", "--output",
+                 str(output)]) == 0
+    with open(str(output / "partition.json")) as file:
+        clusters = json.load(file)["clusters"]
+    assert len(clusters) == 3
+    for index, cluster in enumerate(clusters):
+        lines = (output / "cluster_{0}".format(index) /
+                 "images.txt").read_text().splitlines()
+        assert lines == cluster
+    assert sorted(set(sum(clusters, []))) == [
+        "{0:03d}.jpg".format(image_id) for image_id in range(1, 31)
+    ]
+    assert main(["--database", database, "--clusters", "40", "--output",
+                 str(output)]) == 1
@@ -0,0 +1,68 @@
+import asyncio, os, stat
+
+import pytest
+from PIL import Image
+
+from dpg.executor import LocalExecutor
+from dpg.pipeline import PipelineConfig, run_pipeline
+from dpg.runner import TIMEOUT_EXIT_CODE, group_alive
+
+
+def make_scene(folder, count=3, size=(64, 48)):
+    images = folder / "images"
+    images.mkdir(parents=True)
+    for index in range(count):
+        Image.new("RGB", size).save(str(images / "{0}.jpg".format(index)))
+    return folder
+
+
+def hanging_colmap(folder):
+    """
+    Stand-in for colmap that never finishes, with a child in its process group
+    """
+    path = folder / "colmap"
+    path.write_text("#!/bin/sh\nsleep 60 &\nsleep 60\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def pipeline_config(tmp_path, **options):
+    return PipelineConfig(str(make_scene(tmp_path / "scene")),
+                          output=str(tmp_path / "output"),
+                          run_colmap=True,
+                          colmap=hanging_colmap(tmp_path),
+                          no_admission=True,
+                          host_cache_ttl=0,
+                          log_file=str(tmp_path / "run.log"),
+                          **options)
+
+
+def test_cancel_stops_the_process_group(tmp_path):
+    config = pipeline_config(tmp_path)
+    executor = LocalExecutor()
+
+    async def cancel_first_stage():
+        task = asyncio.ensure_future(run_pipeline(config, executor))
+        for _ in range(200):
+            if executor.groups:
+                break
+            await asyncio.sleep(0.05)
+        group = next(iter(executor.groups))
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return group
+
+    group = asyncio.run(cancel_first_stage())
+    assert not group_alive(group)
+    assert not executor.groups
+    with open(str(tmp_path / "run_report.json")) as file:
+        assert '"status": "interrupted"' in file.read()
+
+
+def test_stage_timeout_returns_124(tmp_path):
+    config = pipeline_config(tmp_path, stage_timeout=["1"])
+    report = asyncio.run(run_pipeline(config))
+    assert report["status"] == "failed"
+    assert report["stages"][-1]["exit_code"] == TIMEOUT_EXIT_CODE
+    assert report["stages"][-1]["duration"] < 30
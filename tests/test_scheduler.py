@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from dpg.scheduler import resolve_dependencies, run_graph
+
+
+def stage(title, inputs=(), outputs=(), **fields):
+    return dict(title=title,
+                command=["true"],
+                inputs=list(inputs),
+                outputs=list(outputs),
+                **fields)
+
+
+def test_dependencies_follow_the_paths():
+    commands = [
+        stage("extract", ["/s/images"], ["/s/database.db"]),
+        stage("undistort", ["/s/images"], ["/s/dense"]),
+        stage("match", ["/s/database.db"], ["/s/database.db"]),
+        # Writes into a folder the undistorter produced
+        stage("densify", ["/s/dense/scene.mvs"], ["/s/dense/points.ply"]),
+        # Overwrites what undistort reads
+        stage("refresh", [], ["/s/images/new.jpg"]),
+        stage("report", depends=["extract"]),
+    ]
+    assert resolve_dependencies(commands) == [
+        set(), set(), {0}, {1}, {0, 1}, {0}
+    ]
+
+
+def test_undeclared_stages_are_barriers():
+    commands = [
+        stage("first", [], ["/a"]),
+        {"title": "barrier", "command": ["true"]},
+        stage("after", [], ["/b"]),
+    ]
+    assert resolve_dependencies(commands) == [set(), {0}, {1}]
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        resolve_dependencies([stage("a", depends=["missing"])])
+
+
+def test_run_graph_runs_independent_stages_together():
+    # Both branches have to be running at once to pass the barrier
+    both_running = threading.Barrier(2, timeout=10)
+    finished = []
+    lock = threading.Lock()
+
+    def run_stage(instruction):
+        if instruction["title"] in ("left", "right"):
+            both_running.wait()
+        with lock:
+            finished.append(instruction["title"])
+        return 0
+
+    commands = [
+        stage("left", [], ["/left"]),
+        stage("right", [], ["/right"]),
+        stage("join", ["/left", "/right"], ["/joined"]),
+        {"title": "barrier", "command": ["true"]},
+        stage("last", [], ["/last"]),
+    ]
+    assert run_graph(commands, run_stage, jobs=2) is None
+    assert sorted(finished[:2]) == ["left", "right"]
+    assert finished[2:] == ["join", "barrier", "last"]
+
+
+def test_run_graph_starts_nothing_after_a_failure():
+    started = []
+
+    def run_stage(instruction):
+        started.append(instruction["title"])
+        return 1 if instruction["title"] == "broken" else 0
+
+    commands = [
+        stage("broken", [], ["/a"]),
+        stage("uses", ["/a"], ["/b"]),
+        stage("unrelated", [], ["/c"]),
+    ]
+    failed = run_graph(commands, run_stage, jobs=1)
+    assert failed["title"] == "broken"
+    assert started == ["broken"]
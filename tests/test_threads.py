@@ -0,0 +1,59 @@
+from dpg.admission import AdmissionController, Reservation
+from dpg.threads import format_cores, place_cores, with_threads
+
+
+def test_place_cores_within_the_budget():
+    assert place_cores([], list(range(8))) == []
+    assert place_cores([2, 3], list(range(8))) == [[0, 1], [2, 3, 4]]
+    # More threads than cores: the blocks shrink in proportion, still disjoint
+    blocks = place_cores([4, 4, 4], list(range(8)))
+    assert blocks == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    blocks = place_cores([6, 1, 1], list(range(4)))
+    assert [len(block) for block in blocks] == [2, 1, 1]
+    assert sorted(sum(blocks, [])) == [0, 1, 2, 3]
+
+
+def test_place_cores_with_more_stages_than_cores():
+    # Every stage gets a core, the blocks wrap around
+    assert place_cores([1, 1, 1], [4, 5]) == [[4], [5], [4]]
+
+
+def test_place_cores_uses_the_given_cores():
+    assert place_cores([1, 2], [2, 3, 6, 7]) == [[2], [3, 6]]
+
+
+def test_assign_threads(tmp_path):
+    controller = AdmissionController(state_dir=str(tmp_path))
+    controller.cpu_budget = 8
+    estimate = {"mem": 0, "cpus": 8, "gpu_mem": 0}
+
+    def threads(tool, others):
+        reservation = Reservation(tool, tool, 0, estimate)
+        controller.assign_threads(reservation, [{
+            "cpus": cpus
+        } for cpus in others])
+        return reservation.threads, reservation.cpus
+
+    assert threads("mapper", []) == (8, 8)
+    # The free cores, or at least an even share of the budget
+    assert threads("mapper", [2]) == (6, 6)
+    assert threads("mapper", [8]) == (4, 4)
+    assert threads("mapper", [8, 8, 8]) == (2, 2)
+    assert threads("mapper", [8] * 10) == (1, 1)
+    # Single-threaded tools get one thread whatever is free
+    assert threads("model_converter", []) == (1, 1)
+
+
+def test_with_threads():
+    command = ["colmap", "mapper", "--database_path", "db"]
+    assert with_threads(command, "mapper", 3) == command + [
+        "--Mapper.num_threads", "3"
+    ]
+    given = command + ["--Mapper.num_threads=2"]
+    assert with_threads(given, "mapper", 3) == given
+    assert with_threads(["colmap", "model_converter"], "model_converter",
+                        3) == ["colmap", "model_converter"]
+
+
+def test_format_cores():
+    assert format_cores([3, 0, 1, 2, 8, 10, 11]) == "0-3,8,10-11"
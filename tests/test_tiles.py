@@ -0,0 +1,118 @@
+import numpy as np
+
+from dpg import tiles
+from dpg.tiles import map_vertices, merge_ply
+
+VERTEX = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                   ("red", "u1")])
+
+
+def write_ply(path, xyz, red):
+    vertices = np.zeros(len(xyz), dtype=VERTEX)
+    vertices["x"], vertices["y"], vertices["z"] = xyz.T
+    vertices["red"] = red
+    header = [
+        "ply", "format binary_little_endian 1.0", "comment tile",
+        "element vertex {0}".format(len(vertices)), "property float x",
+        "property float y", "property float z", "property uchar red",
+        "end_header"
+    ]
+    with open(str(path), "wb") as file:
+        file.write(("\n".join(header) + "\n").encode("ascii"))
+        vertices.tofile(file)
+    return str(path)
+
+
+def plane(columns, rows=101, step=0.01):
+    """
+    Points of the z=0 plane on a regular grid, columns given as x indices
+    """
+    x, y = np.meshgrid(np.asarray(columns) * step, np.arange(rows) * step)
+    return np.stack([x.ravel(), y.ravel(), np.zeros(x.size)], axis=1)
+
+
+def two_tiles(tmp_path):
+    # Both tiles fused the columns 100 to 150, as DensifyPointCloud does for
+    # views of one tile that see the surface of the other
+    first = write_ply(tmp_path / "tile_0.ply", plane(range(0, 151)), 1)
+    second = write_ply(tmp_path / "tile_1.ply", plane(range(100, 251)), 2)
+    return first, second
+
+
+def test_merge_drops_one_copy_of_the_overlap(tmp_path, monkeypatch):
+    # Several chunks per tile
+    monkeypatch.setattr(tiles, "CHUNK_VERTICES", 1000)
+    paths = two_tiles(tmp_path)
+    output = str(tmp_path / "merged.ply")
+    total, dropped = merge_ply(paths, output)
+    assert dropped == 51 * 101
+    assert total == 2 * 151 * 101 - dropped
+
+    merged = map_vertices(output)
+    assert len(merged) == total
+    columns = np.round(merged["x"] / np.float32(0.01)).astype(int)
+    # Every point of the scene once, the ones outside the overlap from their tile
+    assert sorted(set(columns.tolist())) == list(range(0, 251))
+    assert len(np.unique(np.stack([merged["x"], merged["y"]], axis=1),
+                         axis=0)) == total
+    assert (merged["red"][columns < 100] == 1).all()
+    assert (merged["red"][columns > 150] == 2).all()
+    with open(output, "rb") as file:
+        assert b"comment tile\n" in file.read(200)
+
+
+def test_keep_overlap_concatenates(tmp_path):
+    paths = two_tiles(tmp_path)
+    output = str(tmp_path / "merged.ply")
+    assert merge_ply(paths, output, keep_overlap=True) == (2 * 151 * 101, 0)
+    merged = map_vertices(output)
+    assert (merged["red"][:151 * 101] == 1).all()
+    assert (merged["red"][151 * 101:] == 2).all()
+
+
+def test_merge_with_an_empty_tile(tmp_path):
+    first = write_ply(tmp_path / "tile_0.ply", plane(range(0, 10)), 1)
+    empty = write_ply(tmp_path / "tile_1.ply", np.zeros((0, 3)), 2)
+    output = str(tmp_path / "merged.ply")
+    assert merge_ply([first, empty], output) == (10 * 101, 0)
+
+
+def test_plan_splits_the_neighbors_file(tmp_path):
+    # Views along a path, each one seeing the two views on both sides
+    lines = ["# view neighbors"]
+    for view in range(30):
+        neighbors = [
+            neighbor for neighbor in (view - 1, view + 1, view - 2, view + 2)
+            if 0 <= neighbor < 30
+        ]
+        lines.append(" ".join(map(str, [view] + neighbors)))
+    neighbors = tmp_path / "neighbors.txt"
+    neighbors.write_text("\n".join(lines) + "\n")
+    output = tmp_path / "tiles"
+    assert tiles.main([
+        "plan", "--neighbors",
+        str(neighbors), "--tiles", "3", "--output",
+        str(output)
+    ]) == 0
+
+    seen = []
+    for index in range(3):
+        tile_lines = (output / "tile_{0}".format(index) /
+                      "neighbors.txt").read_text().splitlines()
+        views = sorted(int(line.split()[0]) for line in tile_lines)
+        assert len(views) == 10
+        # Neighboring views end up in the same tile
+        assert views == list(range(views[0], views[0] + 10))
+        assert tile_lines == [lines[view + 1] for view in views]
+        seen += views
+    assert sorted(seen) == list(range(30))
+
+
+def test_plan_needs_a_view_per_tile(tmp_path):
+    neighbors = tmp_path / "neighbors.txt"
+    neighbors.write_text("0 1\n1 0\n")
+    assert tiles.main([
+        "plan", "--neighbors",
+        str(neighbors), "--tiles", "3", "--output",
+        str(tmp_path / "tiles")
+    ]) == 1
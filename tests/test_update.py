@@ -0,0 +1,68 @@
+import os, struct
+
+from dpg.update import main, match_pairs, new_images
+
+
+def write_images_bin(model_folder, names):
+    """
+    images.bin of a model registering some images, without 2D points
+    """
+    os.makedirs(str(model_folder))
+    with open(str(model_folder / "images.bin"), "wb") as file:
+        file.write(struct.pack("<Q", len(names)))
+        for image_id, name in enumerate(names, 1):
+            file.write(
+                struct.pack("<I4d3dI", image_id, 1, 0, 0, 0, 0, 0, 0, 1))
+            file.write(name.encode("utf-8") + b"\x00")
+            file.write(struct.pack("<Q", 0))
+
+
+def make_scene(tmp_path, names):
+    images = tmp_path / "images"
+    images.mkdir()
+    for name in names:
+        (images / name).write_bytes(b"")
+    return str(images)
+
+
+def test_new_images(tmp_path):
+    # c.jpg was dropped by the mapper, b.jpg and d.png were added since
+    images = make_scene(tmp_path,
+                        ["a.jpg", "b.jpg", "c.jpg", "d.png", "notes.txt"])
+    write_images_bin(tmp_path / "sparse" / "0", ["a.jpg"])
+    assert new_images(images, str(tmp_path / "sparse" / "0")) == [
+        "b.jpg", "c.jpg", "d.png"
+    ]
+
+
+def test_match_pairs():
+    pairs = match_pairs(["b.jpg", "d.png"],
+                        ["a.jpg", "b.jpg", "c.jpg", "d.png"])
+    assert pairs == [("b.jpg", "a.jpg"), ("b.jpg", "c.jpg"),
+                     ("b.jpg", "d.png"), ("d.png", "a.jpg"),
+                     ("d.png", "c.jpg")]
+
+
+def test_main_writes_the_lists(tmp_path):
+    images = make_scene(tmp_path, ["a.jpg", "b.jpg", "c.jpg"])
+    model = tmp_path / "sparse" / "0"
+    write_images_bin(model, ["a.jpg", "b.jpg"])
+    output = tmp_path / "update"
+    assert main(["--images", images, "--model",
+                 str(model), "--output",
+                 str(output)]) == 0
+    assert (output / "new_images.txt").read_text() == "c.jpg\n"
+    assert (output / "match_pairs.txt").read_text().splitlines() == [
+        "c.jpg a.jpg", "c.jpg b.jpg"
+    ]
+
+
+def test_main_without_new_images(tmp_path):
+    images = make_scene(tmp_path, ["a.jpg", "b.jpg"])
+    model = tmp_path / "sparse" / "0"
+    write_images_bin(model, ["a.jpg", "b.jpg"])
+    output = tmp_path / "update"
+    assert main(["--images", images, "--model",
+                 str(model), "--output",
+                 str(output)]) == 1
+    assert not output.exists()
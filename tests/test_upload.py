@@ -0,0 +1,92 @@
+import random, threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from dpg.upload import LogUploader, StandInHandler
+
+
+class LostAnswerHandler(StandInHandler):
+    """
+    Stores the first chunk but answers 503, as when the answer is lost on the way
+    """
+
+    def answer(self, status, offset=None):
+        if status == 204 and not self.server.answer_lost:
+            self.server.answer_lost = True
+            status = 503
+        super().answer(status, offset)
+
+
+@pytest.fixture
+def server(tmp_path):
+    servers = []
+
+    def start(handler=StandInHandler, fail_rate=0.0):
+        instance = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        instance.output = str(tmp_path / "received")
+        instance.fail_rate = fail_rate
+        instance.lock = threading.Lock()
+        instance.answer_lost = False
+        (tmp_path / "received").mkdir(exist_ok=True)
+        threading.Thread(target=instance.serve_forever, daemon=True).start()
+        servers.append(instance)
+        return "http://127.0.0.1:{0}/logs".format(instance.server_address[1])
+
+    yield start
+    for instance in servers:
+        instance.shutdown()
+        instance.server_close()
+
+
+def uploader(url, **options):
+    return LogUploader(url, interval=3600, chunk_size=100, backoff=0.0,
+                       **options)
+
+
+def log_lines(count, first=0):
+    return "".join("line {0}\n".format(index)
+                   for index in range(first, first + count)).encode()
+
+
+def test_growing_log_resumes_after_errors(tmp_path, server):
+    random.seed(1)
+    url = server(fail_rate=0.3)
+    log = tmp_path / "GraphEngine.log"
+    log.write_bytes(log_lines(100))
+    sender = uploader(url, retries=20)
+    assert sender.sync(str(log), "run.log") == len(log.read_bytes())
+    with open(str(log), "ab") as file:
+        file.write(log_lines(50, 100))
+    # Only what the server does not have yet
+    assert sender.sync(str(log), "run.log") == len(log_lines(50, 100))
+    sender.close(timeout=None)
+    assert (tmp_path / "received" /
+            "logs_run.log").read_bytes() == log.read_bytes()
+
+
+def test_chunk_that_landed_is_not_sent_twice(tmp_path, server):
+    url = server(LostAnswerHandler)
+    log = tmp_path / "GraphEngine.log"
+    log.write_bytes(log_lines(40))
+    sender = uploader(url)
+    # The retry of the first chunk gets a 409 with the offset of the server
+    sender.sync(str(log), "run.log")
+    sender.close(timeout=None)
+    assert (tmp_path / "received" /
+            "logs_run.log").read_bytes() == log.read_bytes()
+
+
+def test_final_files_wait_for_the_last_sync(tmp_path, server):
+    url = server()
+    report = tmp_path / "report.json"
+    sender = uploader(url)
+    sender.add(str(report), final=True)
+    report.write_text('{"status": "running"}')
+    sender.sync_all()
+    assert not (tmp_path / "received" / "logs_report.json").exists()
+    report.write_text('{"status": "succeeded"}')
+    sender.close(timeout=None)
+    assert (tmp_path / "received" /
+            "logs_report.json").read_text() == '{"status": "succeeded"}'
+